@@ -0,0 +1,248 @@
+import hashlib
+import threading
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+import diagnostics
+import utils
+
+# --- SPENDING ANALYTICS ---
+# Burn rates, month-to-date spend against the budget, a month-end projection,
+# per-category rolling averages and outlier transactions, computed from compact
+# per-user aggregates instead of the full ledger. The aggregates (daily totals,
+# daily totals per category, per-category count/sum/sum of squares and the
+# rows of the last few months) are kept in memory per process and only have the
+# rows added since the last refresh folded in. A change in the user's row count
+# or total that new rows don't explain (edits, deletes, a move to a tenant
+# file) rebuilds them from scratch.
+ANALYTICS_BURN_DAYS = 30          # trailing window for the daily burn rate
+ANALYTICS_WEEKS = 12              # trailing weeks for the weekly burn rate
+ANALYTICS_ROLLING_DAYS = 30       # window of the per-category rolling average
+ANALYTICS_HISTORY_DAYS = 90       # days shown in the rolling chart and scanned for outliers
+ANALYTICS_OUTLIER_Z = 3.0         # standard deviations above a category's mean
+ANALYTICS_OUTLIER_MIN_COUNT = 10  # categories with fewer rows aren't scored
+ANALYTICS_OUTLIER_LIMIT = 10
+
+# The advisor gets a short plain-text digest of the same aggregates instead of
+# the ledger itself. It is rebuilt only when its version changes: new rows,
+# goal activity, a budget or currency change, or a new day.
+ADVISOR_SUMMARY_TOKENS = 400      # budget for the digest; lines past it are dropped
+ADVISOR_CHARS_PER_TOKEN = 4       # rough estimate used to apply the budget
+ADVISOR_SUMMARY_CATEGORIES = 8
+ADVISOR_SUMMARY_GOALS = 5
+ADVISOR_SUMMARY_NOTABLE = 5
+
+# Each (path, user) refreshes under its own lock, so building one heavy
+# ledger's aggregates doesn't hold up anyone else; _lock only guards the dicts.
+_lock = threading.Lock()
+_state = {}
+_user_locks = {}
+
+def _user_lock(path, user):
+    with _lock:
+        return _user_locks.setdefault((path, user), threading.Lock())
+
+def _new_state():
+    return {"last_id": 0, "rows": 0, "total_cents": 0, "categories": {}, "outliers": None, "summary": None,
+            "daily": pd.Series(dtype=float, index=pd.DatetimeIndex([])),
+            "category_daily": pd.DataFrame(dtype=float, index=pd.DatetimeIndex([])),
+            "stats": pd.DataFrame({"count": [], "sum": [], "sumsq": []}, dtype=float),
+            "recent": pd.DataFrame({"id": pd.Series(dtype="int64"), "day": pd.Series(dtype="datetime64[ns]"),
+                                    "code": pd.Series(dtype="int32"), "amount": pd.Series(dtype=float)})}
+
+def _fold(state, new, today):
+    # `new` is a slice of the compact ledger (utils.load_ledger_rows): epoch days and integer cents.
+    days = pd.to_datetime(new["day"].astype("float64"), unit="D")
+    amount = new["amount_cents"] / 100
+    category = new["category"].astype(object).fillna("")
+    dated = days.notna()
+    d_days, d_amount, d_category = days[dated], amount[dated], category[dated]
+
+    state["daily"] = state["daily"].add(d_amount.groupby(d_days).sum(), fill_value=0.0)
+    per_category = d_amount.groupby([d_days, d_category]).sum().unstack(fill_value=0.0)
+    state["category_daily"] = state["category_daily"].add(per_category, fill_value=0.0).fillna(0.0)
+    stats = pd.DataFrame({"count": amount.groupby(category).size().astype(float),
+                          "sum": amount.groupby(category).sum(),
+                          "sumsq": (amount * amount).groupby(category).sum()})
+    state["stats"] = state["stats"].add(stats, fill_value=0.0)
+
+    # Recent rows keep their category as an integer code so scoring them is pure array arithmetic.
+    codes = state["categories"]
+    for name in d_category.unique():
+        codes.setdefault(name, len(codes))
+    cutoff = today - pd.Timedelta(days=ANALYTICS_HISTORY_DAYS)
+    recent = pd.DataFrame({"id": new["id"][dated], "day": d_days, "code": d_category.map(codes).astype("int32"), "amount": d_amount})
+    recent = recent[recent["day"] > cutoff]
+    if not recent.empty:
+        state["recent"] = pd.concat([state["recent"], recent], ignore_index=True)
+    state["last_id"] = int(new["id"].iloc[-1])
+    state["rows"] += len(new)
+    state["total_cents"] += int(new["amount_cents"].sum())
+
+def _refresh(user, path, today):
+    with _user_lock(path, user):
+        with _lock:
+            state = _state.get((path, user))
+        with utils.db_connection(path) as conn:
+            max_id, rows, total_cents = conn.execute('''SELECT (SELECT MAX(id) FROM expenses WHERE user_id = ?),
+                                                               SUM(count), SUM(total_cents) FROM expense_rollup WHERE user_id = ?''',
+                                                     (user, user)).fetchone()
+            max_id, rows, total_cents = max_id or 0, rows or 0, total_cents or 0
+            if state is None or max_id < state["last_id"]:
+                state = _new_state()
+            if max_id > state["last_id"]:
+                _fold(state, utils.load_ledger_rows(conn, user, state["last_id"]), today)
+            if state["rows"] != rows or state["total_cents"] != total_cents:
+                state = _new_state()
+                new = utils.load_ledger_rows(conn, user)
+                if not new.empty:
+                    _fold(state, new, today)
+        cutoff = today - pd.Timedelta(days=ANALYTICS_HISTORY_DAYS)
+        if not state["recent"].empty and state["recent"]["day"].iloc[0] <= cutoff:
+            state["recent"] = state["recent"][state["recent"]["day"] > cutoff].reset_index(drop=True)
+        with _lock:
+            _state[(path, user)] = state
+        return state
+
+def _outliers(state, conn):
+    stats = state["stats"][state["stats"]["count"] >= ANALYTICS_OUTLIER_MIN_COUNT]
+    recent = state["recent"]
+    empty = pd.DataFrame(columns=["id", "date", "category", "amount", "description", "zscore"])
+    if stats.empty or recent.empty:
+        return empty
+    names = list(state["categories"])
+    stats = stats.reindex(names)
+    mean = (stats["sum"] / stats["count"]).to_numpy()
+    std = np.sqrt(np.clip(stats["sumsq"].to_numpy() / stats["count"].to_numpy() - mean * mean, 0.0, None))
+    codes = recent["code"].to_numpy()
+    with np.errstate(divide="ignore", invalid="ignore"):
+        z = (recent["amount"].to_numpy() - mean[codes]) / std[codes]
+    mask = np.isfinite(z) & (z >= ANALYTICS_OUTLIER_Z)
+    if not mask.any():
+        return empty
+    hits = recent[mask].assign(zscore=z[mask]).nlargest(ANALYTICS_OUTLIER_LIMIT, "zscore")
+    hits["category"] = [names[c] for c in hits["code"]]
+    ids = [int(i) for i in hits["id"]]
+    descriptions = dict(conn.execute(f"SELECT id, description FROM expenses WHERE id IN ({', '.join('?' * len(ids))})", ids).fetchall())
+    return pd.DataFrame({"id": ids, "date": hits["day"].dt.strftime("%Y-%m-%d").to_numpy(), "category": hits["category"].to_numpy(),
+                         "amount": hits["amount"].to_numpy(), "description": [descriptions.get(i) for i in ids],
+                         "zscore": hits["zscore"].round(1).to_numpy()})
+
+@diagnostics.traced
+def get_snapshot(user=None, today=None):
+    # Everything the Dashboard and Reports pages show, as of `today` (default:
+    # the current date). Rows dated in the future are ignored by the windows.
+    user, path = utils.resolve_ledger(user)
+    return _snapshot(user, path, today)[0]
+
+def _snapshot(user, path, today):
+    # (snapshot, the aggregate state it was computed from).
+    today = pd.Timestamp(today or date.today()).normalize()
+    state = _refresh(user, path, today)
+    daily = state["daily"]
+
+    def window(series, days):
+        return series[(series.index > today - pd.Timedelta(days=days)) & (series.index <= today)]
+
+    daily_burn = window(daily, ANALYTICS_BURN_DAYS).sum() / ANALYTICS_BURN_DAYS
+    weekly = window(daily, 7 * ANALYTICS_WEEKS)
+    weekly = weekly.reindex(pd.date_range(today - pd.Timedelta(days=7 * ANALYTICS_WEEKS - 1), today), fill_value=0.0)
+    weekly = weekly.groupby(np.arange(len(weekly)) // 7).sum()
+    weekly.index = [today - pd.Timedelta(days=7 * (ANALYTICS_WEEKS - 1 - i) + 6) for i in weekly.index]
+
+    month_to_date = window(daily, today.day).sum()
+    projected = month_to_date + daily_burn * (today.days_in_month - today.day)
+    budget = utils.get_budget(user)
+
+    span = ANALYTICS_HISTORY_DAYS + ANALYTICS_ROLLING_DAYS
+    category_daily = state["category_daily"]
+    category_daily = category_daily[(category_daily.index > today - pd.Timedelta(days=span)) & (category_daily.index <= today)]
+    category_daily = category_daily.reindex(pd.date_range(today - pd.Timedelta(days=span - 1), today), fill_value=0.0)
+    rolling = category_daily.rolling(ANALYTICS_ROLLING_DAYS, min_periods=1).mean().iloc[-ANALYTICS_HISTORY_DAYS:]
+    rolling = rolling.loc[:, (rolling != 0).any()]
+
+    # Outliers only change when rows arrive or the day rolls over.
+    key = (state["last_id"], state["rows"], today)
+    if state["outliers"] is None or state["outliers"][0] != key:
+        with utils.db_connection(path) as conn:
+            state["outliers"] = (key, _outliers(state, conn))
+    outliers = state["outliers"][1]
+    return {"as_of": today.date(), "rows": state["rows"],
+            "daily_burn": float(daily_burn), "weekly_burn": float(weekly.mean()), "weekly_totals": weekly,
+            "month_to_date": float(month_to_date), "budget": budget,
+            "budget_used": float(month_to_date / budget) if budget else None,
+            "projected_month_end": float(projected), "projected_over_budget": float(projected - budget),
+            "category_rolling": rolling, "category_latest": rolling.iloc[-1] if not rolling.empty else pd.Series(dtype=float),
+            "outliers": outliers}, state
+
+def forget(user=None):
+    with _lock:
+        for key in [k for k in _state if user is None or k[1] == user]:
+            del _state[key]
+
+# --- ADVISOR SUMMARY ---
+def _goals_version(path, user):
+    with utils.db_connection(path) as conn:
+        return conn.execute('''SELECT (SELECT COUNT(*) FROM goals WHERE user_id = ?), (SELECT MAX(id) FROM goals WHERE user_id = ?),
+                                       (SELECT MAX(id) FROM goal_contributions WHERE user_id = ?)''', (user, user, user)).fetchone()
+
+def _summary_lines(snapshot, state, user, currency):
+    today = pd.Timestamp(snapshot["as_of"])
+    money = lambda v: f"{currency}{v:,.2f}"
+    lines = [f"Financial summary as of {today.date()} ({snapshot['rows']} transactions on record)."]
+    budget = snapshot["budget"]
+    if budget:
+        lines.append(f"This month: spent {money(snapshot['month_to_date'])} of a {money(budget)} budget "
+                     f"({snapshot['budget_used']:.0%}); projected month-end {money(snapshot['projected_month_end'])}.")
+    else:
+        lines.append(f"This month: spent {money(snapshot['month_to_date'])}, no budget set; "
+                     f"projected month-end {money(snapshot['projected_month_end'])}.")
+    lines.append(f"Burn rate: {money(snapshot['daily_burn'])}/day, {money(snapshot['weekly_burn'])}/week.")
+
+    category_daily = state["category_daily"]
+    month = category_daily[(category_daily.index >= today.replace(day=1)) & (category_daily.index <= today)].sum()
+    month = month[month != 0].sort_values(ascending=False)
+    if not month.empty:
+        top = ", ".join(f"{name} {money(value)}" for name, value in month.head(ADVISOR_SUMMARY_CATEGORIES).items())
+        lines.append(f"Top categories this month: {top}.")
+
+    goals = utils.get_goals(user)
+    if not goals.empty:
+        projections = utils.get_goal_projections(user)
+        lines.append("Goals:")
+        for goal in goals.head(ADVISOR_SUMMARY_GOALS).itertuples():
+            eta = projections["projected_date"].get(goal.id)
+            pace = f", on pace for {eta.date()}" if eta is not None and not pd.isna(eta) else ""
+            lines.append(f"- {goal.name}: {money(goal.current_amount)} of {money(goal.target_amount)}{pace}")
+
+    outliers = snapshot["outliers"]
+    if not outliers.empty:
+        lines.append("Unusually large transactions:")
+        for row in outliers.head(ADVISOR_SUMMARY_NOTABLE).itertuples():
+            lines.append(f"- {row.date} {row.category} {money(row.amount)} ({row.description})")
+    return lines
+
+@diagnostics.traced
+def get_advisor_summary(user=None, today=None):
+    # Returns {"version", "text", "tokens"}; the version changes whenever the
+    # text could, so it can key cached advisor replies.
+    user, path = utils.resolve_ledger(user)
+    snapshot, state = _snapshot(user, path, today)
+    currency = utils.get_currency(user)
+    key = (path, user, state["last_id"], state["rows"], state["total_cents"], _goals_version(path, user),
+           snapshot["budget"], currency, snapshot["as_of"])
+    with _user_lock(path, user):
+        if state["summary"] is None or state["summary"][0] != key:
+            budget = ADVISOR_SUMMARY_TOKENS * ADVISOR_CHARS_PER_TOKEN
+            kept = []
+            for line in _summary_lines(snapshot, state, user, currency):
+                budget -= len(line) + 1
+                if budget < 0:
+                    break
+                kept.append(line)
+            text = "\n".join(kept)
+            state["summary"] = (key, {"version": hashlib.sha1(repr(key).encode()).hexdigest()[:16], "text": text,
+                                      "tokens": -(-len(text) // ADVISOR_CHARS_PER_TOKEN)})
+        return state["summary"][1]
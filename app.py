@@ -1,496 +1,704 @@
-import streamlit as st
-import pandas as pd
-import utils
-from datetime import datetime
-import time
-import matplotlib.pyplot as plt
-
-# --- 1. PAGE CONFIGURATION ---
-st.set_page_config(
-    page_title="Onyx Capital",
-    page_icon="💎",
-    layout="wide",
-    initial_sidebar_state="expanded"
-)
-
-# --- 2. INITIALIZATION ---
-if "db_initialized" not in st.session_state:
-    utils.init_db()
-    st.session_state["db_initialized"] = True
-
-if "page" not in st.session_state: st.session_state.page = "landing"
-if "auth_status" not in st.session_state: st.session_state.auth_status = False
-if "username" not in st.session_state: st.session_state.username = ""
-if "nav_selection" not in st.session_state: st.session_state.nav_selection = "Dashboard"
-
-# Initialize Document Queue
-if "pending_docs" not in st.session_state: st.session_state.pending_docs = []
-if "review_mode" not in st.session_state: st.session_state.review_mode = False
-if "current_review_doc" not in st.session_state: st.session_state.current_review_doc = None
-if "extracted_data" not in st.session_state: st.session_state.extracted_data = {}
-
-# --- 3. GLOBAL PROFESSIONAL CSS ---
-st.markdown("""
-    <style>
-    @import url('https://fonts.googleapis.com/css2?family=Inter:wght@400;500;600;700;800&display=swap');
-    
-    * { font-family: 'Inter', sans-serif; -webkit-user-select: none; user-select: none; }
-    input, textarea { user-select: text !important; -webkit-user-select: text !important; }
-
-    /* HIDE 'PRESS ENTER TO APPLY' */
-    div[data-testid="InputInstructions"] { display: none !important; }
-
-    /* LOCK CURSOR ON DROPDOWNS (CURRENCY) */
-    div[data-testid="stSelectbox"] input {
-        cursor: pointer !important;
-        caret-color: transparent !important; /* Hides blinking text cursor */
-    }
-    div[data-testid="stSelectbox"] {
-        cursor: pointer !important;
-    }
-
-    [data-testid="stAppViewContainer"] { background-color: #050505 !important; color: #E0E0E0; }
-    header[data-testid="stHeader"] { background-color: transparent !important; }
-    div[data-testid="stDecoration"] { display: none; }
-    section[data-testid="stSidebar"] { background-color: #0B0C10; border-right: 1px solid #1F1F1F; }
-    
-    .sidebar-label { color: #666; font-size: 0.85rem; font-weight: 700; letter-spacing: 1.5px; margin-top: 40px; margin-bottom: 15px; padding-left: 14px; text-transform: uppercase; }
-    
-    div[role="radiogroup"] label { padding: 14px 16px; margin-bottom: 6px; border-radius: 8px; transition: all 0.2s ease; cursor: pointer !important; color: #999; border: 1px solid transparent; font-size: 16px; font-weight: 500; }
-    div[role="radiogroup"] label:hover { background-color: #151515; color: #FFF !important; }
-    div[role="radiogroup"] label[data-checked="true"] { background-color: #1A1A1A; color: #FFF !important; border-left: 4px solid #6366F1; font-weight: 700; }
-    
-    /* DOC CARDS & PROFILE CARDS */
-    .doc-card { background-color: #111; border: 1px solid #222; border-radius: 12px; padding: 20px; margin-bottom: 16px; display: flex; align-items: center; justify-content: space-between; }
-    .doc-icon-container { background-color: #1A1A1A; width: 48px; height: 48px; border-radius: 8px; display: flex; align-items: center; justify-content: center; font-size: 24px; margin-right: 20px; }
-    .doc-status-bar { background-color: #3A2E15; color: #F59E0B; padding: 6px 10px; border-radius: 6px; font-size: 0.75rem; margin-top: 8px; display: inline-flex; align-items: center; }
-    .mini-stat-card { background-color: #111; border: 1px solid #222; border-radius: 12px; padding: 16px 24px; display: flex; align-items: center; }
-    
-    /* PROFILE SPECIFIC */
-    .profile-header { background-color: #111; border: 1px solid #222; border-radius: 12px; padding: 30px; margin-bottom: 24px; display: flex; align-items: center; }
-    .profile-avatar { width: 80px; height: 80px; background: linear-gradient(135deg, #6366F1, #8B5CF6); border-radius: 50%; display: flex; align-items: center; justify-content: center; font-size: 36px; color: white; margin-right: 24px; font-weight: 700;}
-    
-    /* ANIMATION CONTAINER */
-    .onyx-bg-container { position: fixed; top: 0; left: 0; width: 100vw; height: 100vh; z-index: 0; overflow: hidden; pointer-events: none; background: #050505; }
-    .stock-graph-svg { position: absolute; top: 40%; left: 0; width: 200%; height: 60%; animation: slideGraph 20s linear infinite; opacity: 0.6; }
-    .graph-line { fill: none; stroke: #3f3f46; stroke-width: 2; vector-effect: non-scaling-stroke; }
-    .graph-glow { filter: drop-shadow(0 0 4px rgba(255, 255, 255, 0.2)); }
-    @keyframes slideGraph { 0% { transform: translateX(0); } 100% { transform: translateX(-50%); } }
-    
-    .hero-container { position: relative; z-index: 10; text-align: center; padding-top: 15vh; }
-    .hero-title { font-size: 6rem; font-weight: 900; color: #ffffff; letter-spacing: -3px; margin-bottom: 0; text-shadow: 0 10px 30px rgba(0,0,0,0.8); }
-    .hero-subtitle { font-size: 1.6rem; color: #a1a1aa; font-weight: 400; margin-top: 10px; }
-    </style>
-""", unsafe_allow_html=True)
-
-# =========================================================
-# HELPER FUNCTIONS
-# =========================================================
-
-def hide_sidebar():
-    st.markdown("""<style>section[data-testid="stSidebar"] {display: none !important;}</style>""", unsafe_allow_html=True)
-
-def render_sidebar():
-    with st.sidebar:
-        st.write("") 
-        c_logo, c_text = st.columns([1, 4])
-        with c_logo: st.markdown("<div style='font-size: 32px; line-height: 1;'>💎</div>", unsafe_allow_html=True)
-        with c_text: st.markdown("<h2 style='margin:0; padding-top: 5px; font-size:24px; font-weight:800; color:white; letter-spacing: -0.5px; line-height: 1;'>ONYX</h2>", unsafe_allow_html=True)
-        st.write(""); st.write("")
-        st.markdown('<p class="sidebar-label">PLATFORM</p>', unsafe_allow_html=True)
-        # Added "Profile" to the list below
-        nav = st.radio("Main Navigation", ["Dashboard", "Transactions", "Documents", "AI Advisor", "Goals", "Reports", "Profile"], label_visibility="collapsed", key="navigation_radio")
-        st.write(""); st.write(""); st.write(""); st.divider()
-        st.caption(f"User: **{st.session_state.username}**")
-        if st.button("Log Out", use_container_width=True):
-            st.session_state.auth_status = False; st.session_state.username = ""; st.session_state.page = "landing"; st.rerun()
-        return nav
-
-def render_custom_metric(label, value, extra_html=""):
-    html = f"""<div style="background-color: #111; border: 1px solid #222; border-radius: 12px; padding: 24px; height: 100%; box-shadow: 0 4px 10px rgba(0,0,0,0.2); display: flex; flex-direction: column; justify-content: space-between;">
-        <div style="color: #888; font-size: 14px; font-weight: 500; margin-bottom: 8px;">{label}</div>
-        <div style="color: #FFF; font-size: 28px; font-weight: 700;">{value}</div>
-        <div style="margin-top: 12px; display: flex; align-items: center;">{extra_html}</div></div>"""
-    st.markdown(html, unsafe_allow_html=True)
-
-def load_data():
-    df = utils.get_expenses_from_db()
-    total_spend = df["amount"].sum() if not df.empty else 0.0
-    return df, total_spend
-
-# =========================================================
-# VIEWS
-# =========================================================
-def show_landing():
-    hide_sidebar()
-    st.markdown("""
-        <div class="onyx-bg-container"><svg class="stock-graph-svg" viewBox="0 0 2000 400" preserveAspectRatio="none"><path class="graph-line graph-glow" d="M0,200 L50,150 L100,220 L100,350 M100,220 L150,180 L200,250 L250,150 L250,380 M250,150 L300,100 L350,160 L400,120 L400,300 M400,120 L450,180 L500,140 L550,220 L600,160 L600,350 M600,160 L650,100 L700,200 L750,150 L800,220 L800,380 M800,220 L850,180 L900,250 L950,200 L1000,200 L1050,150 L1100,220 L1100,350 M1100,220 L1150,180 L1200,250 L1250,150 L1250,380 M1250,150 L1300,100 L1350,160 L1400,120 L1400,300 M1400,120 L1450,180 L1500,140 L1550,220 L1600,160 L1600,350 M1600,160 L1650,100 L1700,200 L1750,150 L1800,220 L1800,380 M1800,220 L1850,180 L1900,250 L1950,200 L2000,200" /></svg></div>
-        <div class="hero-container"><h1 class="hero-title">ONYX CAPITAL.</h1><p class="hero-subtitle">The Enterprise Operating System for Personal Wealth.<br>AI-Driven. Private. Secure.</p></div>
-    """, unsafe_allow_html=True)
-    
-    st.write(""); st.write(""); c1, c2, c3 = st.columns([1, 0.5, 1])
-    with c2: 
-        if st.button("Access Dashboard", use_container_width=True): st.session_state.page = "auth"; st.rerun()
-
-def show_auth():
-    hide_sidebar()
-    st.markdown("<br><br>", unsafe_allow_html=True)
-    col1, col2, col3 = st.columns([1, 1, 1])
-    with col2:
-        st.markdown("<h2 style='text-align:center;'>Welcome Back</h2>", unsafe_allow_html=True)
-        st.write("")
-        auth_mode = st.tabs(["Sign In", "Register"])
-        with auth_mode[0]:
-            u = st.text_input("Username", key="login_u")
-            p = st.text_input("Password", type="password", key="login_p")
-            st.write("")
-            if st.button("Sign In", use_container_width=True):
-                if utils.verify_user(u, p): st.session_state.auth_status = True; st.session_state.username = u; st.session_state.page = "app"; st.rerun()
-                else: st.error("Invalid credentials.")
-        with auth_mode[1]:
-            new_u = st.text_input("Choose Username", key="signup_u"); new_p = st.text_input("Choose Password", type="password", key="signup_p"); st.write("")
-            if st.button("Create Account", use_container_width=True):
-                if utils.create_user(new_u, new_p): st.success("Account created.")
-                else: st.error("Username taken.")
-        st.markdown("---"); 
-        if st.button("← Back"): st.session_state.page = "landing"; st.rerun()
-
-def show_app():
-    nav = render_sidebar()
-    df, total_spend = load_data()
-    # LOAD SETTINGS DYNAMICALLY
-    budget = utils.get_budget()
-    currency = utils.get_currency()
-    
-    # --- DASHBOARD ---
-    if nav == "Dashboard":
-        st.title("Financial Overview")
-        
-        # EDIT BUDGET BUTTON
-        with st.expander(f"⚙️ Adjust Monthly Budget"):
-            new_budget = st.number_input(f"Set Budget Amount ({currency})", value=float(budget))
-            if st.button("Update Budget"):
-                utils.set_budget(new_budget)
-                st.success("Budget Updated!")
-                time.sleep(0.5)
-                st.rerun()
-
-        st.caption(f"Real-time Data • {datetime.now().strftime('%B %Y')}")
-        st.write("")
-        c1, c2, c3 = st.columns(3)
-        with c1: render_custom_metric("Monthly Budget", f"{currency}{budget:,.0f}", "<span style='color:#666; font-size:12px;'>Fixed Allocation</span>")
-        with c2: render_custom_metric("Total Spent", f"{currency}{total_spend:,.2f}", """<svg width="100" height="25" viewBox="0 0 100 25" style="margin-right:10px;"><path d="M0 20 L10 15 L20 18 L30 10 L40 12 L50 5 L60 15 L70 8 L80 18 L90 10 L100 15" fill="none" stroke="#4ADE80" stroke-width="2.5" stroke-linecap="round" stroke-linejoin="round"/></svg><span style='color:#4ADE80; font-weight:bold; font-size:12px;'>+ Volatility</span>""")
-        with c3: render_custom_metric("Remaining Capital", f"{currency}{budget - total_spend:,.2f}", "<span style='color:#6366F1; font-weight:bold; font-size:12px;'>90% Liquid</span>")
-        st.markdown("---")
-        c1, c2 = st.columns([2, 1])
-        with c1:
-            st.subheader("Capital Allocation")
-            if not df.empty:
-                cat_data = df.groupby("category")["amount"].sum()
-                fig, ax = plt.subplots(figsize=(5, 3))
-                fig.patch.set_facecolor('#050505'); fig.patch.set_alpha(0.0); ax.set_facecolor('#050505')
-                colors = ['#6366F1', '#10B981', '#F59E0B', '#EF4444']
-                wedges, texts, autotexts = ax.pie(cat_data, autopct='%1.1f%%', startangle=90, pctdistance=0.85, colors=colors[:len(cat_data)], textprops={'color':"white", 'fontsize': 9, 'weight':'bold'}, wedgeprops={'edgecolor': '#050505', 'linewidth': 3, 'width': 0.6})
-                ax.legend(wedges, cat_data.index, loc="center left", bbox_to_anchor=(1, 0, 0.5, 1), frameon=False, labelcolor="#E0E0E0")
-                st.pyplot(fig, use_container_width=True)
-            else: st.info("No data available.")
-        with c2:
-            st.subheader("Recent Activity")
-            if not df.empty: st.dataframe(df.sort_values("date", ascending=False).head(5), hide_index=True, use_container_width=True, column_config={"date": "Date", "amount": st.column_config.NumberColumn(f"{currency}", format=f"{currency}%.0f")})
-            else: st.caption("No recent transactions.")
-
-    # --- TRANSACTIONS ---
-    elif nav == "Transactions":
-        st.title("Transaction Ledger")
-        t1, t2 = st.tabs(["New Entry", "History Log"])
-        with t1:
-            c1, c2 = st.columns(2)
-            with c1:
-                st.info("📸 **AI Scan**")
-                up = st.file_uploader("Upload Receipt", type=["jpg", "png"], label_visibility="collapsed")
-                if up and st.button("Scan Receipt"):
-                    with st.spinner("Processing..."):
-                        d = utils.analyze_image_direct(up)
-                        st.session_state['ai_data'] = d
-                        if "warning" in d:
-                            st.warning(d['warning']) 
-                        else:
-                            st.success("Scanned!")
-                        st.rerun()
-            with c2:
-                st.info("✏️ **Details**")
-                val = st.session_state.get('ai_data', {})
-                date = st.date_input("Date", datetime.today())
-                cat = st.selectbox("Category", ["Food", "Transport", "Utilities", "Other"])
-                amt = st.number_input(f"Amount ({currency})", value=float(val.get('amount', 0.0)))
-                desc = st.text_input("Note", value=val.get('description', ''))
-                if st.button("Save Entry", type="primary"):
-                    utils.add_expense_to_db(str(date), cat, amt, desc)
-                    if 'ai_data' in st.session_state: del st.session_state['ai_data']
-                    st.success("Saved!")
-                    time.sleep(0.5)
-                    st.rerun()
-        with t2:
-            st.dataframe(df, use_container_width=True, column_config={"amount": st.column_config.NumberColumn(f"Amount ({currency})", format=f"{currency}%.2f")})
-            
-    # --- DOCUMENTS ---
-    elif nav == "Documents":
-        if st.session_state.review_mode and st.session_state.current_review_doc:
-            doc_file = st.session_state.current_review_doc
-            data = st.session_state.extracted_data
-            
-            st.markdown(f"### Reviewing: {doc_file.name}")
-            
-            if "warning" in data:
-                st.warning(f"⚠️ {data['warning']} - Please enter details manually.")
-            else:
-                st.info("AI Analysis Complete. Verify & Correct Details.")
-            
-            with st.container():
-                c_date = st.text_input("Date", value=data.get('date', datetime.today().strftime('%Y-%m-%d')))
-                c_cat = st.selectbox("Category", ["Food", "Transport", "Utilities", "Entertainment", "Investment", "Other"], 
-                                     index=["Food", "Transport", "Utilities", "Entertainment", "Investment", "Other"].index(data.get('category', 'Food')) if data.get('category') in ["Food", "Transport", "Utilities", "Entertainment", "Investment", "Other"] else 0)
-                c_amt = st.number_input(f"Amount ({currency})", value=float(data.get('amount', 0.0)))
-                c_desc = st.text_input("Description", value=data.get('description', ''))
-                
-                st.write("")
-                c1, c2 = st.columns(2)
-                with c1:
-                    if st.button("✅ Approve & Save", type="primary", use_container_width=True):
-                        utils.add_expense_to_db(c_date, c_cat, c_amt, c_desc)
-                        st.session_state.pending_docs.remove(doc_file)
-                        st.session_state.review_mode = False
-                        st.success("Saved!")
-                        st.rerun()
-                with c2:
-                    if st.button("❌ Cancel", use_container_width=True):
-                        st.session_state.review_mode = False
-                        st.rerun()
-        else:
-            st.title("Document Management")
-            st.write("Upload and review your financial documents.")
-            
-            c1, c2 = st.columns([1, 2])
-            with c1:
-                st.markdown(f"""
-                    <div class="mini-stat-card">
-                        <div style="font-size: 24px; margin-right: 16px;">📄</div>
-                        <div>
-                            <div style="color: #888; font-size: 14px; font-weight: 500;">Pending Review</div>
-                            <div style="color: #FFF; font-size: 24px; font-weight: 700;">{len(st.session_state.pending_docs)}</div>
-                        </div>
-                    </div>
-                """, unsafe_allow_html=True)
-            with c2:
-                with st.expander("📤 Upload Document", expanded=True):
-                     uploaded_file = st.file_uploader("Choose file", label_visibility="collapsed")
-                     if uploaded_file and st.button("Upload Queue", type="primary", use_container_width=True):
-                         st.session_state.pending_docs.append(uploaded_file)
-                         st.success("Added to queue")
-                         st.rerun()
-
-            st.divider()
-            st.subheader("Pending Review")
-            st.write("")
-
-            if not st.session_state.pending_docs:
-                st.info("No documents pending.")
-            else:
-                for idx, doc in enumerate(st.session_state.pending_docs):
-                    st.markdown(f"""
-                        <div class="doc-card">
-                            <div style="display: flex; align-items: flex-start;">
-                                <div class="doc-icon-container">📄</div>
-                                <div>
-                                    <div style="font-weight: 600; color: white; font-size: 1rem;">{doc.name}</div>
-                                    <div style="color: #888; font-size: 0.8rem; margin-top: 4px;">Size: {doc.size / 1024:.1f} KB</div>
-                                     <div class="doc-status-bar">
-                                        <span style="margin-right: 8px;">⏳</span> Awaiting AI Analysis
-                                    </div>
-                                </div>
-                            </div>
-                        </div>
-                    """, unsafe_allow_html=True)
-                    
-                    col_spacer, col_btn = st.columns([5, 1])
-                    with col_btn:
-                         st.markdown('<div style="margin-top: -75px; margin-bottom: 38px;">', unsafe_allow_html=True)
-                         if st.button("Review", key=f"rev_{idx}", use_container_width=True):
-                             with st.spinner("AI is analyzing image..."):
-                                 extracted = utils.analyze_image_direct(doc)
-                                 st.session_state.extracted_data = extracted
-                                 st.session_state.current_review_doc = doc
-                                 st.session_state.review_mode = True
-                                 st.rerun()
-                         st.markdown('</div>', unsafe_allow_html=True)
-
-    # --- AI ADVISOR ---
-    elif nav == "AI Advisor":
-        st.title("Onyx AI Advisory")
-        c1, c2 = st.columns([3, 1])
-        with c1:
-            personas = ["The Wealth Architect 🏛️ (Long-term Strategy)", "The Strategic Investor 📈 (Aggressive Growth)", "The Frugal Sage 🧘 (Smart Budgeting)", "The Tax Tactician 💼 (Tax Optimization)"]
-            guru = st.selectbox("Select Advisor Model", personas)
-        with c2: st.write(""); active = st.toggle("Activate AI", value=True)
-        st.divider()
-        chat_box = st.container(height=500)
-        with chat_box:
-            if "messages" not in st.session_state: st.session_state.messages = []
-            for m in st.session_state.messages:
-                with st.chat_message(m["role"]): st.markdown(m["content"])
-        if q := st.chat_input("Ask about your finances..."):
-            st.session_state.messages.append({"role": "user", "content": q})
-            with chat_box:
-                st.chat_message("user").markdown(q)
-                with st.chat_message("assistant"):
-                    with st.spinner("Thinking..."):
-                        ans = utils.get_chat_response(q, persona=guru, enable_guru=active)
-                        st.markdown(ans)
-            st.session_state.messages.append({"role": "assistant", "content": ans})
-            st.rerun()
-
-    # --- GOALS ---
-    elif nav == "Goals":
-        st.title("Financial Targets")
-        with st.expander("➕ Create Target"):
-            g_name = st.text_input("Goal Name"); g_target = st.number_input(f"Target Amount ({currency})", min_value=1.0)
-            if st.button("Create"): utils.add_goal(g_name, g_target); st.success("Created!"); st.rerun()
-        st.divider(); goals_df = utils.get_goals()
-        if not goals_df.empty:
-            for i, row in goals_df.iterrows():
-                with st.container():
-                    c1, c2 = st.columns([3, 1])
-                    with c1: st.subheader(row['name']); prog = min(row['current_amount'] / row['target_amount'], 1.0); st.progress(prog); st.caption(f"{currency}{row['current_amount']:,.0f} / {currency}{row['target_amount']:,.0f}")
-                    with c2:
-                        add_val = st.number_input("Add", key=f"add_{row['id']}", min_value=0.0, label_visibility="collapsed")
-                        if st.button("Fund", key=f"btn_{row['id']}"): utils.update_goal_progress(row['id'], add_val); st.rerun()
-                    st.markdown("---")
-        else: st.info("No active targets.")
-
-    # --- REPORTS ---
-    elif nav == "Reports":
-        st.title("Executive Reports")
-        if not df.empty:
-            st.download_button("📥 Download CSV Ledger", df.to_csv(index=False).encode('utf-8'), "onyx_ledger.csv", "text/csv", type="primary")
-            st.dataframe(df, use_container_width=True, column_config={"amount": st.column_config.NumberColumn(f"Amount ({currency})", format=f"{currency}%.2f")})
-        else: st.warning("No data found.")
-
-    # --- PROFILE (UPDATED WITH SETTINGS TAB) ---
-    elif nav == "Profile":
-        st.title("User Profile")
-        
-        # Profile Header Card (Common to both tabs)
-        st.markdown(f"""
-        <div class="profile-header">
-            <div class="profile-avatar">{st.session_state.username[0].upper()}</div>
-            <div class="profile-info">
-                <h2 style="margin:0; color:white;">{st.session_state.username}</h2>
-                <p style="margin:0; color:#888;">Onyx Premium Member</p>
-                <div style="margin-top:8px;">
-                    <span style="background:#10B981; color:#050505; padding:4px 8px; border-radius:4px; font-size:12px; font-weight:bold;">ACTIVE</span>
-                </div>
-            </div>
-        </div>
-        """, unsafe_allow_html=True)
-        
-        # TABBED INTERFACE FOR SETTINGS
-        tab1, tab2 = st.tabs(["My Profile", "Settings"])
-        
-        # TAB 1: OVERVIEW & BUDGET
-        with tab1:
-            st.subheader("Financial Configuration")
-            st.markdown("""
-            <div class="doc-card">
-                <div style="display: flex; align-items: center;">
-                    <div class="doc-icon-container" style="font-size: 20px;">💰</div>
-                    <div>
-                        <div style="font-weight: 600; color: white;">Monthly Budget</div>
-                        <div style="color: #666; font-size: 12px;">Base allocation limit</div>
-                    </div>
-                </div>
-            </div>
-            """, unsafe_allow_html=True)
-            
-            new_budget_profile = st.number_input(f"Update Budget ({currency})", value=float(budget), key="profile_budget")
-            if st.button("Save New Budget", key="save_profile_budget", type="primary"):
-                utils.set_budget(new_budget_profile)
-                st.success("Budget Saved")
-                time.sleep(0.5)
-                st.rerun()
-
-        # TAB 2: SETTINGS (NOTIFICATIONS + CURRENCY + SECURITY)
-        with tab2:
-            # 1. NOTIFICATION SECTION (TOP FULL WIDTH)
-            st.subheader("Notification Preferences")
-            st.markdown("""
-            <div class="doc-card">
-                <div style="display: flex; align-items: center;">
-                    <div class="doc-icon-container" style="font-size: 20px;">🔔</div>
-                    <div>
-                        <div style="font-weight: 600; color: white;">Alerts & Updates</div>
-                        <div style="color: #666; font-size: 12px;">Email & Push notifications</div>
-                    </div>
-                </div>
-            </div>
-            """, unsafe_allow_html=True)
-            st.toggle("Enable All Notifications", value=True)
-            
-            st.write(""); st.divider(); st.write("")
-
-            # 2. GLOBAL PREFS & SECURITY (BELOW, SIDE BY SIDE)
-            c1, c2 = st.columns(2)
-            
-            with c1:
-                st.subheader("Global Preferences")
-                st.info("Changing currency will update all dashboards.")
-                
-                currency_options = ["₹", "$", "€", "£", "¥", "Rp"]
-                current_curr_index = 0
-                if currency in currency_options:
-                    current_curr_index = currency_options.index(currency)
-                
-                new_currency = st.selectbox("Select Currency Symbol", currency_options, index=current_curr_index)
-                if new_currency != currency:
-                    utils.set_currency(new_currency)
-                    st.success(f"Currency updated to {new_currency}")
-                    time.sleep(0.5)
-                    st.rerun()
-
-            with c2:
-                st.subheader("Security Settings")
-                
-                with st.expander("Change Password"):
-                    p_new = st.text_input("New Password", type="password")
-                    p_confirm = st.text_input("Confirm New Password", type="password")
-                    if st.button("Update Password"):
-                        if p_new and p_new == p_confirm:
-                            if utils.update_credentials(st.session_state.username, p_new):
-                                st.success("Password Updated Successfully.")
-                            else:
-                                st.error("Update failed.")
-                        else:
-                            st.error("Passwords do not match.")
-                            
-                # ADDED: Change Username Section BELOW Password
-                st.write("") 
-                with st.expander("Change Username"):
-                    new_user_input = st.text_input("New Username")
-                    if st.button("Update Username"):
-                        if new_user_input:
-                            if utils.update_username(st.session_state.username, new_user_input):
-                                st.session_state.username = new_user_input
-                                st.success(f"Username updated to {new_user_input}")
-                                time.sleep(1)
-                                st.rerun()
-                            else:
-                                st.error("Username already taken.")
-
-
-# =========================================================
-# APP ROUTER
-# =========================================================
-if st.session_state.page == "landing": show_landing()
-elif st.session_state.page == "auth": show_auth()
-elif st.session_state.page == "app":
-    if st.session_state.auth_status: show_app()
+import streamlit as st
+from streamlit.errors import StreamlitAPIException
+import utils
+import diagnostics
+from datetime import datetime
+import time
+
+# --- 1. PAGE CONFIGURATION ---
+st.set_page_config(
+    page_title="Onyx Capital",
+    page_icon="💎",
+    layout="wide",
+    initial_sidebar_state="expanded"
+)
+
+# --- 2. INITIALIZATION ---
+utils.ensure_db()   # schema work happens once per process, not per session
+
+if "page" not in st.session_state: st.session_state.page = "landing"
+if "auth_status" not in st.session_state: st.session_state.auth_status = False
+if "username" not in st.session_state: st.session_state.username = ""
+if "nav_selection" not in st.session_state: st.session_state.nav_selection = "Dashboard"
+
+# Initialize Document Queue (the queue itself is persisted by utils; the session only tracks the open review)
+utils.start_document_worker()
+if "review_mode" not in st.session_state: st.session_state.review_mode = False
+if "review_job" not in st.session_state: st.session_state.review_job = None
+if "extracted_data" not in st.session_state: st.session_state.extracted_data = {}
+
+# --- 3. GLOBAL PROFESSIONAL CSS ---
+st.markdown("""
+    <style>
+    @import url('https://fonts.googleapis.com/css2?family=Inter:wght@400;500;600;700;800&display=swap');
+    
+    * { font-family: 'Inter', sans-serif; -webkit-user-select: none; user-select: none; }
+    input, textarea { user-select: text !important; -webkit-user-select: text !important; }
+
+    /* HIDE 'PRESS ENTER TO APPLY' */
+    div[data-testid="InputInstructions"] { display: none !important; }
+
+    /* LOCK CURSOR ON DROPDOWNS (CURRENCY) */
+    div[data-testid="stSelectbox"] input {
+        cursor: pointer !important;
+        caret-color: transparent !important; /* Hides blinking text cursor */
+    }
+    div[data-testid="stSelectbox"] {
+        cursor: pointer !important;
+    }
+
+    [data-testid="stAppViewContainer"] { background-color: #050505 !important; color: #E0E0E0; }
+    header[data-testid="stHeader"] { background-color: transparent !important; }
+    div[data-testid="stDecoration"] { display: none; }
+    section[data-testid="stSidebar"] { background-color: #0B0C10; border-right: 1px solid #1F1F1F; }
+    
+    .sidebar-label { color: #666; font-size: 0.85rem; font-weight: 700; letter-spacing: 1.5px; margin-top: 40px; margin-bottom: 15px; padding-left: 14px; text-transform: uppercase; }
+    
+    div[role="radiogroup"] label { padding: 14px 16px; margin-bottom: 6px; border-radius: 8px; transition: all 0.2s ease; cursor: pointer !important; color: #999; border: 1px solid transparent; font-size: 16px; font-weight: 500; }
+    div[role="radiogroup"] label:hover { background-color: #151515; color: #FFF !important; }
+    div[role="radiogroup"] label[data-checked="true"] { background-color: #1A1A1A; color: #FFF !important; border-left: 4px solid #6366F1; font-weight: 700; }
+    
+    /* DOC CARDS & PROFILE CARDS */
+    .doc-card { background-color: #111; border: 1px solid #222; border-radius: 12px; padding: 20px; margin-bottom: 16px; display: flex; align-items: center; justify-content: space-between; }
+    .doc-icon-container { background-color: #1A1A1A; width: 48px; height: 48px; border-radius: 8px; display: flex; align-items: center; justify-content: center; font-size: 24px; margin-right: 20px; }
+    .doc-status-bar { background-color: #3A2E15; color: #F59E0B; padding: 6px 10px; border-radius: 6px; font-size: 0.75rem; margin-top: 8px; display: inline-flex; align-items: center; }
+    .mini-stat-card { background-color: #111; border: 1px solid #222; border-radius: 12px; padding: 16px 24px; display: flex; align-items: center; }
+    
+    /* PROFILE SPECIFIC */
+    .profile-header { background-color: #111; border: 1px solid #222; border-radius: 12px; padding: 30px; margin-bottom: 24px; display: flex; align-items: center; }
+    .profile-avatar { width: 80px; height: 80px; background: linear-gradient(135deg, #6366F1, #8B5CF6); border-radius: 50%; display: flex; align-items: center; justify-content: center; font-size: 36px; color: white; margin-right: 24px; font-weight: 700;}
+    
+    /* ANIMATION CONTAINER */
+    .onyx-bg-container { position: fixed; top: 0; left: 0; width: 100vw; height: 100vh; z-index: 0; overflow: hidden; pointer-events: none; background: #050505; }
+    .stock-graph-svg { position: absolute; top: 40%; left: 0; width: 200%; height: 60%; animation: slideGraph 20s linear infinite; opacity: 0.6; }
+    .graph-line { fill: none; stroke: #3f3f46; stroke-width: 2; vector-effect: non-scaling-stroke; }
+    .graph-glow { filter: drop-shadow(0 0 4px rgba(255, 255, 255, 0.2)); }
+    @keyframes slideGraph { 0% { transform: translateX(0); } 100% { transform: translateX(-50%); } }
+    
+    .hero-container { position: relative; z-index: 10; text-align: center; padding-top: 15vh; }
+    .hero-title { font-size: 6rem; font-weight: 900; color: #ffffff; letter-spacing: -3px; margin-bottom: 0; text-shadow: 0 10px 30px rgba(0,0,0,0.8); }
+    .hero-subtitle { font-size: 1.6rem; color: #a1a1aa; font-weight: 400; margin-top: 10px; }
+    </style>
+""", unsafe_allow_html=True)
+
+# =========================================================
+# HELPER FUNCTIONS
+# =========================================================
+
+def hide_sidebar():
+    st.markdown("""<style>section[data-testid="stSidebar"] {display: none !important;}</style>""", unsafe_allow_html=True)
+
+def render_sidebar():
+    with st.sidebar:
+        st.write("") 
+        c_logo, c_text = st.columns([1, 4])
+        with c_logo: st.markdown("<div style='font-size: 32px; line-height: 1;'>💎</div>", unsafe_allow_html=True)
+        with c_text: st.markdown("<h2 style='margin:0; padding-top: 5px; font-size:24px; font-weight:800; color:white; letter-spacing: -0.5px; line-height: 1;'>ONYX</h2>", unsafe_allow_html=True)
+        st.write(""); st.write("")
+        st.markdown('<p class="sidebar-label">PLATFORM</p>', unsafe_allow_html=True)
+        # Added "Profile" to the list below
+        nav = st.radio("Main Navigation", ["Dashboard", "Transactions", "Documents", "AI Advisor", "Goals", "Reports", "Profile"], label_visibility="collapsed", key="navigation_radio")
+        st.write(""); st.write(""); st.write(""); st.divider()
+        st.caption(f"User: **{st.session_state.username}**")
+        if st.button("Log Out", use_container_width=True):
+            st.session_state.auth_status = False; st.session_state.username = ""; st.session_state.page = "landing"; st.rerun()
+        return nav
+
+def rerun_fragment():
+    # Redraws just the calling fragment. A fragment that ran as part of a full
+    # page run can't rerun on its own, so that case reruns the page.
+    try: st.rerun(scope="fragment")
+    except StreamlitAPIException: st.rerun()
+
+def render_custom_metric(label, value, extra_html=""):
+    html = f"""<div style="background-color: #111; border: 1px solid #222; border-radius: 12px; padding: 24px; height: 100%; box-shadow: 0 4px 10px rgba(0,0,0,0.2); display: flex; flex-direction: column; justify-content: space-between;">
+        <div style="color: #888; font-size: 14px; font-weight: 500; margin-bottom: 8px;">{label}</div>
+        <div style="color: #FFF; font-size: 28px; font-weight: 700;">{value}</div>
+        <div style="margin-top: 12px; display: flex; align-items: center;">{extra_html}</div></div>"""
+    st.markdown(html, unsafe_allow_html=True)
+
+def render_ledger(key, currency):
+    # Paged ledger view: only the current page is fetched and sent to the browser.
+    f1, f2, f3 = st.columns([2, 2, 1])
+    with f1: dates = st.date_input("Date range", value=(), key=f"{key}_dates")
+    with f2: cat = st.selectbox("Category", ["All"] + utils.get_categories(), key=f"{key}_cat")
+    with f3: page_size = st.selectbox("Rows per page", [25, 50, 100, 250], index=1, key=f"{key}_size")
+    start = dates[0] if len(dates) > 0 else None
+    end = dates[1] if len(dates) > 1 else start
+    category = None if cat == "All" else cat
+
+    # Cursor stack: entry i is the cursor that opens page i + 1. Reset whenever the filters change.
+    filters = (start, end, category, page_size)
+    if st.session_state.get(f"{key}_filters") != filters:
+        st.session_state[f"{key}_filters"] = filters
+        st.session_state[f"{key}_cursors"] = [None]
+    cursors = st.session_state[f"{key}_cursors"]
+
+    page, next_cursor = utils.get_expenses_page(cursors[-1], page_size, start, end, category)
+    total = utils.count_expenses(start, end, category)
+    st.dataframe(page, use_container_width=True, hide_index=True, column_config={"amount": st.column_config.NumberColumn(f"Amount ({currency})", format=f"{currency}%.2f")})
+
+    p1, p2, p3 = st.columns([1, 4, 1])
+    with p1:
+        if st.button("← Previous", key=f"{key}_prev", disabled=len(cursors) == 1, use_container_width=True):
+            cursors.pop(); st.rerun()
+    with p2: st.caption(f"Page {len(cursors)} of {max(1, -(-total // page_size))} • {total:,} entries")
+    with p3:
+        if st.button("Next →", key=f"{key}_next", disabled=next_cursor is None, use_container_width=True):
+            cursors.append(next_cursor); st.rerun()
+    return (start, end, category), total
+
+# =========================================================
+# VIEWS
+# =========================================================
+def show_landing():
+    hide_sidebar()
+    st.markdown("""
+        <div class="onyx-bg-container"><svg class="stock-graph-svg" viewBox="0 0 2000 400" preserveAspectRatio="none"><path class="graph-line graph-glow" d="M0,200 L50,150 L100,220 L100,350 M100,220 L150,180 L200,250 L250,150 L250,380 M250,150 L300,100 L350,160 L400,120 L400,300 M400,120 L450,180 L500,140 L550,220 L600,160 L600,350 M600,160 L650,100 L700,200 L750,150 L800,220 L800,380 M800,220 L850,180 L900,250 L950,200 L1000,200 L1050,150 L1100,220 L1100,350 M1100,220 L1150,180 L1200,250 L1250,150 L1250,380 M1250,150 L1300,100 L1350,160 L1400,120 L1400,300 M1400,120 L1450,180 L1500,140 L1550,220 L1600,160 L1600,350 M1600,160 L1650,100 L1700,200 L1750,150 L1800,220 L1800,380 M1800,220 L1850,180 L1900,250 L1950,200 L2000,200" /></svg></div>
+        <div class="hero-container"><h1 class="hero-title">ONYX CAPITAL.</h1><p class="hero-subtitle">The Enterprise Operating System for Personal Wealth.<br>AI-Driven. Private. Secure.</p></div>
+    """, unsafe_allow_html=True)
+    
+    st.write(""); st.write(""); c1, c2, c3 = st.columns([1, 0.5, 1])
+    with c2: 
+        if st.button("Access Dashboard", use_container_width=True): st.session_state.page = "auth"; st.rerun()
+
+def show_auth():
+    hide_sidebar()
+    st.markdown("<br><br>", unsafe_allow_html=True)
+    col1, col2, col3 = st.columns([1, 1, 1])
+    with col2:
+        st.markdown("<h2 style='text-align:center;'>Welcome Back</h2>", unsafe_allow_html=True)
+        st.write("")
+        auth_mode = st.tabs(["Sign In", "Register"])
+        with auth_mode[0]:
+            u = st.text_input("Username", key="login_u")
+            p = st.text_input("Password", type="password", key="login_p")
+            st.write("")
+            if st.button("Sign In", use_container_width=True):
+                if utils.verify_user(u, p): st.session_state.auth_status = True; st.session_state.username = u; st.session_state.page = "app"; st.rerun()
+                else: st.error("Invalid credentials.")
+        with auth_mode[1]:
+            new_u = st.text_input("Choose Username", key="signup_u"); new_p = st.text_input("Choose Password", type="password", key="signup_p"); st.write("")
+            if st.button("Create Account", use_container_width=True):
+                if utils.create_user(new_u, new_p): st.success("Account created.")
+                else: st.error("Username taken.")
+        st.markdown("---"); 
+        if st.button("← Back"): st.session_state.page = "landing"; st.rerun()
+
+# --- DASHBOARD ---
+@diagnostics.fragment
+def budget_editor(budget, currency):
+    with st.expander(f"⚙️ Adjust Monthly Budget"):
+        new_budget = st.number_input(f"Set Budget Amount ({currency})", value=float(budget))
+        if st.button("Update Budget"):
+            utils.set_budget(new_budget)
+            st.success("Budget Updated!")
+            time.sleep(0.5)
+            st.rerun()  # the metrics below depend on the budget
+
+def page_dashboard():
+    budget = utils.get_budget()
+    currency = utils.get_currency()
+    st.title("Financial Overview")
+
+    # EDIT BUDGET BUTTON
+    budget_editor(budget, currency)
+
+    st.caption(f"Real-time Data • {datetime.now().strftime('%B %Y')}")
+    st.write("")
+    month_spend = utils.get_month_spend()
+    c1, c2, c3 = st.columns(3)
+    with c1: render_custom_metric("Monthly Budget", f"{currency}{budget:,.0f}", "<span style='color:#666; font-size:12px;'>Fixed Allocation</span>")
+    with c2: render_custom_metric("Total Spent", f"{currency}{month_spend:,.2f}", """<svg width="100" height="25" viewBox="0 0 100 25" style="margin-right:10px;"><path d="M0 20 L10 15 L20 18 L30 10 L40 12 L50 5 L60 15 L70 8 L80 18 L90 10 L100 15" fill="none" stroke="#4ADE80" stroke-width="2.5" stroke-linecap="round" stroke-linejoin="round"/></svg><span style='color:#4ADE80; font-weight:bold; font-size:12px;'>+ Volatility</span>""")
+    with c3: render_custom_metric("Remaining Capital", f"{currency}{budget - month_spend:,.2f}", "<span style='color:#6366F1; font-weight:bold; font-size:12px;'>90% Liquid</span>")
+    st.write("")
+    snapshot = analytics.get_snapshot()
+    over = snapshot["projected_over_budget"]
+    c1, c2, c3 = st.columns(3)
+    with c1: render_custom_metric("Daily Burn", f"{currency}{snapshot['daily_burn']:,.2f}", f"<span style='color:#666; font-size:12px;'>Last {analytics.ANALYTICS_BURN_DAYS} days</span>")
+    with c2: render_custom_metric("Weekly Burn", f"{currency}{snapshot['weekly_burn']:,.2f}", f"<span style='color:#666; font-size:12px;'>Last {analytics.ANALYTICS_WEEKS} weeks</span>")
+    with c3: render_custom_metric("Projected Month-End", f"{currency}{snapshot['projected_month_end']:,.2f}", f"<span style='color:{'#EF4444' if over > 0 else '#4ADE80'}; font-weight:bold; font-size:12px;'>{currency}{abs(over):,.0f} {'over' if over > 0 else 'under'} budget</span>")
+    st.markdown("---")
+    c1, c2 = st.columns([2, 1])
+    with c1:
+        st.subheader("Capital Allocation")
+        cat_data = utils.get_category_totals()
+        if not cat_data.empty:
+            st.image(charts.allocation_chart(cat_data), use_container_width=True)
+        else: st.info("No data available.")
+    with c2:
+        st.subheader("Recent Activity")
+        recent = utils.get_recent_expenses(5)
+        if not recent.empty: st.dataframe(recent, hide_index=True, use_container_width=True, column_config={"date": "Date", "amount": st.column_config.NumberColumn(f"{currency}", format=f"{currency}%.0f")})
+        else: st.caption("No recent transactions.")
+
+# --- TRANSACTIONS ---
+def page_transactions():
+    currency = utils.get_currency()
+    st.title("Transaction Ledger")
+    t1, t2, t3 = st.tabs(["New Entry", "History Log", "Bulk Import"])
+    with t1:
+        c1, c2 = st.columns(2)
+        with c1:
+            st.info("📸 **AI Scan**")
+            up = st.file_uploader("Upload Receipt", type=["jpg", "png"], label_visibility="collapsed")
+            if up and st.button("Scan Receipt"):
+                with st.spinner("Processing..."):
+                    d = utils.analyze_image_direct(up)
+                    st.session_state['ai_data'] = d
+                    if "warning" in d:
+                        st.warning(d['warning']) 
+                    else:
+                        st.success("Scanned!")
+                    st.rerun()
+        with c2:
+            st.info("✏️ **Details**")
+            val = st.session_state.get('ai_data', {})
+            date = st.date_input("Date", datetime.today())
+            cat = st.selectbox("Category", ["Food", "Transport", "Utilities", "Other"])
+            amt = st.number_input(f"Amount ({currency})", value=float(val.get('amount', 0.0)))
+            desc = st.text_input("Note", value=val.get('description', ''))
+            if st.button("Save Entry", type="primary"):
+                utils.add_expense_to_db(str(date), cat, amt, desc)
+                if 'ai_data' in st.session_state: del st.session_state['ai_data']
+                st.success("Saved!")
+                time.sleep(0.5)
+                st.rerun()
+    with t2:
+        render_ledger("history", currency)
+    with t3:
+        st.info("🏦 **Import bank statements or CSV ledgers** (CSV, OFX, QFX)")
+        imp = st.file_uploader("Statement File", type=["csv", "ofx", "qfx"], key="import_file")
+        if imp:
+            is_ofx = imp.name.lower().endswith((".ofx", ".qfx"))
+            mapping = None
+            if not is_ofx:
+                headers = utils.read_import_headers(imp)
+                guess = utils.guess_import_mapping(headers)
+                options = ["—"] + headers
+                cols = st.columns(4)
+                mapping = {}
+                for col, field in zip(cols, ["date", "amount", "category", "description"]):
+                    with col:
+                        choice = st.selectbox(f"{field.title()} column", options, index=options.index(guess[field]) if guess[field] else 0, key=f"import_map_{field}")
+                        mapping[field] = None if choice == "—" else choice
+            i1, i2 = st.columns(2)
+            with i1: default_cat = st.selectbox("Default Category", ["Other", "Food", "Transport", "Utilities", "Entertainment", "Investment"], key="import_cat")
+            with i2:
+                st.write("")
+                negative = st.checkbox("Spending shown as negative amounts", value=is_ofx, disabled=is_ofx, key="import_negative")
+            if st.button("Import Statement", type="primary"):
+                progress = st.progress(0.0, text="Importing...")
+                est_rows = max(imp.size // 60, 1)  # rough row count for the bar, ~60 bytes per statement line
+                def on_progress(read, inserted):
+                    progress.progress(min(read / est_rows, 1.0), text=f"Read {read:,} rows • {inserted:,} new")
+                try:
+                    report = utils.import_expenses(imp, mapping=mapping, default_category=default_cat, debits_negative=negative, on_progress=on_progress)
+                except ValueError as e:
+                    st.error(f"Import failed: {e}")
+                else:
+                    progress.progress(1.0, text="Done")
+                    st.success(f"Imported {report['inserted']:,} of {report['read']:,} rows • {report['duplicates']:,} duplicates skipped • {report['rejected']:,} rejected")
+                    if report["rejects"]:
+                        st.dataframe(pd.DataFrame(report["rejects"], columns=["Line", "Reason"]), hide_index=True, use_container_width=True)
+
+# --- DOCUMENTS ---
+@diagnostics.fragment
+def document_review(review_job, data, currency):
+    # Editing the fields reruns only this form; Approve and Cancel leave review mode.
+    c_date = st.text_input("Date", value=data.get('date', datetime.today().strftime('%Y-%m-%d')))
+    c_cat = st.selectbox("Category", ["Food", "Transport", "Utilities", "Entertainment", "Investment", "Other"], 
+                         index=["Food", "Transport", "Utilities", "Entertainment", "Investment", "Other"].index(data.get('category', 'Food')) if data.get('category') in ["Food", "Transport", "Utilities", "Entertainment", "Investment", "Other"] else 0)
+    c_amt = st.number_input(f"Amount ({currency})", value=float(data.get('amount', 0.0)))
+    c_desc = st.text_input("Description", value=data.get('description', ''))
+
+    st.write("")
+    c1, c2 = st.columns(2)
+    with c1:
+        if st.button("✅ Approve & Save", type="primary", use_container_width=True):
+            try:
+                utils.add_expense_to_db(c_date, c_cat, c_amt, c_desc)
+            except ValueError:
+                st.error("Couldn't read that date. Use YYYY-MM-DD.")
+            else:
+                utils.remove_document_job(review_job["id"])
+                st.session_state.review_mode = False; st.session_state.review_job = None
+                st.success("Saved!")
+                st.rerun()
+    with c2:
+        if st.button("❌ Cancel", use_container_width=True):
+            st.session_state.review_mode = False
+            st.rerun()
+
+def page_documents():
+    currency = utils.get_currency()
+    review_job = utils.get_document_job(st.session_state.review_job) if st.session_state.review_mode and st.session_state.review_job else None
+    if review_job:
+        data = st.session_state.extracted_data
+
+        st.markdown(f"### Reviewing: {review_job['name']}")
+
+        if "warning" in data:
+            st.warning(f"⚠️ {data['warning']} - Please enter details manually.")
+        else:
+            st.info("AI Analysis Complete. Verify & Correct Details.")
+
+        document_review(review_job, data, currency)
+    else:
+        st.title("Document Management")
+        st.write("Upload and review your financial documents.")
+        # Queued documents live in the on-disk spool; the session only ever sees job rows.
+        jobs = utils.get_document_jobs()
+
+        c1, c2 = st.columns([1, 2])
+        with c1:
+            st.markdown(f"""
+                <div class="mini-stat-card">
+                    <div style="font-size: 24px; margin-right: 16px;">📄</div>
+                    <div>
+                        <div style="color: #888; font-size: 14px; font-weight: 500;">Pending Review</div>
+                        <div style="color: #FFF; font-size: 24px; font-weight: 700;">{len(jobs)}</div>
+                    </div>
+                </div>
+            """, unsafe_allow_html=True)
+        with c2:
+            with st.expander("📤 Upload Document", expanded=True):
+                 uploaded_file = st.file_uploader("Choose file", label_visibility="collapsed")
+                 if uploaded_file and st.button("Upload Queue", type="primary", use_container_width=True):
+                     utils.enqueue_document(uploaded_file)
+                     st.success("Added to queue")
+                     st.rerun()
+
+        st.divider()
+        st.subheader("Pending Review")
+        st.write("")
+
+        if not jobs:
+            st.info("No documents pending.")
+        else:
+            in_flight = sum(1 for j in jobs if j["status"] in ("queued", "running"))
+            failed = sum(1 for j in jobs if j["status"] == "failed")
+            s1, s2, s3 = st.columns([3, 1, 1])
+            with s1: st.caption(f"AI analysis runs in the background • {in_flight} in progress" if in_flight else "All documents analyzed.")
+            with s2:
+                if in_flight and st.button("🔄 Refresh", use_container_width=True): st.rerun()
+            with s3:
+                if failed and st.button(f"⚡ Retry failed ({failed})", use_container_width=True): utils.retry_document_jobs(); st.rerun()
+
+            labels = {"done": ("✅", "Analysis Ready"), "running": ("⏳", "Analyzing..."), "queued": ("⏳", "Queued for AI Analysis"), "failed": ("⚠️", "Needs Manual Entry")}
+            for job in jobs:
+                icon, label = labels[job["status"]]
+                status = f"<span style=\"margin-right: 8px;\">{icon}</span> {label}"
+                st.markdown(f"""
+                    <div class="doc-card">
+                        <div style="display: flex; align-items: flex-start;">
+                            <div class="doc-icon-container">📄</div>
+                            <div>
+                                <div style="font-weight: 600; color: white; font-size: 1rem;">{job['name']}</div>
+                                <div style="color: #888; font-size: 0.8rem; margin-top: 4px;">Size: {job['size'] / 1024:.1f} KB</div>
+                                 <div class="doc-status-bar">
+                                    {status}
+                                </div>
+                            </div>
+                        </div>
+                    </div>
+                """, unsafe_allow_html=True)
+
+                col_spacer, col_btn = st.columns([5, 1])
+                with col_btn:
+                     st.markdown('<div style="margin-top: -75px; margin-bottom: 38px;">', unsafe_allow_html=True)
+                     if st.button("Review", key=f"rev_{job['id']}", use_container_width=True):
+                         if job["result"] is None:
+                             # Not reached by the worker yet: analyze it now.
+                             with st.spinner("AI is analyzing image..."):
+                                 utils.process_document_job(job["id"])
+                                 job = utils.get_document_job(job["id"])
+                         st.session_state.extracted_data = job["result"]
+                         st.session_state.review_job = job["id"]
+                         st.session_state.review_mode = True
+                         st.rerun()
+                     st.markdown('</div>', unsafe_allow_html=True)
+
+# --- AI ADVISOR ---
+@diagnostics.fragment
+def advisor_chat(guru, active):
+    # Sending a message or loading older ones reruns only the conversation. Only
+    # the newest window of the stored conversation is rendered.
+    if "chat_window" not in st.session_state: st.session_state.chat_window = utils.CHAT_WINDOW
+    history = utils.get_chat_messages(limit=st.session_state.chat_window + 1)
+    chat_box = st.container(height=500)
+    with chat_box:
+        if len(history) > st.session_state.chat_window:
+            history = history[1:]
+            if st.button("Load earlier messages", key="chat_more"):
+                st.session_state.chat_window += utils.CHAT_WINDOW; rerun_fragment()
+        for m in history:
+            with st.chat_message(m["role"]): st.markdown(m["content"])
+    summary = analytics.get_advisor_summary()
+    with st.expander("What the advisor sees"):
+        st.text(summary["text"])
+        st.caption(f"~{summary['tokens']} tokens")
+    metrics = utils.get_advisor_metrics(st.session_state)
+    if metrics.get("error"):
+        st.error(metrics["error"])
+    elif metrics.get("cached"):
+        st.caption("Answered from cache • your finances haven't changed since this was last asked")
+    elif metrics.get("ttft") is not None:
+        st.caption(f"First token in {metrics['ttft']:.2f}s • Full reply in {metrics['elapsed'] or 0:.2f}s")
+    if q := st.chat_input("Ask about your finances..."):
+        with chat_box:
+            st.chat_message("user").markdown(q)
+            with st.chat_message("assistant"):
+                st.write_stream(utils.stream_chat_response(q, st.session_state, persona=guru, enable_guru=active, context=summary))
+        rerun_fragment()
+
+def page_advisor():
+    st.title("Onyx AI Advisory")
+    c1, c2 = st.columns([3, 1])
+    with c1:
+        personas = ["The Wealth Architect 🏛️ (Long-term Strategy)", "The Strategic Investor 📈 (Aggressive Growth)", "The Frugal Sage 🧘 (Smart Budgeting)", "The Tax Tactician 💼 (Tax Optimization)"]
+        guru = st.selectbox("Select Advisor Model", personas)
+    with c2:
+        st.write(""); active = st.toggle("Activate AI", value=True)
+        if st.button("Clear Conversation", key="chat_clear"):
+            utils.clear_chat_history(); st.session_state.chat_window = utils.CHAT_WINDOW; st.rerun()
+    st.divider()
+    advisor_chat(guru, active)
+
+# --- GOALS ---
+@diagnostics.fragment
+def goal_funding(currency):
+    # Funding reruns only the goal list.
+    goals_df = utils.get_goals()
+    if not goals_df.empty:
+        projections = utils.get_goal_projections()
+        # One form for every goal: amounts are collected without reruns and applied together on submit.
+        with st.form("fund_goals", clear_on_submit=True, border=False):
+            amounts = {}
+            for row in goals_df.itertuples():
+                c1, c2 = st.columns([3, 1])
+                with c1:
+                    st.subheader(row.name); st.progress(min(row.current_amount / row.target_amount, 1.0))
+                    eta = projections.at[row.id, "projected_date"]
+                    pace = f" • On pace for {eta:%b %d, %Y}" if row.current_amount < row.target_amount and pd.notna(eta) else ""
+                    st.caption(f"{currency}{row.current_amount:,.0f} / {currency}{row.target_amount:,.0f}{pace}")
+                with c2: amounts[row.id] = st.number_input("Add", key=f"add_{row.id}", min_value=0.0, label_visibility="collapsed")
+                st.markdown("---")
+            if st.form_submit_button("💰 Fund Goals", type="primary"):
+                funded = utils.fund_goals(amounts)
+                if funded: st.toast(f"Funded {funded} goal{'s' if funded != 1 else ''}."); rerun_fragment()
+    else: st.info("No active targets.")
+
+def page_goals():
+    currency = utils.get_currency()
+    st.title("Financial Targets")
+    with st.expander("➕ Create Target"):
+        g_name = st.text_input("Goal Name"); g_target = st.number_input(f"Target Amount ({currency})", min_value=1.0)
+        if st.button("Create"): utils.add_goal(g_name, g_target); st.success("Created!"); st.rerun()
+    st.divider()
+    goal_funding(currency)
+
+# --- REPORTS ---
+def page_reports():
+    currency = utils.get_currency()
+    st.title("Executive Reports")
+    if utils.count_expenses() > 0:
+        snapshot = analytics.get_snapshot()
+        st.subheader("Spending Analytics")
+        a1, a2 = st.columns(2)
+        with a1: st.caption("Weekly spend"); st.bar_chart(snapshot["weekly_totals"], color="#6366F1")
+        with a2: st.caption(f"{analytics.ANALYTICS_ROLLING_DAYS}-day rolling daily average by category"); st.line_chart(snapshot["category_rolling"])
+        if not snapshot["outliers"].empty:
+            st.caption(f"Unusual transactions (last {analytics.ANALYTICS_HISTORY_DAYS} days)")
+            st.dataframe(snapshot["outliers"], hide_index=True, use_container_width=True, column_config={"amount": st.column_config.NumberColumn(f"{currency}", format=f"{currency}%.2f"), "zscore": "σ above usual"})
+        st.divider()
+        filters, total = render_ledger("reports", currency)
+        st.divider()
+        e1, e2 = st.columns([1, 3])
+        with e1: fmt = st.selectbox("Export Format", list(utils.EXPORT_FORMATS), format_func=lambda f: {"csv": "CSV", "csv.gz": "CSV (gzip)", "parquet": "Parquet"}[f])
+        file_name, mime = utils.EXPORT_FORMATS[fmt]
+        with e2:
+            st.write("")
+            # The file is only built when the button is clicked, for the filters currently applied.
+            st.download_button(f"📥 Download Ledger ({total:,} rows)", lambda fmt=fmt, filters=filters, user=st.session_state.username: utils.export_ledger_bytes(fmt, *filters, user=user), file_name, mime, type="primary")
+    else: st.warning("No data found.")
+
+# --- PROFILE (UPDATED WITH SETTINGS TAB) ---
+def page_profile():
+    budget = utils.get_budget()
+    currency = utils.get_currency()
+    st.title("User Profile")
+
+    # Profile Header Card (Common to both tabs)
+    st.markdown(f"""
+    <div class="profile-header">
+        <div class="profile-avatar">{st.session_state.username[0].upper()}</div>
+        <div class="profile-info">
+            <h2 style="margin:0; color:white;">{st.session_state.username}</h2>
+            <p style="margin:0; color:#888;">Onyx Premium Member</p>
+            <div style="margin-top:8px;">
+                <span style="background:#10B981; color:#050505; padding:4px 8px; border-radius:4px; font-size:12px; font-weight:bold;">ACTIVE</span>
+            </div>
+        </div>
+    </div>
+    """, unsafe_allow_html=True)
+
+    # TABBED INTERFACE FOR SETTINGS
+    is_admin = diagnostics.is_admin(st.session_state.username)
+    tabs = st.tabs(["My Profile", "Settings"] + (["Diagnostics"] if is_admin else []))
+    tab1, tab2 = tabs[:2]
+
+    # TAB 1: OVERVIEW & BUDGET
+    with tab1:
+        st.subheader("Financial Configuration")
+        st.markdown("""
+        <div class="doc-card">
+            <div style="display: flex; align-items: center;">
+                <div class="doc-icon-container" style="font-size: 20px;">💰</div>
+                <div>
+                    <div style="font-weight: 600; color: white;">Monthly Budget</div>
+                    <div style="color: #666; font-size: 12px;">Base allocation limit</div>
+                </div>
+            </div>
+        </div>
+        """, unsafe_allow_html=True)
+
+        new_budget_profile = st.number_input(f"Update Budget ({currency})", value=float(budget), key="profile_budget")
+        if st.button("Save New Budget", key="save_profile_budget", type="primary"):
+            utils.set_budget(new_budget_profile)
+            st.success("Budget Saved")
+            time.sleep(0.5)
+            st.rerun()
+
+    # TAB 2: SETTINGS (NOTIFICATIONS + CURRENCY + SECURITY)
+    with tab2:
+        # 1. NOTIFICATION SECTION (TOP FULL WIDTH)
+        st.subheader("Notification Preferences")
+        st.markdown("""
+        <div class="doc-card">
+            <div style="display: flex; align-items: center;">
+                <div class="doc-icon-container" style="font-size: 20px;">🔔</div>
+                <div>
+                    <div style="font-weight: 600; color: white;">Alerts & Updates</div>
+                    <div style="color: #666; font-size: 12px;">Email & Push notifications</div>
+                </div>
+            </div>
+        </div>
+        """, unsafe_allow_html=True)
+        st.toggle("Enable All Notifications", value=True)
+
+        st.write(""); st.divider(); st.write("")
+
+        # 2. GLOBAL PREFS & SECURITY (BELOW, SIDE BY SIDE)
+        c1, c2 = st.columns(2)
+
+        with c1:
+            st.subheader("Global Preferences")
+            st.info("Changing currency will update all dashboards.")
+
+            currency_options = ["₹", "$", "€", "£", "¥", "Rp"]
+            current_curr_index = 0
+            if currency in currency_options:
+                current_curr_index = currency_options.index(currency)
+
+            new_currency = st.selectbox("Select Currency Symbol", currency_options, index=current_curr_index)
+            if new_currency != currency:
+                utils.set_currency(new_currency)
+                st.success(f"Currency updated to {new_currency}")
+                time.sleep(0.5)
+                st.rerun()
+
+        with c2:
+            st.subheader("Security Settings")
+
+            with st.expander("Change Password"):
+                p_new = st.text_input("New Password", type="password")
+                p_confirm = st.text_input("Confirm New Password", type="password")
+                if st.button("Update Password"):
+                    if p_new and p_new == p_confirm:
+                        if utils.update_credentials(st.session_state.username, p_new):
+                            st.success("Password Updated Successfully.")
+                        else:
+                            st.error("Update failed.")
+                    else:
+                        st.error("Passwords do not match.")
+
+            # ADDED: Change Username Section BELOW Password
+            st.write("") 
+            with st.expander("Change Username"):
+                new_user_input = st.text_input("New Username")
+                if st.button("Update Username"):
+                    if new_user_input:
+                        if utils.update_username(st.session_state.username, new_user_input):
+                            analytics.forget(st.session_state.username)
+                            st.session_state.username = new_user_input
+                            st.success(f"Username updated to {new_user_input}")
+                            time.sleep(1)
+                            st.rerun()
+                        else:
+                            st.error("Username already taken.")
+
+    # TAB 3: DIAGNOSTICS (ADMINS ONLY)
+    if is_admin:
+        with tabs[2]:
+            st.subheader("Rerun Diagnostics")
+            recording = st.toggle("Record spans for every rerun", value=diagnostics.enabled(), key="diag_enabled")
+            if recording != diagnostics.enabled():
+                diagnostics.set_enabled(recording); st.rerun()
+            st.caption(f"Finished runs are appended to `{diagnostics.DIAGNOSTICS_LOG}` as JSON lines.")
+            summary = diagnostics.page_summary()
+            if not summary:
+                st.info("No runs recorded yet. Turn recording on and browse a few pages.")
+            else:
+                st.dataframe(pd.DataFrame(summary).round(2), use_container_width=True, hide_index=True)
+                diag_page = st.selectbox("Page", [row["page"] for row in summary], key="diag_page")
+                st.markdown("**Time by call** (inclusive of nested calls)")
+                st.dataframe(pd.DataFrame(diagnostics.span_summary(diag_page)).round(2), use_container_width=True, hide_index=True)
+                last = diagnostics.last_run(diag_page)
+                st.markdown(f"**Last run**: {last['ms']:.0f} ms • {last['queries']} queries • {last['rows']} rows • {last['api_ms']:.0f} ms in external APIs")
+                st.dataframe(pd.DataFrame(last["spans"]).round(2), use_container_width=True, hide_index=True)
+                if st.button("Clear history", key="diag_clear"):
+                    diagnostics.reset(); st.rerun()
+            st.subheader("AI Client")
+            ai = utils.get_ai_client_stats()
+            a1, a2, a3, a4 = st.columns(4)
+            a1.metric("Queue Depth", ai["queue_depth"])
+            a2.metric("In Flight", ai["in_flight"])
+            a3.metric("Mean Wait", f"{ai['mean_wait_seconds']:.2f}s")
+            a4.metric("Max Wait", f"{ai['max_wait_seconds']:.2f}s")
+            st.caption(f"{ai['calls']} calls • {ai['coalesced']} coalesced • {ai['quota_errors']} quota errors • "
+                       f"{ai['rejected']} rejected • backoff {ai['backoff_seconds']:.0f}s")
+
+PAGES = {
+    "Dashboard": page_dashboard,
+    "Transactions": page_transactions,
+    "Documents": page_documents,
+    "AI Advisor": page_advisor,
+    "Goals": page_goals,
+    "Reports": page_reports,
+    "Profile": page_profile,
+}
+
+def show_app():
+    nav = render_sidebar()
+    diagnostics.start_run(nav, st.session_state.username)
+    # Each page loads only the data it shows, and its interactive parts are
+    # fragments, so using them reruns that part instead of the whole page.
+    PAGES[nav]()
+
+
+# =========================================================
+# APP ROUTER
+# =========================================================
+if st.session_state.page == "landing": show_landing()
+elif st.session_state.page == "auth": show_auth()
+elif st.session_state.page == "app":
+    if st.session_state.auth_status:
+        # The landing and sign-in pages never load pandas, matplotlib or numpy.
+        import pandas as pd
+        import charts
+        import analytics
+        # finally: st.rerun() ends the script with an exception, and that run still counts.
+        try: show_app()
+        finally: diagnostics.finish_run()
     else: st.session_state.page = "auth"; st.rerun()
\ No newline at end of file
@@ -0,0 +1,674 @@
+import argparse
+import hashlib
+import io
+import json
+import os
+import platform
+import random
+import resource
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from types import SimpleNamespace
+
+from PIL import Image
+
+# --- BENCHMARK SUITE ---
+# Seeds synthetic ledgers of the requested sizes, times the public functions in
+# utils, charts and the full page renders of app.py (through Streamlit's AppTest),
+# and writes everything to JSON. Passing --compare with an earlier run fails the
+# run when any timing got slower than the threshold allows.
+#
+#   python benchmarks.py --sizes 1000 100000 --out before.json
+#   python benchmarks.py --sizes 1000 100000 --compare before.json --threshold 0.2
+#
+# The AI is replaced by a deterministic local stand-in with a fixed latency, so
+# runs never touch the network and are comparable with each other.
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+NAV_SECTIONS = ["Dashboard", "Transactions", "Documents", "AI Advisor", "Goals", "Reports", "Profile"]
+
+BENCH_SIZES = [1_000, 10_000, 100_000]
+BENCH_REPEAT = 5
+BENCH_SEED = 2024
+BENCH_USER = "bench"
+BENCH_PASSWORD = "bench-password"
+BENCH_CATEGORIES = ["Food", "Transport", "Utilities", "Entertainment", "Shopping", "Health", "Rent", "Other"]
+BENCH_GOALS = 20
+BENCH_DAYS = 730                 # ledger dates spread over the last two years
+
+FAKE_MODEL_LATENCY = 0.2         # seconds per simulated model call
+FAKE_STREAM_CHUNKS = 8           # chunks a streamed advisor reply arrives in
+
+IMAGE_CORPUS = [                 # (name, size, mode, format, EXIF orientation)
+    ("phone-photo", (4032, 3024), "RGB", "JPEG", 6),
+    ("scan", (2480, 3508), "L", "PNG", None),
+    ("screenshot", (1170, 2532), "RGBA", "PNG", None),
+    ("small-receipt", (800, 1200), "RGB", "JPEG", None),
+]
+BATCH_RECEIPTS = 16
+BATCH_WORKERS = [1, 2, 4, 8]
+COALESCE_CALLERS = 8             # concurrent requests for the same receipt
+LIMITER_CALLS = 12               # chat calls fired at once against the limiter below
+LIMITER_RATE_PER_MINUTE = 600
+LIMITER_BURST = 4
+CHAT_HISTORY_MESSAGES = 2000     # stored advisor messages for the history benchmarks
+
+# The soaks change the data on every step so each one really builds, encodes
+# and tears down a figure; rerunning an unchanged ledger only hits the cache.
+SOAK_RERUNS = 1000               # dashboard reruns for the memory soak, a new expense before each
+SOAK_CHART_RENDERS = 3000        # direct renders of the allocation chart, each with distinct totals
+SOAK_WARMUP = 20
+SOAK_MAX_GROWTH_MB = 20.0        # RSS growth after warm-up that counts as a leak
+
+# Cold start is measured in fresh interpreters, from Streamlit being imported to
+# the landing page rendered. The targets assume a warm disk cache; the landing
+# and sign-in pages must not load any of the heavy modules at all.
+COLD_START_RUNS = 3
+COLD_START_TARGET_IMPORT_MS = 150      # `import utils`
+COLD_START_TARGET_PAINT_MS = 1000      # importing the app and rendering the landing page
+COLD_START_HEAVY_MODULES = ["pandas", "numpy", "matplotlib", "PIL.Image", "google.generativeai"]
+
+REGRESSION_THRESHOLD = 0.20      # allowed slowdown before a timing counts as a regression
+REGRESSION_FLOOR_MS = 1.0        # timings below this are too noisy to compare
+
+# --- FAKE AI ---
+class _FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+class _FakeChat:
+    def __init__(self, ai):
+        self.ai = ai
+
+    def send_message(self, message, stream=False):
+        reply = f"Based on your ledger, keep discretionary spending under budget. ({len(message)} chars received)"
+        if stream:
+            return self._stream(reply)
+        time.sleep(self.ai.latency)
+        return _FakeResponse(reply)
+
+    def _stream(self, reply):
+        words = reply.split(" ")
+        step = max(1, len(words) // FAKE_STREAM_CHUNKS)
+        for i in range(0, len(words), step):
+            time.sleep(self.ai.latency / FAKE_STREAM_CHUNKS)
+            yield _FakeResponse(" ".join(words[i:i + step]) + " ")
+
+class _FakeModel:
+    def __init__(self, ai, model_name):
+        self.ai = ai
+        self.model_name = model_name
+
+    def generate_content(self, contents, request_options=None, **kwargs):
+        # The "receipt" is derived from the image bytes, so the same image
+        # always extracts to the same expense.
+        time.sleep(self.ai.latency)
+        self.ai.calls += 1
+        if isinstance(contents, str):
+            return _FakeResponse(f"Summary of {contents.count(chr(10))} lines of conversation.")
+        image = contents[-1]["data"] if isinstance(contents[-1], dict) else b""
+        digest = int.from_bytes(hashlib.blake2b(image, digest_size=4).digest(), "big")
+        receipt = {"date": str(date(2026, 1, 1) + timedelta(days=digest % 365)),
+                   "amount": round(digest % 50000 / 100, 2),
+                   "category": BENCH_CATEGORIES[digest % len(BENCH_CATEGORIES)],
+                   "description": f"Receipt {digest % 10000}"}
+        return _FakeResponse("```json\n" + json.dumps(receipt) + "\n```")
+
+    def start_chat(self, history=None):
+        return _FakeChat(self.ai)
+
+class FakeGenAI:
+    def __init__(self, latency=FAKE_MODEL_LATENCY):
+        self.latency = latency
+        self.calls = 0
+        self.list_models_calls = 0
+
+    def configure(self, **kwargs):
+        pass
+
+    def list_models(self):
+        self.list_models_calls += 1
+        time.sleep(self.latency)
+        return [SimpleNamespace(name="models/gemini-bench", supported_generation_methods=["generateContent"])]
+
+    def GenerativeModel(self, model_name, system_instruction=None, **kwargs):
+        return _FakeModel(self, model_name)
+
+# --- HELPERS ---
+def _stats(samples):
+    return {"runs": len(samples), "min_ms": min(samples), "median_ms": statistics.median(samples), "max_ms": max(samples)}
+
+def _measure(fn, repeat):
+    samples = []
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return _stats(samples), result
+
+def _rss_mb():
+    # Peak resident set size; ru_maxrss is KiB on Linux and bytes on macOS.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def _write_ledger_csv(path, rows, seed):
+    rng = random.Random(seed)
+    today = date.today()
+    with open(path, "w", newline="") as fh:
+        fh.write("date,category,amount,description\n")
+        for i in range(rows):
+            day = today - timedelta(days=rng.randrange(BENCH_DAYS))
+            fh.write(f"{day},{rng.choice(BENCH_CATEGORIES)},{rng.randrange(100, 50000) / 100:.2f},txn {i}\n")
+
+def _image_bytes(size, mode, fmt, orientation, seed):
+    # Noise compresses about as badly as a real photo, which is the point; the
+    # seed shifts the pixel values so every image (and its cache key) differs.
+    noise = Image.effect_noise(size, 64).point(lambda v: (v + seed * 37) % 256)
+    img = noise if mode == "L" else Image.merge("RGB", [noise, noise.transpose(Image.Transpose.FLIP_LEFT_RIGHT), noise.transpose(Image.Transpose.FLIP_TOP_BOTTOM)])
+    if mode == "RGBA":
+        img = img.convert("RGBA")
+        img.putalpha(200)
+    buf = io.BytesIO()
+    options = {"quality": 95} if fmt == "JPEG" else {}
+    if orientation:
+        exif = Image.Exif()
+        exif[0x0112] = orientation
+        options["exif"] = exif
+    img.save(buf, format=fmt, **options)
+    return buf.getvalue()
+
+def _upload(data, name):
+    f = io.BytesIO(data)
+    f.name = name
+    return f
+
+# --- UTILS BENCHMARKS ---
+def bench_utils(utils, rows, repeat, workdir):
+    results = {}
+
+    def run(name, fn, times=repeat):
+        results[name], value = _measure(fn, times)
+        return value
+
+    csv_path = os.path.join(workdir, "ledger.csv")
+    _write_ledger_csv(csv_path, rows, BENCH_SEED + rows)
+
+    run("init_db", utils.init_db, 1)
+    run("create_user", lambda: utils.create_user(BENCH_USER, BENCH_PASSWORD), 1)
+    run("verify_user", lambda: utils.verify_user(BENCH_USER, BENCH_PASSWORD))
+    run("update_credentials", lambda: utils.update_credentials(BENCH_USER, BENCH_PASSWORD))
+
+    # Bulk import doubles as the seeding step; the second pass is all duplicates.
+    report = run("import_expenses", lambda: utils.import_expenses(csv_path, user=BENCH_USER), 1)
+    results["import_expenses"]["rows_per_second"] = report["inserted"] / (results["import_expenses"]["median_ms"] / 1000)
+    run("import_expenses (duplicates)", lambda: utils.import_expenses(csv_path, user=BENCH_USER), 1)
+    with open(csv_path, "rb") as fh:
+        head = fh.read(64 * 1024)
+    headers = run("read_import_headers", lambda: utils.read_import_headers(_upload(head, "ledger.csv")))
+    run("guess_import_mapping", lambda: utils.guess_import_mapping(headers))
+
+    for i in range(BENCH_GOALS):
+        utils.add_goal(f"Goal {i}", 1000 * (i + 1), user=BENCH_USER)
+    run("add_goal", lambda: utils.add_goal("Bench goal", 500, user=BENCH_USER))
+    goals = run("get_goals", lambda: utils.get_goals(user=BENCH_USER))
+    run("update_goal_progress", lambda: utils.update_goal_progress(int(goals["id"].iloc[0]), 1, user=BENCH_USER))
+    run("fund_goals", lambda: utils.fund_goals({int(goal_id): 25 for goal_id in goals["id"]}, user=BENCH_USER))
+    run("get_goal_contributions", lambda: utils.get_goal_contributions(user=BENCH_USER))
+    run("get_goal_projections", lambda: utils.get_goal_projections(user=BENCH_USER))
+
+    run("set_budget", lambda: utils.set_budget(30000, user=BENCH_USER))
+    run("get_budget", lambda: utils.get_budget(user=BENCH_USER))
+    run("set_currency", lambda: utils.set_currency("€", user=BENCH_USER))
+    run("get_currency", lambda: utils.get_currency(user=BENCH_USER))
+    run("set_setting", lambda: utils.set_setting("bench_flag", True, user=BENCH_USER))
+    run("get_setting", lambda: utils.get_setting("bench_flag", False, user=BENCH_USER))
+
+    run("get_expenses_from_db (cold)", lambda: utils.get_expenses_from_db(user=BENCH_USER), 1)
+    run("get_expenses_from_db", lambda: utils.get_expenses_from_db(user=BENCH_USER))
+    run("add_expense_to_db", lambda: utils.add_expense_to_db(str(date.today()), "Food", 12.5, "bench", user=BENCH_USER))
+    run("get_total_spend", lambda: utils.get_total_spend(user=BENCH_USER))
+    run("current_month", utils.current_month)
+    run("get_month_spend", lambda: utils.get_month_spend(user=BENCH_USER))
+    run("get_category_totals", lambda: utils.get_category_totals(user=BENCH_USER))
+    run("get_recent_expenses", lambda: utils.get_recent_expenses(5, user=BENCH_USER))
+    run("get_categories", lambda: utils.get_categories(user=BENCH_USER))
+    run("count_expenses", lambda: utils.count_expenses(user=BENCH_USER))
+    since = str(date.today() - timedelta(days=90))
+    run("count_expenses (date range)", lambda: utils.count_expenses(since, None, "Food", user=BENCH_USER))
+
+    _, cursor = run("get_expenses_page", lambda: utils.get_expenses_page(page_size=50, user=BENCH_USER))
+    for _ in range(20):
+        if cursor:
+            _, cursor = utils.get_expenses_page(cursor, 50, user=BENCH_USER)
+    if cursor:
+        run("get_expenses_page (page 20)", lambda: utils.get_expenses_page(cursor, 50, user=BENCH_USER))
+    run("get_expenses_page (filtered)", lambda: utils.get_expenses_page(None, 50, since, None, "Food", user=BENCH_USER))
+
+    for fmt in utils.EXPORT_FORMATS:
+        data = run(f"export_ledger_bytes ({fmt})", lambda fmt=fmt: utils.export_ledger_bytes(fmt, user=BENCH_USER), 1)
+        results[f"export_ledger_bytes ({fmt})"]["bytes"] = len(data)
+
+    # Account maintenance runs against a small scratch user so the main ledger stays put.
+    scratch = "bench_scratch"
+    utils.create_user(scratch, BENCH_PASSWORD)
+    for i in range(min(rows, 1000)):
+        utils.add_expense_to_db(str(date.today()), "Other", 1.0, f"scratch {i}", user=scratch)
+    run("update_username", lambda: utils.update_username(scratch, scratch + "2"), 1)
+    run("move_tenant_to_own_db", lambda: utils.move_tenant_to_own_db(scratch + "2"), 1)
+    return results
+
+# --- STORAGE BENCHMARKS ---
+# Seeds a ledger in the old TEXT/REAL/TEXT layout (with the indexes it had),
+# measures it, migrates it with utils.migrate_expenses_schema and measures the
+# typed table the same way: file size, loading the user's rows into a
+# DataFrame, and that frame's memory. The old table's pages stay in the file
+# after the migration, so the size is also reported after a VACUUM.
+_LEGACY_LEDGER_DDL = [
+    '''CREATE TABLE expenses (id INTEGER PRIMARY KEY, date TEXT, category TEXT, amount REAL, description TEXT,
+                              import_key INTEGER, user_id TEXT NOT NULL DEFAULT '')''',
+    "CREATE UNIQUE INDEX idx_expenses_user_import_key ON expenses(user_id, import_key)",
+    "CREATE INDEX idx_expenses_user_id ON expenses(user_id, id)",
+    "CREATE INDEX idx_expenses_user_date ON expenses(user_id, date)",
+    "CREATE INDEX idx_expenses_user_category_date ON expenses(user_id, category, date)",
+    "CREATE TABLE users (username TEXT PRIMARY KEY, password TEXT)",
+]
+
+def _db_bytes(utils, path):
+    with utils.db_connection(path) as conn:
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    return os.path.getsize(path)
+
+def bench_storage(utils, rows, repeat, workdir):
+    path = os.path.join(workdir, "legacy.db")
+    rng = random.Random(BENCH_SEED + rows)
+    today = date.today()
+    conn = sqlite3.connect(path)
+    for ddl in _LEGACY_LEDGER_DDL:
+        conn.execute(ddl)
+    conn.execute("INSERT INTO users (username, password) VALUES (?, '')", (BENCH_USER,))
+    conn.executemany("INSERT INTO expenses (date, category, amount, description, import_key, user_id) VALUES (?, ?, ?, ?, ?, ?)",
+                     ((str(today - timedelta(days=rng.randrange(BENCH_DAYS))), rng.choice(BENCH_CATEGORIES),
+                       rng.randrange(100, 50000) / 100, f"txn {i}", rng.getrandbits(62), BENCH_USER) for i in range(rows)))
+    conn.commit()
+    conn.close()
+
+    def measure(read):
+        def load():
+            with utils.db_connection(path) as conn:
+                return read(conn)
+        stats, df = _measure(load, repeat)
+        return {"file_bytes": _db_bytes(utils, path), "load": stats, "dataframe_bytes": int(df.memory_usage(deep=True).sum()),
+                "dtypes": {column: str(dtype) for column, dtype in df.dtypes.items()}}
+
+    results = {"before": measure(lambda conn: utils.pd.read_sql_query(
+        "SELECT id, date, category, amount, description FROM expenses WHERE user_id = ? ORDER BY id", conn, params=(BENCH_USER,)))}
+    started = time.perf_counter()
+    copied = utils.migrate_expenses_schema(path)
+    utils.init_db(path)
+    elapsed = time.perf_counter() - started
+    results["migrate"] = {"rows": copied, "ms": elapsed * 1000, "rows_per_second": copied / elapsed if elapsed else None}
+    results["after"] = measure(lambda conn: utils.load_ledger_rows(conn, BENCH_USER))
+    with utils.db_connection(path) as conn:
+        conn.execute("VACUUM")
+    results["after"]["file_bytes_vacuumed"] = _db_bytes(utils, path)
+    utils._close_pool(path)
+    before, after = results["before"], results["after"]
+    print(f"  storage: file {before['file_bytes'] / 2**20:.1f} -> {after['file_bytes_vacuumed'] / 2**20:.1f} MiB, "
+          f"load {before['load']['median_ms']:.0f} -> {after['load']['median_ms']:.0f} ms, "
+          f"frame {before['dataframe_bytes'] / 2**20:.1f} -> {after['dataframe_bytes'] / 2**20:.1f} MiB", flush=True)
+    return results
+
+# --- ANALYTICS BENCHMARKS ---
+def bench_analytics(analytics, utils, repeat):
+    # Cold build, a refresh with nothing new, and a refresh after one new row.
+    results = {}
+    analytics.forget()
+    results["get_snapshot (cold)"], _ = _measure(lambda: analytics.get_snapshot(user=BENCH_USER), 1)
+    results["get_snapshot"], _ = _measure(lambda: analytics.get_snapshot(user=BENCH_USER), repeat)
+
+    def after_insert():
+        utils.add_expense_to_db(str(date.today()), "Food", 9.5, "bench", user=BENCH_USER)
+        started = time.perf_counter()
+        analytics.get_snapshot(user=BENCH_USER)
+        return (time.perf_counter() - started) * 1000
+    samples = [after_insert() for _ in range(repeat)]
+    results["get_snapshot (after insert)"] = {"runs": len(samples), "min_ms": min(samples),
+                                              "median_ms": statistics.median(samples), "max_ms": max(samples)}
+    return results
+
+# --- AI BENCHMARKS ---
+def bench_ai(utils, analytics, fake_ai, repeat):
+    results = {}
+
+    def run(name, fn, times=repeat):
+        results[name], value = _measure(fn, times)
+        return value
+
+    # Earlier page renders already resolved the model; forget it to time a cold start.
+    utils._model_state.update(name=None, expires=0.0, refreshing=False)
+    run("get_working_model_name (cold)", utils.get_working_model_name, 1)
+    run("get_working_model_name", utils.get_working_model_name)
+    run("invalidate_model_name", utils.invalidate_model_name, 1)
+
+    # Preprocessing: bytes in, bytes sent and time per image of the corpus.
+    for i, (name, size, mode, fmt, orientation) in enumerate(IMAGE_CORPUS):
+        data = _image_bytes(size, mode, fmt, orientation, i)
+        prepared = run(f"preprocess_image ({name})", lambda data=data: utils.preprocess_image(data))
+        results[f"preprocess_image ({name})"].update(bytes_in=len(data), bytes_sent=len(prepared))
+
+    # The shared rate limiter would otherwise pace the throughput runs; it is
+    # measured on its own at the end.
+    limiter = utils._ai_limiter
+    utils._ai_limiter = utils._RateLimiter(10 ** 9, 10 ** 9)
+
+    receipt = _image_bytes((1200, 1600), "RGB", "JPEG", None, 99)
+    utils.clear_extraction_cache()
+    run("analyze_image_direct (miss)", lambda: utils.analyze_image_direct(_upload(receipt, "r.jpg")), 1)
+    run("analyze_image_direct (hit)", lambda: utils.analyze_image_direct(_upload(receipt, "r.jpg")))
+    run("get_extraction_cache_stats", utils.get_extraction_cache_stats)
+
+    # Batch extraction: throughput against the concurrency setting.
+    batch = [_upload(_image_bytes((600, 800), "RGB", "JPEG", None, 100 + i), f"r{i}.jpg") for i in range(BATCH_RECEIPTS)]
+    for workers in BATCH_WORKERS:
+        utils.clear_extraction_cache()
+        run(f"analyze_images_batch (workers={workers})", lambda workers=workers: utils.analyze_images_batch(batch, max_workers=workers), 1)
+        results[f"analyze_images_batch (workers={workers})"]["receipts_per_second"] = \
+            BATCH_RECEIPTS / (results[f"analyze_images_batch (workers={workers})"]["median_ms"] / 1000)
+
+    # Document queue: the background workers are held off so each job is timed
+    # on the thread that runs it.
+    claim = utils._claim_document_job
+    utils._claim_document_job = lambda: None
+    utils.clear_extraction_cache()
+    uploads = iter([_upload(_image_bytes((600, 800), "RGB", "JPEG", None, 200 + i), f"doc{i}.jpg") for i in range(repeat)])
+    job_ids = []
+    run("enqueue_document", lambda: job_ids.append(utils.enqueue_document(next(uploads), user=BENCH_USER)))
+    pending = iter(job_ids)
+    run("process_document_job", lambda: utils.process_document_job(next(pending), user=BENCH_USER))
+    run("process_document_job (done)", lambda: utils.process_document_job(job_ids[0], user=BENCH_USER))
+    run("get_document_jobs", lambda: utils.get_document_jobs(user=BENCH_USER))
+    utils._claim_document_job = claim
+    run("clear_extraction_cache", utils.clear_extraction_cache, 1)
+
+    analytics.forget()
+    run("get_advisor_summary (cold)", lambda: analytics.get_advisor_summary(user=BENCH_USER), 1)
+    summary = run("get_advisor_summary", lambda: analytics.get_advisor_summary(user=BENCH_USER))
+    results["get_advisor_summary"]["tokens"] = summary["tokens"]
+
+    def uncached(fn):
+        utils.clear_advisor_cache()
+        return fn()
+
+    run("get_chat_response", lambda: uncached(lambda: utils.get_chat_response("How am I doing?", context=summary)))
+    run("get_chat_response (cached)", lambda: utils.get_chat_response("How am I doing?", context=summary))
+    store = {}
+    run("get_advisor_session", lambda: utils.get_advisor_session(store, context=summary))
+    ask = lambda: "".join(utils.stream_chat_response("How am I doing?", store, context=summary, user=BENCH_USER))
+    run("stream_chat_response", lambda: uncached(ask))
+    run("get_advisor_metrics", lambda: utils.get_advisor_metrics(store))
+    results["stream_chat_response"]["ttft_ms"] = utils.get_advisor_metrics(store)["ttft"] * 1000
+
+    # Chat history: the rendered window and the model context stay the same
+    # size however long the stored conversation gets.
+    utils.clear_chat_history(user=BENCH_USER)
+    for i in range(CHAT_HISTORY_MESSAGES):
+        utils.add_chat_message("user" if i % 2 == 0 else "assistant", f"Message {i} about the budget.", user=BENCH_USER)
+    run("get_chat_messages", lambda: utils.get_chat_messages(user=BENCH_USER))
+    run("compact_chat_history", lambda: utils.compact_chat_history(user=BENCH_USER), 1)
+    run(f"stream_chat_response ({CHAT_HISTORY_MESSAGES} messages stored)", lambda: uncached(ask))
+
+    # Coalescing: identical receipts requested at once share one model call.
+    utils.clear_extraction_cache()
+    same = _image_bytes((1200, 1600), "RGB", "JPEG", None, 98)
+    calls = fake_ai.calls
+    with ThreadPoolExecutor(COALESCE_CALLERS) as pool:
+        run(f"analyze_image_direct (x{COALESCE_CALLERS} concurrent, same image)",
+            lambda: list(pool.map(lambda i: utils.analyze_image_direct(_upload(same, f"s{i}.jpg")), range(COALESCE_CALLERS))), 1)
+    results[f"analyze_image_direct (x{COALESCE_CALLERS} concurrent, same image)"]["model_calls"] = fake_ai.calls - calls
+
+    # Limiter: a burst of distinct chat calls against a tight bucket queues up.
+    utils.clear_advisor_cache()
+    utils._ai_limiter = utils._RateLimiter(LIMITER_RATE_PER_MINUTE, LIMITER_BURST)
+    with ThreadPoolExecutor(LIMITER_CALLS) as pool:
+        run(f"get_chat_response (x{LIMITER_CALLS} concurrent, rate limited)",
+            lambda: list(pool.map(lambda i: utils.get_chat_response(f"Question {i}"), range(LIMITER_CALLS))), 1)
+    ai_stats = utils.get_ai_client_stats()
+    results[f"get_chat_response (x{LIMITER_CALLS} concurrent, rate limited)"].update(
+        mean_wait_ms=ai_stats["mean_wait_seconds"] * 1000, max_wait_ms=ai_stats["max_wait_seconds"] * 1000)
+    utils._ai_limiter = limiter
+    results["model_calls"] = fake_ai.calls
+    results["list_models_calls"] = fake_ai.list_models_calls
+    return results
+
+# --- CHART BENCHMARKS ---
+def bench_charts(charts, utils, repeat):
+    results = {}
+    totals = utils.get_category_totals(user=BENCH_USER)
+    charts._allocation_png.cache_clear()
+    results["allocation_chart (cold)"], _ = _measure(lambda: charts.allocation_chart(totals), 1)
+    results["allocation_chart (cached)"], _ = _measure(lambda: charts.allocation_chart(totals), repeat)
+    return results
+
+# --- RENDER BENCHMARKS ---
+def _logged_in_app():
+    from streamlit.testing.v1 import AppTest
+    at = AppTest.from_file(APP_PATH, default_timeout=600)
+    at.secrets["GOOGLE_API_KEY"] = ""
+    at.session_state["page"] = "app"
+    at.session_state["auth_status"] = True
+    at.session_state["username"] = BENCH_USER
+    at.run()
+    return at
+
+def bench_render(repeat):
+    results = {}
+    at = _logged_in_app()
+    for section in NAV_SECTIONS:
+        at.sidebar.radio[0].set_value(section)
+        stats, _ = _measure(at.run, repeat)
+        if at.exception:
+            stats["error"] = [e.value for e in at.exception]
+        results[section] = stats
+    at.sidebar.radio[0].set_value("AI Advisor")
+    at.run()
+    stats, _ = _measure(lambda: at.chat_input[0].set_value("How am I doing this month?").run(), 1)
+    results["AI Advisor (reply)"] = stats
+    return results
+
+def _soak(step, runs, charts):
+    # Calls step(i) `runs` times and checks peak RSS stops growing once warmed up.
+    warmup = min(SOAK_WARMUP, runs)
+    for i in range(warmup):
+        step(i)
+    baseline = _rss_mb()
+    before = charts.chart_cache_info()
+    started = time.perf_counter()
+    for i in range(warmup, runs):
+        step(i)
+    growth = _rss_mb() - baseline
+    info = charts.chart_cache_info()
+    return {"runs": runs, "seconds": time.perf_counter() - started, "rss_start_mb": baseline, "rss_growth_mb": growth,
+            "chart_cache_hits": info.hits - before.hits, "chart_cache_misses": info.misses - before.misses,
+            "passed": growth <= SOAK_MAX_GROWTH_MB}
+
+def soak_dashboard(charts, utils, reruns):
+    # Adds an expense before each rerun, so the category totals (and the pie) change every time.
+    at = _logged_in_app()
+    at.sidebar.radio[0].set_value("Dashboard")
+
+    def step(i):
+        utils.add_expense_to_db(str(date.today()), BENCH_CATEGORIES[i % len(BENCH_CATEGORIES)], 1 + (i % 97) / 100,
+                                "soak", user=BENCH_USER)
+        at.run()
+    return _soak(step, reruns, charts)
+
+def soak_charts(charts, renders):
+    def step(i):
+        charts.allocation_chart({name: 100 + k * 37 + i / 100 for k, name in enumerate(BENCH_CATEGORIES[:4])})
+    return _soak(step, renders, charts)
+
+# --- COLD START ---
+_COLD_START_PROBE = r"""
+import json, sys, time
+app_dir, app_path, heavy = sys.argv[1], sys.argv[2], json.loads(sys.argv[3])
+sys.path.insert(0, app_dir)
+from streamlit.testing.v1 import AppTest
+started = time.perf_counter()
+import utils
+imported = time.perf_counter()
+at = AppTest.from_file(app_path, default_timeout=120)
+at.secrets["GOOGLE_API_KEY"] = "bench"
+at.run()
+landing = time.perf_counter()
+at.session_state["page"] = "auth"
+at.run()
+auth = time.perf_counter()
+print(json.dumps({"import_ms": (imported - started) * 1000, "paint_ms": (landing - started) * 1000,
+                  "auth_ms": (auth - landing) * 1000, "loaded": [m for m in heavy if m in sys.modules],
+                  "errors": len(at.exception)}))
+"""
+
+def bench_cold_start(runs=COLD_START_RUNS):
+    # Each run is a fresh interpreter in its own directory, so nothing is
+    # imported or initialised beforehand.
+    samples = {"import_ms": [], "paint_ms": [], "auth_ms": []}
+    loaded, errors = set(), 0
+    for _ in range(runs):
+        workdir = tempfile.mkdtemp(prefix="onyx-cold-")
+        proc = subprocess.run([sys.executable, "-c", _COLD_START_PROBE, os.path.dirname(APP_PATH), APP_PATH,
+                               json.dumps(COLD_START_HEAVY_MODULES)],
+                              cwd=workdir, capture_output=True, text=True, check=True)
+        probe = json.loads(proc.stdout.strip().splitlines()[-1])
+        for key in samples:
+            samples[key].append(probe[key])
+        loaded.update(probe["loaded"])
+        errors += probe["errors"]
+    results = {"import utils": _stats(samples["import_ms"]), "first paint (landing)": _stats(samples["paint_ms"]),
+               "sign-in page": _stats(samples["auth_ms"]), "heavy_modules_loaded": sorted(loaded),
+               "targets": {"import_ms": COLD_START_TARGET_IMPORT_MS, "paint_ms": COLD_START_TARGET_PAINT_MS}}
+    results["passed"] = (not loaded and not errors
+                         and results["import utils"]["median_ms"] <= COLD_START_TARGET_IMPORT_MS
+                         and results["first paint (landing)"]["median_ms"] <= COLD_START_TARGET_PAINT_MS)
+    return results
+
+# --- COMPARISON ---
+def _flatten(tree, prefix=""):
+    flat = {}
+    for key, value in tree.items():
+        if isinstance(value, dict) and "median_ms" in value:
+            flat[prefix + key] = value["median_ms"]
+        elif isinstance(value, dict):
+            flat.update(_flatten(value, f"{prefix}{key}/"))
+    return flat
+
+def compare(results, baseline, threshold):
+    # Returns (name, baseline_ms, current_ms) for every timing that got slower
+    # than the threshold allows. Timings only present on one side are skipped.
+    before, after = _flatten(baseline["results"]), _flatten(results["results"])
+    regressions = []
+    for name, now in sorted(after.items()):
+        was = before.get(name)
+        if was is None or max(was, now) < REGRESSION_FLOOR_MS:
+            continue
+        if now > was * (1 + threshold):
+            regressions.append((name, was, now))
+    return regressions
+
+# --- RUNNER ---
+def run_benchmarks(sizes, repeat, latency, soak, render=True, soak_charts_renders=SOAK_CHART_RENDERS):
+    workdir = tempfile.mkdtemp(prefix="onyx-bench-")
+    os.chdir(workdir)
+    sys.path.insert(0, os.path.dirname(APP_PATH))
+    import utils
+    import charts
+    import analytics
+
+    fake_ai = FakeGenAI(latency)
+    utils.genai = fake_ai
+    output = {"meta": {"started": datetime.now().isoformat(timespec="seconds"), "python": platform.python_version(),
+                       "platform": platform.platform(), "sizes": sizes, "repeat": repeat, "model_latency": latency},
+              "results": {}}
+    for rows in sizes:
+        # Each size gets its own database and tenant directory (absolute paths,
+        # since the connection pools are keyed by path).
+        size_dir = os.path.join(workdir, f"ledger-{rows}")
+        os.makedirs(size_dir)
+        utils.DB_NAME = os.path.join(size_dir, "expenses.db")
+        utils.TENANT_DB_DIR = os.path.join(size_dir, "tenants")
+        print(f"[{rows:,} expenses] utils", flush=True)
+        section = {"utils": bench_utils(utils, rows, repeat, size_dir)}
+        section["storage"] = bench_storage(utils, rows, repeat, size_dir)
+        section["charts"] = bench_charts(charts, utils, repeat)
+        section["analytics"] = bench_analytics(analytics, utils, repeat)
+        if render:
+            print(f"[{rows:,} expenses] app renders", flush=True)
+            section["render"] = bench_render(repeat)
+        output["results"][f"rows={rows}"] = section
+    print("AI stand-in", flush=True)
+    output["results"]["ai"] = bench_ai(utils, analytics, fake_ai, repeat)
+    print("cold start", flush=True)
+    output["results"]["cold_start"] = bench_cold_start()
+    if soak or soak_charts_renders:
+        output["soak"] = {}
+    if soak_charts_renders:
+        print(f"soak: {soak_charts_renders} chart renders", flush=True)
+        output["soak"]["charts"] = soak_charts(charts, soak_charts_renders)
+    if soak:
+        print(f"soak: {soak} dashboard reruns", flush=True)
+        output["soak"]["dashboard"] = soak_dashboard(charts, utils, soak)
+    return output
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark Onyx Capital's data layer and page renders.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=BENCH_SIZES, help="ledger sizes to seed (expenses)")
+    parser.add_argument("--repeat", type=int, default=BENCH_REPEAT, help="timed runs per measurement")
+    parser.add_argument("--latency", type=float, default=FAKE_MODEL_LATENCY, help="simulated model latency in seconds")
+    parser.add_argument("--soak", type=int, default=SOAK_RERUNS, help="dashboard reruns for the memory soak (0 to skip)")
+    parser.add_argument("--soak-charts", type=int, default=SOAK_CHART_RENDERS, help="chart renders for the chart soak (0 to skip)")
+    parser.add_argument("--no-render", action="store_true", help="skip the AppTest page renders")
+    parser.add_argument("--out", default="benchmark-results.json", help="where to write the JSON results")
+    parser.add_argument("--compare", help="earlier results file to check for regressions")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD, help="allowed slowdown, e.g. 0.2 for 20%%")
+    args = parser.parse_args(argv)
+
+    out_path = os.path.abspath(args.out)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as fh:
+            baseline = json.load(fh)
+    results = run_benchmarks(args.sizes, args.repeat, args.latency, args.soak, render=not args.no_render,
+                              soak_charts_renders=args.soak_charts)
+    with open(out_path, "w") as fh:
+        json.dump(results, fh, indent=2, default=str)
+    print(f"Results written to {out_path}")
+
+    failed = False
+    cold = results["results"]["cold_start"]
+    if not cold["passed"]:
+        print(f"Cold start missed its targets: import {cold['import utils']['median_ms']:.0f} ms "
+              f"(target {COLD_START_TARGET_IMPORT_MS}), first paint {cold['first paint (landing)']['median_ms']:.0f} ms "
+              f"(target {COLD_START_TARGET_PAINT_MS}), heavy modules loaded: {', '.join(cold['heavy_modules_loaded']) or 'none'}")
+        failed = True
+    for name, soak in results.get("soak", {}).items():
+        if not soak["passed"]:
+            print(f"Soak ({name}) failed: RSS grew {soak['rss_growth_mb']:.1f} MB over {soak['runs']} runs")
+            failed = True
+    if baseline is not None:
+        if baseline["meta"].get("model_latency") != results["meta"]["model_latency"]:
+            print("Note: the baseline used a different simulated model latency; AI timings aren't comparable.")
+        regressions = compare(results, baseline, args.threshold)
+        for name, was, now in regressions:
+            print(f"REGRESSION {name}: {was:.2f} ms -> {now:.2f} ms ({now / was - 1:+.0%})")
+        if not regressions:
+            print(f"No regressions beyond {args.threshold:.0%}")
+        failed = failed or bool(regressions)
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
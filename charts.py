@@ -0,0 +1,54 @@
+import io
+from functools import lru_cache
+
+import diagnostics
+
+# --- CHART RENDERING ---
+# Charts are rendered to PNG bytes and memoised on their input data and theme,
+# so a rerun with unchanged totals reuses the image instead of drawing it again.
+# Figures are built with the object API rather than pyplot, so they never enter
+# pyplot's global registry, and each one is cleared as soon as it is encoded.
+# matplotlib is only imported when the first chart is drawn.
+CHART_CACHE_SIZE = 64
+CHART_DPI = 200
+
+THEMES = {
+    "onyx": {
+        "background": "#050505",
+        "colors": ("#6366F1", "#10B981", "#F59E0B", "#EF4444"),
+        "label": "white",
+        "legend": "#E0E0E0",
+    },
+}
+
+def _render_png(fig):
+    buf = io.BytesIO()
+    try:
+        fig.savefig(buf, format="png", dpi=CHART_DPI, bbox_inches="tight", transparent=True)
+    finally:
+        fig.clear()
+    return buf.getvalue()
+
+@lru_cache(maxsize=CHART_CACHE_SIZE)
+def _allocation_png(totals, theme):
+    from matplotlib.figure import Figure
+    style = THEMES[theme]
+    labels = [label for label, _ in totals]
+    values = [value for _, value in totals]
+    fig = Figure(figsize=(5, 3))
+    fig.patch.set_facecolor(style["background"]); fig.patch.set_alpha(0.0)
+    ax = fig.subplots()
+    ax.set_facecolor(style["background"])
+    wedges, texts, autotexts = ax.pie(values, autopct='%1.1f%%', startangle=90, pctdistance=0.85, colors=style["colors"][:len(values)], textprops={'color': style["label"], 'fontsize': 9, 'weight': 'bold'}, wedgeprops={'edgecolor': style["background"], 'linewidth': 3, 'width': 0.6})
+    ax.legend(wedges, labels, loc="center left", bbox_to_anchor=(1, 0, 0.5, 1), frameon=False, labelcolor=style["legend"])
+    return _render_png(fig)
+
+@diagnostics.traced
+def allocation_chart(category_totals, theme="onyx"):
+    # category_totals: a Series (or mapping) of category -> amount. Totals are
+    # rounded to cents for the cache key so float noise doesn't cause misses.
+    totals = tuple((str(k), round(float(v), 2)) for k, v in category_totals.items())
+    return _allocation_png(totals, theme)
+
+def chart_cache_info():
+    return _allocation_png.cache_info()
@@ -0,0 +1,230 @@
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import streamlit as st
+
+# --- DIAGNOSTICS ---
+# Records where a script run spends its time: one span per utils call (with the
+# SQLite statements it ran and the rows it returned) and one per external API
+# call. Each finished run is kept in a short per-page history for the admin
+# panel and appended to a JSON lines log for offline analysis.
+#
+# Spans belong to the run started on the current thread; calls made on other
+# threads (download callbacks, background refreshes) are not recorded unless the
+# work was handed over with bind(). Fragments declared with fragment() start a
+# run of their own when they rerun without the rest of the page. When recording
+# is off, traced calls cost one flag check.
+DIAGNOSTICS_ENABLED = os.environ.get("ONYX_DIAGNOSTICS", "") == "1"
+DIAGNOSTICS_LOG = os.environ.get("ONYX_DIAGNOSTICS_LOG", "diagnostics.jsonl")
+DIAGNOSTICS_HISTORY = 50        # finished runs kept per page
+DIAGNOSTICS_MAX_SPANS = 1000    # spans kept per run; the rest are only counted
+
+_state = {"enabled": DIAGNOSTICS_ENABLED}
+_local = threading.local()
+_history_lock = threading.Lock()
+_history = {}
+_log_lock = threading.Lock()
+
+def enabled():
+    return _state["enabled"]
+
+def set_enabled(on):
+    _state["enabled"] = bool(on)
+
+def is_admin(username):
+    # Admins are listed in the ADMIN_USERS secret (a list or a comma separated
+    # string), falling back to the ONYX_ADMINS environment variable.
+    admins = os.environ.get("ONYX_ADMINS", "")
+    try:
+        admins = st.secrets.get("ADMIN_USERS", admins)
+    except Exception:
+        pass
+    if isinstance(admins, str):
+        admins = admins.split(",")
+    return bool(username) and username in {a.strip() for a in admins}
+
+# --- RUNS & SPANS ---
+def start_run(page, user):
+    if not _state["enabled"]:
+        _local.run = None
+        return
+    _local.run = {"ts": time.time(), "page": page, "user": user, "started": time.perf_counter(),
+                  "queries": 0, "rows": 0, "api_ms": 0.0, "span_count": 0, "spans": [], "lock": threading.Lock()}
+    _local.stack = []
+
+def finish_run():
+    run = getattr(_local, "run", None)
+    if run is None:
+        return None
+    _local.run = None
+    record = {k: v for k, v in run.items() if k not in ("started", "lock")}
+    record["ms"] = (time.perf_counter() - run["started"]) * 1000
+    with _history_lock:
+        _history.setdefault(run["page"], deque(maxlen=DIAGNOSTICS_HISTORY)).append(record)
+    _append_log(record)
+    return record
+
+def bind(fn):
+    # Lets work handed to another thread (a thread pool, say) record into the
+    # caller's run.
+    run = getattr(_local, "run", None)
+    if run is None:
+        return fn
+
+    @functools.wraps(fn)
+    def bound(*args, **kwargs):
+        _local.run, _local.stack = run, []
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _local.run = None
+    return bound
+
+def fragment(fn):
+    # st.fragment that records its own reruns. Run as part of the page it
+    # records into the page's run; rerun on its own it gets a run of its own,
+    # kept under "<name> (fragment)".
+    return st.fragment(_recorded(fn))
+
+def _recorded(fn):
+    @functools.wraps(fn)
+    def recorded(*args, **kwargs):
+        if not _state["enabled"] or getattr(_local, "run", None) is not None:
+            return fn(*args, **kwargs)
+        start_run(f"{fn.__name__} (fragment)", st.session_state.get("username"))
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            finish_run()
+    return recorded
+
+@contextmanager
+def span(name, kind="call"):
+    run = getattr(_local, "run", None) if _state["enabled"] else None
+    if run is None:
+        yield None
+        return
+    stack = _local.stack
+    current = {"name": name, "kind": kind, "depth": len(stack), "queries": 0, "rows": None}
+    stack.append(current)
+    started = time.perf_counter()
+    try:
+        yield current
+    except Exception as e:
+        current["error"] = type(e).__name__
+        raise
+    finally:
+        current["ms"] = (time.perf_counter() - started) * 1000
+        stack.pop()
+        with run["lock"]:
+            run["span_count"] += 1
+            if current["rows"] and current["depth"] == 0:
+                run["rows"] += current["rows"]
+            if kind == "api":
+                run["api_ms"] += current["ms"]
+            if len(run["spans"]) < DIAGNOSTICS_MAX_SPANS:
+                run["spans"].append(current)
+
+def record_query(statement):
+    # sqlite3 trace callback: counts each statement against the innermost span.
+    run = getattr(_local, "run", None)
+    if run is None:
+        return
+    with run["lock"]:
+        run["queries"] += 1
+    stack = getattr(_local, "stack", None)
+    if stack:
+        stack[-1]["queries"] += 1
+
+def _row_count(result):
+    if isinstance(result, tuple) and result:
+        result = result[0]
+    if isinstance(result, list) or hasattr(result, "shape"):
+        return len(result)
+    return None
+
+def traced(fn):
+    name = fn.__name__
+    if inspect.isgeneratorfunction(fn):
+        @functools.wraps(fn)
+        def traced_gen(*args, **kwargs):
+            if not _state["enabled"]:
+                yield from fn(*args, **kwargs)
+                return
+            with span(name):
+                yield from fn(*args, **kwargs)
+        return traced_gen
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        if not _state["enabled"]:
+            return fn(*args, **kwargs)
+        with span(name) as current:
+            result = fn(*args, **kwargs)
+            if current is not None:
+                current["rows"] = _row_count(result)
+            return result
+    return wrapper
+
+# --- SUMMARIES & LOG ---
+def _append_log(record):
+    if not DIAGNOSTICS_LOG:
+        return
+    line = json.dumps(record, default=str)
+    try:
+        with _log_lock, open(DIAGNOSTICS_LOG, "a", encoding="utf-8") as fh:
+            fh.write(line + "\n")
+    except OSError:
+        pass
+
+def _runs(page=None):
+    with _history_lock:
+        if page is not None:
+            return list(_history.get(page, ()))
+        return {p: list(runs) for p, runs in _history.items()}
+
+def page_summary():
+    # One row per nav page over its recent runs.
+    rows = []
+    for page, runs in sorted(_runs().items()):
+        times = sorted(r["ms"] for r in runs)
+        rows.append({"page": page, "runs": len(runs),
+                     "mean_ms": sum(times) / len(times), "p95_ms": times[min(len(times) - 1, int(0.95 * len(times)))],
+                     "max_ms": times[-1],
+                     "queries": sum(r["queries"] for r in runs) / len(runs),
+                     "rows": sum(r["rows"] for r in runs) / len(runs),
+                     "api_ms": sum(r["api_ms"] for r in runs) / len(runs)})
+    return rows
+
+def span_summary(page):
+    # Per call site over a page's recent runs; times include nested calls.
+    totals = {}
+    runs = _runs(page)
+    for run in runs:
+        for s in run["spans"]:
+            t = totals.setdefault(s["name"], {"name": s["name"], "kind": s["kind"], "calls": 0, "total_ms": 0.0,
+                                              "queries": 0, "rows": 0, "errors": 0})
+            t["calls"] += 1
+            t["total_ms"] += s["ms"]
+            t["queries"] += s["queries"]
+            t["rows"] += s["rows"] or 0
+            t["errors"] += "error" in s
+    rows = sorted(totals.values(), key=lambda t: t["total_ms"], reverse=True)
+    for t in rows:
+        t["mean_ms"] = t["total_ms"] / t["calls"]
+        t["per_run_ms"] = t["total_ms"] / len(runs)
+    return rows
+
+def last_run(page):
+    runs = _runs(page)
+    return runs[-1] if runs else None
+
+def reset():
+    with _history_lock:
+        _history.clear()
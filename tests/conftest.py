@@ -0,0 +1,38 @@
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import utils  # noqa: E402
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    # Points utils at a fresh database and tenant directory under tmp_path, with
+    # the schema in place and no state left over from other tests.
+    monkeypatch.setattr(utils, "DB_NAME", str(tmp_path / "expenses.db"))
+    monkeypatch.setattr(utils, "TENANT_DB_DIR", str(tmp_path / "tenants"))
+    utils.ensure_db()
+    yield utils.DB_NAME
+    utils._ledger_cache.clear()
+    utils._settings_cache.clear()
+    for path in list(utils._pools):
+        utils._close_pool(path)
+
+@pytest.fixture
+def slow_load(monkeypatch):
+    # Makes utils.load_ledger_rows block for one user until released, to hold a
+    # cold ledger load open. Returns (user setter, started, release).
+    started, release, slow = threading.Event(), threading.Event(), {}
+    load = utils.load_ledger_rows
+
+    def blocking(conn, user, after_id=0):
+        if user == slow.get("user"):
+            started.set()
+            release.wait(5)
+        return load(conn, user, after_id)
+    monkeypatch.setattr(utils, "load_ledger_rows", blocking)
+    yield slow, started, release
+    release.set()
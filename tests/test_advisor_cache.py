@@ -0,0 +1,61 @@
+from types import SimpleNamespace
+
+import pytest
+
+import utils
+
+class StubChat:
+    def __init__(self, genai, history):
+        self.genai, self.history = genai, history
+
+    def send_message(self, query, stream=False):
+        self.genai.calls += 1
+        return [SimpleNamespace(text=f"reply {self.genai.calls} after {len(self.history)} turns")]
+
+class StubGenAI:
+    def __init__(self):
+        self.calls = 0
+
+    def GenerativeModel(self, name, system_instruction=None):
+        return SimpleNamespace(start_chat=lambda history: StubChat(self, history))
+
+@pytest.fixture
+def advisor(db, monkeypatch):
+    genai = StubGenAI()
+    monkeypatch.setattr(utils, "genai", genai)
+    monkeypatch.setattr(utils, "get_working_model_name", lambda: "models/gemini-test")
+    monkeypatch.setattr(utils, "_schedule_chat_compaction", lambda user: None)
+    utils.clear_advisor_cache()
+    yield genai
+    utils.clear_advisor_cache()
+
+def _ask(query, user, store=None, version="v1"):
+    context = {"version": f"{user}-{version}", "text": f"{user}'s finances"}
+    return "".join(utils.stream_chat_response(query, {} if store is None else store, context=context, user=user))
+
+def test_the_opening_question_is_answered_from_cache(advisor):
+    first = _ask("How am I doing?", "alice")
+    utils.clear_chat_history(user="alice")
+    store = {}
+    assert _ask("how am I doing", "alice", store) == first
+    assert utils.get_advisor_metrics(store)["cached"]
+    assert advisor.calls == 1
+    # The cached reply is still stored as the conversation's answer.
+    assert [m["content"] for m in utils.get_chat_messages(user="alice")] == ["how am I doing", first]
+
+def test_later_turns_are_answered_afresh_and_not_stored(advisor):
+    first = _ask("How am I doing?", "alice")
+    _ask("What about rent?", "alice")
+    store = {}
+    again = _ask("How am I doing?", "alice", store)
+    assert advisor.calls == 3
+    assert again != first and "after 4 turns" in again
+    assert not store["advisor_session"]["cached"]
+    assert utils.get_advisor_cache_stats()["entries"] == 1
+
+def test_changed_finances_or_another_user_miss(advisor):
+    _ask("How am I doing?", "alice")
+    utils.clear_chat_history(user="alice")
+    _ask("How am I doing?", "alice", version="v2")
+    _ask("How am I doing?", "bob")
+    assert advisor.calls == 3
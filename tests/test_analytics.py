@@ -0,0 +1,45 @@
+import threading
+import time
+
+import pytest
+
+import analytics
+import utils
+
+@pytest.fixture
+def ledgers(db):
+    for i in range(50):
+        utils.add_expense_to_db(f"2026-01-{i % 28 + 1:02d}", "Food", 10 + i, f"big {i}", user="big")
+    utils.add_expense_to_db("2026-01-05", "Rent", 700, "rent", user="small")
+    analytics.forget()
+    yield
+    analytics.forget()
+
+def test_one_users_cold_build_does_not_block_another(ledgers, slow_load):
+    slow, started, release = slow_load
+    slow["user"] = "big"
+    worker = threading.Thread(target=analytics.get_snapshot, args=("big", "2026-01-31"))
+    worker.start()
+    assert started.wait(5)
+    began = time.perf_counter()
+    snapshot = analytics.get_snapshot("small", "2026-01-31")
+    assert time.perf_counter() - began < 1.0
+    assert snapshot["rows"] == 1 and snapshot["month_to_date"] == 700
+    release.set()
+    worker.join(5)
+    assert analytics.get_snapshot("big", "2026-01-31")["rows"] == 50
+
+def test_advisor_summary_survives_a_concurrent_forget(ledgers):
+    stop = threading.Event()
+
+    def forgetting():
+        while not stop.is_set():
+            analytics.forget("small")
+    thread = threading.Thread(target=forgetting)
+    thread.start()
+    try:
+        for _ in range(20):
+            assert "700" in analytics.get_advisor_summary("small", "2026-01-31")["text"]
+    finally:
+        stop.set()
+        thread.join(5)
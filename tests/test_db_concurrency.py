@@ -0,0 +1,75 @@
+import sqlite3
+import threading
+import time
+
+import utils
+
+WRITERS = 4
+READERS = 4
+WRITES_PER_WRITER = 50
+
+def test_concurrent_writers_and_readers_never_hit_a_lock(db):
+    errors, reads = [], []
+    stop = threading.Event()
+
+    def writer(n):
+        try:
+            for i in range(WRITES_PER_WRITER):
+                with utils.transaction() as conn:
+                    conn.execute("INSERT INTO settings (user_id, key, value) VALUES (?, ?, ?)", (f"w{n}", f"k{i}", str(i)))
+        except sqlite3.OperationalError as e:
+            errors.append(e)
+
+    def reader():
+        try:
+            while not stop.is_set():
+                with utils.db_connection() as conn:
+                    reads.append(conn.execute("SELECT COUNT(*) FROM settings").fetchone()[0])
+        except sqlite3.OperationalError as e:
+            errors.append(e)
+
+    readers = [threading.Thread(target=reader) for _ in range(READERS)]
+    writers = [threading.Thread(target=writer, args=(n,)) for n in range(WRITERS)]
+    for t in readers + writers:
+        t.start()
+    for t in writers:
+        t.join()
+    stop.set()
+    for t in readers:
+        t.join()
+
+    assert not errors
+    assert reads
+    with utils.db_connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM settings").fetchone()[0] == WRITERS * WRITES_PER_WRITER
+
+def test_readers_make_progress_while_a_write_is_open(db):
+    started, release = threading.Event(), threading.Event()
+
+    def hold_write():
+        with utils.transaction() as conn:
+            conn.execute("INSERT INTO settings (user_id, key, value) VALUES ('w', 'open', '1')")
+            started.set()
+            release.wait(10)
+
+    holder = threading.Thread(target=hold_write)
+    holder.start()
+    try:
+        assert started.wait(5)
+        began = time.monotonic()
+        with utils.db_connection() as conn:
+            # WAL: the reader sees the last committed state without waiting for the writer.
+            assert conn.execute("SELECT COUNT(*) FROM settings WHERE key = 'open'").fetchone()[0] == 0
+        assert time.monotonic() - began < utils.DB_BUSY_TIMEOUT_MS / 1000 / 2
+    finally:
+        release.set()
+        holder.join()
+    with utils.db_connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM settings WHERE key = 'open'").fetchone()[0] == 1
+
+def test_nested_transactions_share_one_connection(db):
+    with utils.transaction() as outer:
+        with utils.transaction() as inner:
+            assert inner is outer
+            inner.execute("INSERT INTO settings (user_id, key, value) VALUES ('n', 'k', 'v')")
+        assert outer.in_transaction
@@ -0,0 +1,38 @@
+import pytest
+
+import diagnostics
+
+@pytest.fixture
+def recording(monkeypatch):
+    monkeypatch.setattr(diagnostics, "DIAGNOSTICS_LOG", "")
+    monkeypatch.setitem(diagnostics._state, "enabled", True)
+    diagnostics.reset()
+    yield
+    diagnostics.reset()
+
+# Outside a Streamlit script st.fragment doesn't call the function, so the
+# recording wrapper is exercised on its own.
+@diagnostics._recorded
+def counter():
+    with diagnostics.span("counter.body"):
+        return 1
+
+def test_a_fragment_in_a_full_run_records_into_the_page(recording):
+    diagnostics.start_run("Page", "alice")
+    counter()
+    diagnostics.finish_run()
+    assert [s["name"] for s in diagnostics.last_run("Page")["spans"]] == ["counter.body"]
+    assert diagnostics.last_run("counter (fragment)") is None
+
+def test_a_fragment_rerun_records_a_run_of_its_own(recording):
+    counter()
+    counter()
+    runs = diagnostics._runs("counter (fragment)")
+    assert len(runs) == 2
+    assert [s["name"] for s in runs[-1]["spans"]] == ["counter.body"]
+    assert diagnostics._runs("Page") == []
+
+def test_fragments_cost_nothing_when_recording_is_off(recording, monkeypatch):
+    monkeypatch.setitem(diagnostics._state, "enabled", False)
+    counter()
+    assert diagnostics._runs() == {}
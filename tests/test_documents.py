@@ -0,0 +1,70 @@
+import io
+import os
+import threading
+
+import pytest
+
+import utils
+
+@pytest.fixture
+def spool(db, tmp_path, monkeypatch):
+    # No background workers: jobs only run when the test processes them.
+    calls = []
+    def extract(upload, *args):
+        calls.append(upload.name)
+        return {"amount": 12.5, "category": "Food", "date": "2026-01-02", "description": upload.name}
+    monkeypatch.setattr(utils, "SPOOL_DIR", str(tmp_path / "spool"))
+    monkeypatch.setattr(utils, "start_document_worker", lambda: None)
+    monkeypatch.setattr(utils, "_extract_with_retries", extract)
+    return calls
+
+def _enqueue(data, name, user):
+    upload = io.BytesIO(data)
+    upload.name = name
+    return utils.enqueue_document(upload, user=user)
+
+def test_a_job_is_only_processed_for_its_owner(spool):
+    job_id = _enqueue(b"receipt-a", "a.jpg", "alice")
+    assert utils.process_document_job(job_id, user="bob") is None
+    assert spool == []
+    assert utils.get_document_job(job_id, user="alice")["status"] == "queued"
+
+    assert utils.process_document_job(job_id, user="alice") == job_id
+    job = utils.get_document_job(job_id, user="alice")
+    assert job["status"] == "done" and job["result"]["amount"] == 12.5
+
+def test_finished_jobs_are_not_run_again(spool):
+    job_id = _enqueue(b"receipt-b", "b.jpg", "alice")
+    assert utils.process_document_job(job_id, user="alice") == job_id
+    assert utils.process_document_job(job_id, user="alice") is None
+    assert spool == ["b.jpg"]
+    assert utils.get_document_job(job_id, user="alice")["attempts"] == 1
+
+def test_queue_worker_path_still_claims_any_users_job(spool):
+    first = _enqueue(b"receipt-c", "c.jpg", "alice")
+    second = _enqueue(b"receipt-d", "d.jpg", "bob")
+    assert [utils.process_document_job(), utils.process_document_job(), utils.process_document_job()] == [first, second, None]
+    assert [job["status"] for job in utils.get_document_jobs(user="bob")] == ["done"]
+
+def test_removing_a_document_while_another_user_queues_it_keeps_the_file(spool, monkeypatch):
+    alice_job = _enqueue(b"same-receipt", "a.jpg", "alice")
+    write, removers = utils._spool_write, []
+
+    def racing(*args):
+        # Alice removes her copy right after bob's file write; it has to wait
+        # for bob's job to be committed, and then the file is no longer orphaned.
+        result = write(*args)
+        remover = threading.Thread(target=utils.remove_document_job, args=(alice_job, "alice"))
+        remover.start()
+        remover.join(0.3)
+        removers.append(remover)
+        return result
+    monkeypatch.setattr(utils, "_spool_write", racing)
+    bob_job = _enqueue(b"same-receipt", "b.jpg", "bob")
+    removers[0].join(5)
+    assert utils.get_document_job(alice_job, user="alice") is None
+    assert utils.read_document(bob_job, user="bob") == b"same-receipt"
+
+    monkeypatch.setattr(utils, "_spool_write", write)
+    assert utils.remove_document_job(bob_job, user="bob")
+    assert not any(files for _, _, files in os.walk(utils.SPOOL_DIR))
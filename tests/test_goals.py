@@ -0,0 +1,37 @@
+from datetime import datetime, timedelta
+
+import pandas as pd
+import pytest
+
+import utils
+
+def _backdate(db, goal_id, days):
+    created = (datetime.now() - timedelta(days=days)).isoformat(timespec="seconds")
+    with utils.transaction(db) as conn:
+        conn.execute("UPDATE goal_contributions SET created = ? WHERE goal_id = ? AND kind = 'deposit'", (created, goal_id))
+
+def test_opening_balance_counts_towards_progress_not_pace(db):
+    utils.add_goal("Car", 2000, user="alice")
+    utils.add_goal("Bike", 500, user="alice")
+    car, bike = utils.get_goals(user="alice")["id"].tolist()
+    # Progress saved under the old schema is carried over by init_db.
+    with utils.transaction(db) as conn:
+        conn.execute("UPDATE goals SET current_amount = 1000 WHERE id = ?", (car,))
+        conn.execute("UPDATE goals SET current_amount = 100 WHERE id = ?", (bike,))
+    utils.init_db(db)
+    assert utils.get_goal_contributions(user="alice")["kind"].tolist() == ["opening", "opening"]
+
+    utils.fund_goals({car: 100}, user="alice")
+    utils.fund_goals({car: 100}, user="alice")
+    _backdate(db, car, 10)
+
+    goals = utils.get_goals(user="alice").set_index("id")
+    assert goals.loc[car, "current_amount"] == 1200
+    projections = utils.get_goal_projections(user="alice")
+    assert projections.loc[car, "rate_per_day"] == pytest.approx(20, rel=1e-3)
+    assert projections.loc[car, "remaining"] == 800
+    assert (projections.loc[car, "projected_date"] - pd.Timestamp.now().normalize()).days in (39, 40)
+    # Only an opening balance: no pace to project from yet.
+    assert goals.loc[bike, "current_amount"] == 100
+    assert pd.isna(projections.loc[bike, "rate_per_day"])
+    assert pd.isna(projections.loc[bike, "projected_date"])
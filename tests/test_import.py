@@ -0,0 +1,33 @@
+import io
+
+import utils
+
+USER = "importer"
+
+def _csv(*lines):
+    return io.BytesIO(("date,category,amount,description\n" + "\n".join(lines) + "\n").encode())
+
+def test_repeated_transaction_in_an_unsorted_file_is_kept(db):
+    rows = ["2026-01-01,Food,3.00,Coffee", "2026-01-02,Transport,2.00,Bus", "2026-01-01,Food,3.00,Coffee"]
+    report = utils.import_expenses(_csv(*rows), user=USER)
+    assert (report["inserted"], report["duplicates"]) == (3, 0)
+    assert utils.count_expenses(user=USER) == 3
+
+def test_reimporting_the_same_file_in_another_order_adds_nothing(db):
+    rows = ["2026-01-01,Food,3.00,Coffee", "2026-01-02,Transport,2.00,Bus", "2026-01-01,Food,3.00,Coffee"]
+    utils.import_expenses(_csv(*rows), user=USER)
+    report = utils.import_expenses(_csv(*reversed(rows)), user=USER)
+    assert (report["inserted"], report["duplicates"]) == (0, 3)
+    assert utils.get_total_spend(user=USER) == 8.0
+
+def test_overlapping_statement_only_adds_new_rows(db):
+    utils.import_expenses(_csv("2026-01-01,Food,3.00,Coffee", "2026-01-01,Food,3.00,Coffee"), user=USER)
+    report = utils.import_expenses(_csv("2026-01-01,Food,3.00,Coffee", "2026-01-01,Food,3.00,Coffee",
+                                        "2026-01-01,Food,3.00,Coffee", "2026-01-03,Food,4.50,Lunch"), user=USER)
+    assert (report["inserted"], report["duplicates"]) == (2, 2)
+
+def test_bad_rows_are_rejected_and_reported(db):
+    report = utils.import_expenses(_csv("not a date,Food,3.00,x", "2026-01-01,Food,abc,y", "2026-01-01,Food,1.00,z"), user=USER)
+    assert report["inserted"] == 1
+    assert report["rejected"] == 2
+    assert [line for line, _ in report["rejects"]] == [2, 3]
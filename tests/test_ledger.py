@@ -0,0 +1,48 @@
+import threading
+import time
+
+import utils
+
+def test_one_users_cold_load_does_not_stall_another(db, slow_load):
+    for i in range(20):
+        utils.add_expense_to_db("2026-01-05", "Food", 5, f"big {i}", user="big")
+    utils.add_expense_to_db("2026-01-05", "Rent", 700, "rent", user="small")
+    utils._ledger_cache.clear()
+    slow, started, release = slow_load
+    slow["user"] = "big"
+    worker = threading.Thread(target=utils.get_expenses_from_db, args=("big",))
+    worker.start()
+    assert started.wait(5)
+    began = time.perf_counter()
+    assert utils.get_total_spend(user="small") == 700
+    assert len(utils.get_expenses_from_db(user="small")) == 1
+    assert time.perf_counter() - began < 1.0
+    release.set()
+    worker.join(5)
+    assert utils.get_total_spend(user="big") == 100
+
+def test_a_users_frame_only_knows_their_own_categories(db):
+    utils.add_expense_to_db("2026-01-05", "Alice-Secret-Clinic", 80, "visit", user="alice")
+    utils.add_expense_to_db("2026-01-06", "Food", 12, "lunch", user="bob")
+    df = utils.get_expenses_from_db(user="bob")
+    assert list(df["category"].cat.categories) == ["Food"]
+    assert df.groupby("category", observed=False)["amount_cents"].sum().to_dict() == {"Food": 1200}
+
+    # Topping up the cached frame with a new category (and an uncategorised row) keeps it categorical.
+    utils.add_expense_to_db("2026-01-07", "Gym", 30, "pass", user="bob")
+    utils.add_expense_to_db("2026-01-08", "", 1, "misc", user="bob")
+    utils._ledger_cache.clear()
+    utils.get_expenses_from_db(user="bob")
+    utils.add_expense_to_db("2026-01-09", "Books", 9, "novel", user="bob")
+    df = utils.get_expenses_from_db(user="bob")
+    assert df["category"].dtype == "category"
+    assert sorted(df["category"].cat.categories) == ["Books", "Food", "Gym"]
+    assert [c if isinstance(c, str) else None for c in df["category"]] == ["Food", "Gym", None, "Books"]
+
+def test_a_moved_tenant_only_takes_the_categories_it_uses(db):
+    utils.add_expense_to_db("2026-01-05", "Alice-Secret-Clinic", 80, "visit", user="alice")
+    utils.add_expense_to_db("2026-01-06", "Food", 12, "lunch", user="bob")
+    path = utils.move_tenant_to_own_db("bob")
+    with utils.db_connection(path) as conn:
+        assert [r[0] for r in conn.execute("SELECT name FROM categories")] == ["Food"]
+    assert utils.get_category_totals(user="bob").to_dict() == {"Food": 12.0}
@@ -0,0 +1,104 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import utils
+
+class StubGenAI:
+    # Stands in for google.generativeai: counts list_models() calls and can be
+    # made to fail or to block until released.
+    def __init__(self, name="models/gemini-test"):
+        self.name = name
+        self.calls = 0
+        self.fail = False
+        self.gate = None
+
+    def list_models(self):
+        self.calls += 1
+        if self.gate is not None:
+            self.gate.wait(5)
+        if self.fail:
+            raise ConnectionError("offline")
+        return [SimpleNamespace(name="models/embedding-001", supported_generation_methods=["embedContent"]),
+                SimpleNamespace(name=self.name, supported_generation_methods=["generateContent"])]
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def stub(monkeypatch):
+    genai, clock = StubGenAI(), Clock()
+    monkeypatch.setattr(utils, "genai", genai)
+    monkeypatch.setattr(utils, "time", SimpleNamespace(monotonic=clock, time=time.time, sleep=time.sleep,
+                                                       perf_counter=time.perf_counter))
+    monkeypatch.setattr(utils, "_model_state", {"name": None, "expires": 0.0, "refreshing": False})
+    genai.clock = clock
+    return genai
+
+def _wait_for_refresh():
+    deadline = time.monotonic() + 5
+    while utils._model_state["refreshing"]:
+        assert time.monotonic() < deadline, "background refresh never finished"
+        time.sleep(0.01)
+
+def test_one_discovery_per_ttl_window(stub):
+    assert utils.get_working_model_name() == "models/gemini-test"
+    for _ in range(20):
+        utils.get_working_model_name()
+    stub.clock.now += utils.MODEL_DISCOVERY_TTL - 1
+    utils.get_working_model_name()
+    assert stub.calls == 1
+
+def test_stale_name_is_served_while_one_background_refresh_runs(stub):
+    utils.get_working_model_name()
+    stub.name, stub.gate = "models/gemini-next", threading.Event()
+    stub.clock.now += utils.MODEL_DISCOVERY_TTL
+    names = [utils.get_working_model_name() for _ in range(10)]
+    assert names == ["models/gemini-test"] * 10
+    stub.gate.set()
+    _wait_for_refresh()
+    assert stub.calls == 2
+    assert utils.get_working_model_name() == "models/gemini-next"
+
+def test_failed_discovery_falls_back_and_retries_after_the_retry_interval(stub):
+    stub.fail = True
+    assert utils.get_working_model_name() == utils.MODEL_FALLBACK
+    stub.clock.now += utils.MODEL_DISCOVERY_RETRY - 1
+    assert utils.get_working_model_name() == utils.MODEL_FALLBACK
+    assert stub.calls == 1
+
+    stub.fail = False
+    stub.clock.now += 1
+    assert utils.get_working_model_name() == utils.MODEL_FALLBACK   # still stale: the refresh runs in the background
+    _wait_for_refresh()
+    assert stub.calls == 2
+    assert utils.get_working_model_name() == "models/gemini-test"
+
+def test_failed_refresh_keeps_the_last_good_name(stub):
+    utils.get_working_model_name()
+    stub.fail = True
+    stub.clock.now += utils.MODEL_DISCOVERY_TTL
+    utils.get_working_model_name()
+    _wait_for_refresh()
+    assert stub.calls == 2
+    assert utils.get_working_model_name() == "models/gemini-test"
+    assert utils._model_state["expires"] == stub.clock.now + utils.MODEL_DISCOVERY_RETRY
+
+def test_concurrent_cold_callers_share_one_discovery(stub):
+    stub.gate = threading.Event()
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(utils.get_working_model_name())) for _ in range(8)]
+    for t in threads:
+        t.start()
+    time.sleep(0.05)
+    stub.gate.set()
+    for t in threads:
+        t.join()
+    assert results == ["models/gemini-test"] * 8
+    assert stub.calls == 1
@@ -0,0 +1,133 @@
+import os
+import sqlite3
+
+import utils
+
+def _seed(user, amounts, category="Food"):
+    for i, amount in enumerate(amounts):
+        utils.add_expense_to_db(f"2026-01-{i % 28 + 1:02d}", category, amount, f"{user} {i}", user=user)
+
+def _rollup_matches(path, user):
+    # The per-(month, category) rollup must agree with a grouped scan of the ledger.
+    grouped = '''SELECT strftime('%Y-%m', day * 86400, 'unixepoch'), COALESCE(category_id, 0), SUM(amount_cents), COUNT(*)
+                 FROM expenses WHERE user_id = ? GROUP BY 1, 2 ORDER BY 1, 2'''
+    with utils.db_connection(path) as conn:
+        ledger = conn.execute(grouped, (user,)).fetchall()
+        rollup = conn.execute('''SELECT month, category_id, total_cents, count FROM expense_rollup
+                                 WHERE user_id = ? AND count > 0 ORDER BY 1, 2''', (user,)).fetchall()
+    return ledger == rollup
+
+def _rows(path, table, user):
+    with utils.db_connection(path) as conn:
+        return conn.execute(f"SELECT COUNT(*) FROM {table} WHERE user_id = ?", (user,)).fetchone()[0]
+
+def test_users_cannot_see_or_fund_each_others_data(db):
+    _seed("alice", [10, 20.5])
+    utils.add_goal("House", 1000, user="alice")
+    goal_id = int(utils.get_goals(user="alice")["id"].iloc[0])
+    utils.set_budget(500, user="alice")
+    utils.set_currency("$", user="alice")
+
+    assert utils.get_expenses_from_db(user="bob").empty
+    assert utils.get_total_spend(user="bob") == 0
+    assert utils.count_expenses(user="bob") == 0
+    assert utils.get_category_totals(user="bob").empty
+    assert utils.get_recent_expenses(user="bob").empty
+    assert utils.get_expenses_page(user="bob")[0].empty
+    assert utils.export_ledger_bytes(user="bob").decode().strip().splitlines() == [",".join(utils.EXPORT_COLUMNS)]
+    assert utils.get_goals(user="bob").empty
+    assert utils.get_budget(user="bob") == 25000.0
+    assert utils.get_currency(user="bob") == "₹"
+
+    assert utils.fund_goals({goal_id: 100}, user="bob") == 0
+    utils.update_goal_progress(goal_id, 100, user="bob")
+    assert utils.get_goals(user="alice")["current_amount"].iloc[0] == 0
+    assert utils.get_goal_contributions(user="bob").empty
+    assert utils.get_total_spend(user="alice") == 30.5
+
+def test_baseline_database_is_claimed_by_the_oldest_account(tmp_path, monkeypatch):
+    path = str(tmp_path / "baseline.db")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE expenses (id INTEGER PRIMARY KEY, date TEXT, category TEXT, amount REAL, description TEXT)")
+    conn.execute("CREATE TABLE users (username TEXT PRIMARY KEY, password TEXT)")
+    conn.execute("CREATE TABLE goals (id INTEGER PRIMARY KEY, name TEXT, target_amount REAL, current_amount REAL)")
+    conn.execute("CREATE TABLE settings (key TEXT PRIMARY KEY, value TEXT)")
+    conn.executemany("INSERT INTO users (username, password) VALUES (?, '')", [("first",), ("second",)])
+    conn.executemany("INSERT INTO expenses (date, category, amount, description) VALUES (?, ?, ?, ?)",
+                     [("2026-01-05", "Food", 12.5, "lunch"), ("2026-02-01", "Rent", 800, "rent"), ("2026-02-03", "Food", 7.25, "snack")])
+    conn.execute("INSERT INTO goals (name, target_amount, current_amount) VALUES ('Car', 5000, 1200)")
+    conn.execute("INSERT INTO settings (key, value) VALUES ('budget', '900')")
+    conn.commit()
+    conn.close()
+
+    monkeypatch.setattr(utils, "DB_NAME", path)
+    monkeypatch.setattr(utils, "TENANT_DB_DIR", str(tmp_path / "tenants"))
+    try:
+        utils.ensure_db()
+        assert utils.count_expenses(user="first") == 3
+        assert utils.get_total_spend(user="first") == 819.75
+        assert utils.get_category_totals(user="first").to_dict() == {"Food": 19.75, "Rent": 800.0}
+        assert utils.get_month_spend("2026-02", user="first") == 807.25
+        assert utils.get_goals(user="first")[["name", "current_amount"]].values.tolist() == [["Car", 1200.0]]
+        assert utils.get_budget(user="first") == 900.0
+        assert _rollup_matches(path, "first")
+
+        assert utils.count_expenses(user="second") == 0
+        assert utils.get_goals(user="second").empty
+        assert utils.get_budget(user="second") == 25000.0
+        with utils.db_connection(path) as conn:
+            assert conn.execute("SELECT COUNT(*) FROM expenses WHERE user_id = ''").fetchone()[0] == 0
+    finally:
+        utils._ledger_cache.clear()
+        utils._settings_cache.clear()
+        for p in list(utils._pools):
+            utils._close_pool(p)
+
+def test_moving_a_tenant_keeps_rows_and_rollups(db):
+    _seed("alice", [10, 20, 30.25])
+    _seed("alice", [5], category="Rent")
+    _seed("bob", [1, 2])
+    utils.add_goal("Trip", 300, user="alice")
+    utils.fund_goals({int(utils.get_goals(user="alice")["id"].iloc[0]): 50}, user="alice")
+    utils.set_budget(750, user="alice")
+    before = utils.get_category_totals(user="alice").to_dict()
+
+    tenant = utils.move_tenant_to_own_db("alice")
+    assert os.path.exists(tenant)
+    for table in ("expenses", "goals", "goal_contributions", "settings"):
+        assert _rows(db, table, "alice") == 0
+    assert utils.get_category_totals(user="alice").to_dict() == before
+    assert utils.get_total_spend(user="alice") == 65.25
+    assert utils.count_expenses(user="alice") == 4
+    assert utils.get_goals(user="alice")["current_amount"].iloc[0] == 50
+    assert utils.get_budget(user="alice") == 750
+    assert _rollup_matches(tenant, "alice")
+    assert utils.get_total_spend(user="bob") == 3
+    assert _rollup_matches(db, "bob")
+
+    # New writes land in the tenant file.
+    utils.add_expense_to_db("2026-03-01", "Gym", 40, "new", user="alice")
+    assert _rows(tenant, "expenses", "alice") == 5
+    assert utils.get_categories(user="alice") == ["Food", "Gym", "Rent"]
+    assert _rollup_matches(tenant, "alice")
+
+def test_renaming_keeps_rows_and_rollups(db):
+    utils.create_user("carol", "pw")
+    utils.create_user("dave", "pw")
+    _seed("carol", [3, 4])
+    _seed("dave", [9])
+    utils.set_budget(100, user="carol")
+    assert utils.update_username("carol", "caroline")
+    assert utils.count_expenses(user="carol") == 0
+    assert utils.get_total_spend(user="caroline") == 7
+    assert utils.get_budget(user="caroline") == 100
+    assert _rollup_matches(db, "caroline")
+    assert not utils.update_username("caroline", "dave")   # taken
+
+    utils.move_tenant_to_own_db("dave")
+    assert utils.update_username("dave", "david")
+    assert not os.path.exists(utils._tenant_file("dave"))
+    assert os.path.exists(utils._tenant_file("david"))
+    assert utils.get_total_spend(user="david") == 9
+    assert utils.get_total_spend(user="dave") == 0
+    assert _rollup_matches(utils._tenant_file("david"), "david")
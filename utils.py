@@ -1,204 +1,2060 @@
-import sqlite3
-import pandas as pd
-from PIL import Image
-import google.generativeai as genai
-import os
-import json
-import re
-import hashlib
-import io
-from datetime import datetime
-import streamlit as st
-
-# --- 1. CONFIGURATION ---
-# 🔒 SECURE LOADING: This looks for the key in Streamlit Secrets
-# It will NO LONGER crash if you upload this to GitHub.
-try:
-    GOOGLE_API_KEY = st.secrets["GOOGLE_API_KEY"]
-except:
-    # This is just a fallback for local testing if you don't have secrets set up
-    # DO NOT paste your actual key here before uploading to GitHub
-    st.error("Google API Key not found. Please add it to Streamlit Secrets.")
-    GOOGLE_API_KEY = "" 
-
-if GOOGLE_API_KEY:
-    genai.configure(api_key=GOOGLE_API_KEY)
-
-DB_NAME = "expenses.db"
-
-# --- 2. DATABASE MANAGEMENT ---
-def init_db():
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute('''CREATE TABLE IF NOT EXISTS expenses
-                 (id INTEGER PRIMARY KEY, date TEXT, category TEXT, amount REAL, description TEXT)''')
-    c.execute('''CREATE TABLE IF NOT EXISTS users
-                 (username TEXT PRIMARY KEY, password TEXT)''')
-    c.execute('''CREATE TABLE IF NOT EXISTS goals
-                 (id INTEGER PRIMARY KEY, name TEXT, target_amount REAL, current_amount REAL)''')
-    c.execute('''CREATE TABLE IF NOT EXISTS settings
-                 (key TEXT PRIMARY KEY, value TEXT)''')
-    conn.commit()
-    conn.close()
-
-# --- USER AUTHENTICATION & SETTINGS ---
-def create_user(username, password):
-    pwd_hash = hashlib.sha256(password.encode()).hexdigest()
-    try:
-        conn = sqlite3.connect(DB_NAME)
-        c = conn.cursor()
-        c.execute("INSERT INTO users (username, password) VALUES (?, ?)", (username, pwd_hash))
-        conn.commit()
-        conn.close()
-        return True
-    except sqlite3.IntegrityError:
-        return False
-
-def verify_user(username, password):
-    pwd_hash = hashlib.sha256(password.encode()).hexdigest()
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute("SELECT * FROM users WHERE username=? AND password=?", (username, pwd_hash))
-    user = c.fetchone()
-    conn.close()
-    return user is not None
-
-def update_credentials(old_username, new_password):
-    pwd_hash = hashlib.sha256(new_password.encode()).hexdigest()
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute("UPDATE users SET password = ? WHERE username = ?", (pwd_hash, old_username))
-    conn.commit()
-    conn.close()
-    return True
-
-def update_username(current_username, new_username):
-    try:
-        conn = sqlite3.connect(DB_NAME)
-        c = conn.cursor()
-        c.execute("UPDATE users SET username = ? WHERE username = ?", (new_username, current_username))
-        conn.commit()
-        conn.close()
-        return True
-    except sqlite3.IntegrityError:
-        return False
-
-# --- SETTINGS (BUDGET & CURRENCY) ---
-def get_setting(key, default_value):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute("SELECT value FROM settings WHERE key=?", (key,))
-    row = c.fetchone()
-    conn.close()
-    return row[0] if row else default_value
-
-def set_setting(key, value):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)", (key, str(value)))
-    conn.commit()
-    conn.close()
-
-def get_budget():
-    return float(get_setting('budget', 25000.0))
-
-def set_budget(amount):
-    set_setting('budget', amount)
-
-def get_currency():
-    return get_setting('currency', '₹')
-
-def set_currency(symbol):
-    set_setting('currency', symbol)
-
-# --- EXPENSE FUNCTIONS ---
-def add_expense_to_db(date, category, amount, description):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute("INSERT INTO expenses (date, category, amount, description) VALUES (?, ?, ?, ?)",
-              (date, category, amount, description))
-    conn.commit()
-    conn.close()
-
-def get_expenses_from_db():
-    conn = sqlite3.connect(DB_NAME)
-    df = pd.read_sql_query("SELECT * FROM expenses", conn)
-    conn.close()
-    return df
-
-# --- GOALS FUNCTIONS ---
-def add_goal(name, target):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute("INSERT INTO goals (name, target_amount, current_amount) VALUES (?, ?, 0)", (name, target))
-    conn.commit()
-    conn.close()
-
-def get_goals():
-    conn = sqlite3.connect(DB_NAME)
-    df = pd.read_sql_query("SELECT * FROM goals", conn)
-    conn.close()
-    return df
-
-def update_goal_progress(goal_id, amount):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute("UPDATE goals SET current_amount = current_amount + ? WHERE id = ?", (amount, goal_id))
-    conn.commit()
-    conn.close()
-
-# --- SHARED AI HELPER ---
-def get_working_model_name():
-    valid_model = "gemini-1.5-flash"
-    try:
-        for m in genai.list_models():
-            if 'generateContent' in m.supported_generation_methods:
-                if 'gemini' in m.name:
-                    valid_model = m.name
-                    break
-    except:
-        pass
-    return valid_model
-
-# --- AI LOGIC ---
-def analyze_image_direct(uploaded_file):
-    try:
-        image = Image.open(uploaded_file)
-        model_name = get_working_model_name()
-        # print(f"Onyx Vision: Using model {model_name}") # Removed print for clean logs
-        model = genai.GenerativeModel(model_name)
-        
-        prompt = """
-        Extract receipt data. Return ONLY JSON.
-        Format: {"date": "YYYY-MM-DD", "amount": 0.00, "category": "Food", "description": "Brief desc"}
-        """
-        response = model.generate_content([prompt, image])
-        
-        if response.text:
-            clean_text = response.text.replace("```json", "").replace("```", "").strip()
-            match = re.search(r"\{.*\}", clean_text, re.DOTALL)
-            if match:
-                return json.loads(match.group(0))
-            return json.loads(clean_text)
-            
-    except Exception as e:
-        return {
-            "date": datetime.today().strftime('%Y-%m-%d'),
-            "amount": 0.0,
-            "category": "Other",
-            "description": "Manual Entry (AI Failed)",
-            "warning": f"AI Error: {str(e)[:50]}..."
-        }
-    return {}
-
-def get_chat_response(query, persona="Generic", enable_guru=True):
-    try:
-        model_name = get_working_model_name()
-        model = genai.GenerativeModel(model_name)
-        chat = model.start_chat(history=[])
-        sys_msg = f"You are {persona}. Keep it short." if enable_guru else "You are a helpful assistant."
-        response = chat.send_message(f"{sys_msg}\nUser: {query}")
-        return response.text
-    except Exception as e:
-        return f"System Error: {str(e)[:100]}. Please try again later."
-
+import sqlite3
+import importlib
+import os
+import json
+import csv
+import gzip
+import re
+import hashlib
+import io
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime, date
+from decimal import Decimal, ROUND_HALF_UP
+import streamlit as st
+
+import diagnostics
+
+# --- LAZY IMPORTS ---
+# pandas, Pillow and the Gemini SDK take most of a cold start, and the landing
+# and sign-in pages need none of them. Each is bound to a placeholder that
+# imports the real module on first attribute access (running `setup` once) and
+# then rebinds the module-level name, so later calls go straight to the module.
+class _LazyModule:
+    def __init__(self, name, module, setup=None):
+        self._name, self._module, self._setup = name, module, setup
+        self._lock = threading.Lock()
+
+    def __getattr__(self, attr):
+        with self._lock:
+            module = importlib.import_module(self._module)
+            if globals().get(self._name) is self:
+                if self._setup:
+                    self._setup(module)
+                globals()[self._name] = module
+        return getattr(module, attr)
+
+def _configure_genai(module):
+    if GOOGLE_API_KEY:
+        module.configure(api_key=GOOGLE_API_KEY)
+
+pd = _LazyModule("pd", "pandas")
+Image = _LazyModule("Image", "PIL.Image")
+ImageOps = _LazyModule("ImageOps", "PIL.ImageOps")
+genai = _LazyModule("genai", "google.generativeai", setup=_configure_genai)   # configured on first AI call
+
+# --- 1. CONFIGURATION ---
+# 🔒 SECURE LOADING: This looks for the key in Streamlit Secrets
+# It will NO LONGER crash if you upload this to GitHub.
+try:
+    GOOGLE_API_KEY = st.secrets["GOOGLE_API_KEY"]
+except:
+    # This is just a fallback for local testing if you don't have secrets set up
+    # DO NOT paste your actual key here before uploading to GitHub
+    st.error("Google API Key not found. Please add it to Streamlit Secrets.")
+    GOOGLE_API_KEY = "" 
+
+DB_NAME = os.environ.get("ONYX_DB_PATH", "expenses.db")   # override to point the app at another ledger
+DB_POOL_SIZE = 8              # max open connections per database file
+DB_BUSY_TIMEOUT_MS = 5000     # how long a writer waits on a lock before failing
+DB_STATEMENT_CACHE = 256      # prepared statements kept per connection
+
+# --- 2. DATABASE MANAGEMENT ---
+# Connections are long-lived and shared through a small pool per database file.
+# WAL lets readers keep going while a writer commits, busy_timeout turns lock
+# contention into a short wait instead of "database is locked", and keeping the
+# connection open means sqlite3's prepared statement cache actually gets reused.
+class _ConnectionPool:
+    def __init__(self, path, size):
+        self.path = path
+        self.size = size
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _open(self):
+        conn = sqlite3.connect(self.path, timeout=DB_BUSY_TIMEOUT_MS / 1000, isolation_level=None,
+                               check_same_thread=False, cached_statements=DB_STATEMENT_CACHE)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                try:
+                    return self._open()
+                except Exception:
+                    self._created -= 1
+                    raise
+        try:
+            return self._idle.get(timeout=DB_BUSY_TIMEOUT_MS / 1000)
+        except queue.Empty:
+            raise sqlite3.OperationalError(f"connection pool for {self.path} exhausted")
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+    @contextmanager
+    def connection(self):
+        # Re-entrant per thread: nested helpers share the connection (and any open transaction).
+        held = getattr(self._local, "conn", None)
+        if held is not None:
+            yield held
+            return
+        conn = self._acquire()
+        conn.set_trace_callback(diagnostics.record_query if diagnostics.enabled() else None)
+        self._local.conn = conn
+        try:
+            yield conn
+        finally:
+            self._local.conn = None
+            if conn.in_transaction:
+                conn.rollback()
+            self._idle.put(conn)
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def _get_pool(path=None):
+    path = path or DB_NAME
+    pool = _pools.get(path)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.setdefault(path, _ConnectionPool(path, DB_POOL_SIZE))
+    return pool
+
+def _close_pool(path):
+    with _pools_lock:
+        pool = _pools.pop(path, None)
+    if pool is not None:
+        pool.close()
+
+@contextmanager
+def db_connection(path=None):
+    with _get_pool(path).connection() as conn:
+        yield conn
+
+@contextmanager
+def transaction(path=None):
+    # BEGIN IMMEDIATE takes the write lock up front so two writers never deadlock
+    # upgrading from a read lock. Nested calls join the outer transaction.
+    with db_connection(path) as conn:
+        if conn.in_transaction:
+            yield conn
+            return
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
+
+_initialized_paths = set()
+
+@diagnostics.traced
+def init_db(path=None):
+    path = path or DB_NAME
+    migrate_expenses_schema(path)
+    with transaction(path) as conn:
+        c = conn.cursor()
+        c.execute(_EXPENSES_DDL.format(table="expenses"))
+        c.execute(_CATEGORIES_DDL)
+        c.execute('''CREATE TABLE IF NOT EXISTS users
+                     (username TEXT PRIMARY KEY, password TEXT)''')
+        c.execute('''CREATE TABLE IF NOT EXISTS goals
+                     (id INTEGER PRIMARY KEY, name TEXT, target_amount REAL, current_amount REAL)''')
+        c.execute('''CREATE TABLE IF NOT EXISTS settings
+                     (user_id TEXT NOT NULL DEFAULT '', key TEXT NOT NULL, value TEXT, PRIMARY KEY (user_id, key))''')
+        c.execute('''CREATE TABLE IF NOT EXISTS meta
+                     (key TEXT PRIMARY KEY, value INTEGER NOT NULL DEFAULT 0)''')
+        c.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('settings_version', 0)")
+        c.execute('''CREATE TABLE IF NOT EXISTS extraction_cache
+                     (key TEXT PRIMARY KEY, result TEXT NOT NULL, created REAL NOT NULL, last_used REAL NOT NULL)''')
+        c.execute("CREATE INDEX IF NOT EXISTS idx_extraction_cache_last_used ON extraction_cache(last_used)")
+        c.execute('''CREATE TABLE IF NOT EXISTS doc_jobs
+                     (id INTEGER PRIMARY KEY, user_id TEXT NOT NULL, digest TEXT NOT NULL, name TEXT, size INTEGER,
+                      status TEXT NOT NULL, result TEXT, error TEXT, attempts INTEGER NOT NULL DEFAULT 0,
+                      created REAL NOT NULL, updated REAL NOT NULL, UNIQUE (user_id, digest))''')
+        c.execute("CREATE INDEX IF NOT EXISTS idx_doc_jobs_status ON doc_jobs(status, id)")
+        c.execute('''CREATE TABLE IF NOT EXISTS chat_messages
+                     (id INTEGER PRIMARY KEY, user_id TEXT NOT NULL, role TEXT NOT NULL, content TEXT NOT NULL, created REAL NOT NULL)''')
+        c.execute("CREATE INDEX IF NOT EXISTS idx_chat_messages_user ON chat_messages(user_id, id)")
+        c.execute('''CREATE TABLE IF NOT EXISTS chat_summaries
+                     (user_id TEXT PRIMARY KEY, summary TEXT NOT NULL, through_id INTEGER NOT NULL)''')
+        _ensure_column(c, "expenses", "import_key", "INTEGER")
+        _migrate_tenancy(c)
+        c.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_expenses_user_import_key ON expenses(user_id, import_key)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_expenses_user_id ON expenses(user_id, id)")
+        # Covering: date-range and per-category counts and sums never touch the table.
+        c.execute("CREATE INDEX IF NOT EXISTS idx_expenses_user_day ON expenses(user_id, day, id, category_id, amount_cents)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_expenses_user_category_day ON expenses(user_id, category_id, day, amount_cents)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_goals_user ON goals(user_id)")
+        c.execute('''CREATE TABLE IF NOT EXISTS goal_contributions
+                     (id INTEGER PRIMARY KEY, user_id TEXT NOT NULL DEFAULT '', goal_id INTEGER NOT NULL,
+                      amount REAL NOT NULL, running_total REAL NOT NULL, created TEXT NOT NULL)''')
+        # kind is 'opening' for balances carried over from goals.current_amount, 'deposit' otherwise.
+        _ensure_column(c, "goal_contributions", "kind", "TEXT NOT NULL DEFAULT 'deposit'")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_goal_contributions_goal ON goal_contributions(goal_id, id, running_total)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_goal_contributions_user ON goal_contributions(user_id, goal_id)")
+        # Progress used to be kept in goals.current_amount: carry it over as an opening contribution.
+        c.execute('''INSERT INTO goal_contributions (user_id, goal_id, amount, running_total, created, kind)
+                     SELECT user_id, id, current_amount, current_amount, ?, 'opening' FROM goals WHERE current_amount != 0''',
+                  (datetime.now().isoformat(timespec="seconds"),))
+        c.execute("UPDATE goals SET current_amount = 0 WHERE current_amount != 0")
+        for event in ("INSERT", "UPDATE", "DELETE"):
+            c.execute(f'''CREATE TRIGGER IF NOT EXISTS trg_settings_version_{event.lower()} AFTER {event} ON settings BEGIN
+                              UPDATE meta SET value = value + 1 WHERE key = 'settings_version';
+                          END''')
+        _init_rollups(c)
+        _claim_legacy_rows(c)
+    _initialized_paths.add(path)
+
+_init_lock = threading.Lock()
+
+def ensure_db(path=None):
+    # Creates or upgrades the schema once per process for each database file;
+    # afterwards a set lookup, so the app can call it on every rerun.
+    path = path or DB_NAME
+    if path not in _initialized_paths:
+        with _init_lock:
+            if path not in _initialized_paths:
+                init_db(path)
+
+def _ensure_column(c, table, column, ddl):
+    if column not in {r[1] for r in c.execute(f"PRAGMA table_info({table})")}:
+        c.execute(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}")
+
+# --- TYPED LEDGER STORAGE ---
+# An expense is stored as integers: `day` counts days since 1970-01-01,
+# `amount_cents` is the amount in minor currency units and `category_id` points
+# into the shared `categories` dictionary (NULL for uncategorised). Date ranges
+# compare integers, sums are exact, and rows and index entries are smaller than
+# in the old TEXT/REAL/TEXT layout. Dates that can't be read (only possible in
+# migrated files) are kept with a NULL day.
+EXPENSES_MIGRATION_BATCH = 20000   # legacy rows copied per write transaction
+
+_EXPENSES_DDL = '''CREATE TABLE IF NOT EXISTS {table}
+                   (id INTEGER PRIMARY KEY, user_id TEXT NOT NULL DEFAULT '', day INTEGER, category_id INTEGER,
+                    amount_cents INTEGER NOT NULL DEFAULT 0, description TEXT, import_key INTEGER)'''
+_CATEGORIES_DDL = "CREATE TABLE IF NOT EXISTS categories (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE)"
+_EPOCH = date(1970, 1, 1)
+
+def _to_day(value):
+    # Epoch day of a date, or of text in ISO or any IMPORT_DATE_FORMATS form; None if it can't be read.
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        value = value.date()
+    if not isinstance(value, date):
+        text = str(value).strip()
+        try:
+            value = date.fromisoformat(text[:10] if _ISO_DATE.match(text) else _parse_import_date(text))
+        except ValueError:
+            return None
+    return (value - _EPOCH).days
+
+def _to_cents(amount):
+    # Half-up on the shortest decimal form of the float, so 0.285 is 29 cents, not 28.
+    return int((Decimal(repr(float(amount))) * 100).quantize(Decimal(1), ROUND_HALF_UP))
+
+def _category_ids(conn, names):
+    # name -> id for the given category names, adding any the dictionary lacks.
+    names = sorted({n for n in names if n})
+    if not names:
+        return {}
+    conn.executemany("INSERT OR IGNORE INTO categories (name) VALUES (?)", [(n,) for n in names])
+    return dict(conn.execute(f"SELECT name, id FROM categories WHERE name IN ({', '.join('?' * len(names))})", names).fetchall())
+
+def _table_columns(conn, table):
+    return {r[1] for r in conn.execute(f"PRAGMA table_info({table})")}
+
+# Files with the old layout are upgraded online. Rows are copied into
+# `expenses_typed` in id order, EXPENSES_MIGRATION_BATCH at a time, each batch in
+# its own short write transaction that also advances a cursor in `meta`: other
+# connections keep reading and writing the old table in between, and a migration
+# that is interrupted picks up from the cursor next time. The last transaction
+# copies whatever arrived meanwhile, recopies any user whose rows were deleted
+# or re-owned after being copied, and swaps the tables; the old table's indexes
+# and triggers go with it. The freed pages stay in the file until a VACUUM.
+def _legacy_select(columns):
+    user = "user_id" if "user_id" in columns else "''"
+    key = "import_key" if "import_key" in columns else "NULL"
+    return user, f"SELECT id, {user}, date, category, amount, description, {key} FROM expenses"
+
+def _copy_legacy_rows(conn, rows, days):
+    # `days` memoises date text -> epoch day across batches; ledgers repeat dates a lot.
+    categories = _category_ids(conn, {r[3] for r in rows})
+    typed = []
+    for row_id, user, text, category, amount, description, key in rows:
+        if text not in days:
+            days[text] = _to_day(text)
+        cents = _to_cents(amount) if isinstance(amount, (int, float)) else 0  # non-numeric text summed as 0 before too
+        typed.append((row_id, user, days[text], categories.get(category), cents, description, key))
+    conn.executemany('''INSERT OR REPLACE INTO expenses_typed (id, user_id, day, category_id, amount_cents, description, import_key)
+                        VALUES (?, ?, ?, ?, ?, ?, ?)''', typed)
+
+def _finish_expenses_migration(conn, columns, days):
+    user, select = _legacy_select(columns)
+    check = "SELECT {}, COUNT(*), SUM(id) FROM {} GROUP BY 1"
+    legacy = {r[0]: r[1:] for r in conn.execute(check.format(user, "expenses"))}
+    typed = {r[0]: r[1:] for r in conn.execute(check.format("user_id", "expenses_typed"))}
+    for owner in set(legacy) | set(typed):
+        if legacy.get(owner) != typed.get(owner):
+            conn.execute("DELETE FROM expenses_typed WHERE user_id = ?", (owner,))
+            cur = conn.execute(f"{select} WHERE {user} = ? ORDER BY id", (owner,))
+            while True:
+                rows = cur.fetchmany(EXPENSES_MIGRATION_BATCH)
+                if not rows:
+                    break
+                _copy_legacy_rows(conn, rows, days)
+    conn.execute("DROP TABLE expenses")
+    conn.execute("ALTER TABLE expenses_typed RENAME TO expenses")
+    conn.execute("DELETE FROM meta WHERE key = 'expenses_migrated_id'")
+
+@diagnostics.traced
+def migrate_expenses_schema(path=None, batch_size=None, on_progress=None):
+    # Moves an old-layout expenses table to the typed one; a no-op once done.
+    # on_progress(rows_copied) is called after every batch. Returns the number
+    # of rows this call copied.
+    path = path or DB_NAME
+    copied, days = 0, {}
+    while True:
+        with transaction(path) as conn:
+            columns = _table_columns(conn, "expenses")
+            if not columns or "amount_cents" in columns:
+                return copied
+            conn.execute(_EXPENSES_DDL.format(table="expenses_typed"))
+            conn.execute(_CATEGORIES_DDL)
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL DEFAULT 0)")
+            conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('expenses_migrated_id', 0)")
+            after = conn.execute("SELECT value FROM meta WHERE key = 'expenses_migrated_id'").fetchone()[0]
+            rows = conn.execute(f"{_legacy_select(columns)[1]} WHERE id > ? ORDER BY id LIMIT ?",
+                                (after, batch_size or EXPENSES_MIGRATION_BATCH)).fetchall()
+            if not rows:
+                _finish_expenses_migration(conn, columns, days)
+                return copied
+            _copy_legacy_rows(conn, rows, days)
+            conn.execute("UPDATE meta SET value = ? WHERE key = 'expenses_migrated_id'", (rows[-1][0],))
+            copied += len(rows)
+        if on_progress:
+            on_progress(copied)
+
+# --- MULTI-TENANCY ---
+# Every ledger table carries the owning username in `user_id`, and every index
+# the app queries through leads with it, so a user's queries only touch their
+# own rows. Databases from before this change are upgraded in place: the owner
+# column is added, settings are rebuilt with a (user_id, key) key, the rollup is
+# rebuilt per user, and the previously shared rows go to the oldest account (or
+# to the first account created, if there is none yet).
+def _migrate_tenancy(c):
+    _ensure_column(c, "expenses", "user_id", "TEXT NOT NULL DEFAULT ''")
+    _ensure_column(c, "goals", "user_id", "TEXT NOT NULL DEFAULT ''")
+    if "user_id" not in {r[1] for r in c.execute("PRAGMA table_info(settings)")}:
+        c.execute("ALTER TABLE settings RENAME TO settings_legacy")
+        c.execute('''CREATE TABLE settings
+                     (user_id TEXT NOT NULL DEFAULT '', key TEXT NOT NULL, value TEXT, PRIMARY KEY (user_id, key))''')
+        c.execute("INSERT INTO settings (user_id, key, value) SELECT '', key, value FROM settings_legacy")
+        c.execute("DROP TABLE settings_legacy")
+    for name in ("idx_expenses_date", "idx_expenses_category", "idx_expenses_category_date", "idx_expenses_import_key"):
+        c.execute(f"DROP INDEX IF EXISTS {name}")
+    if not {"user_id", "total_cents"} <= {r[1] for r in c.execute("PRAGMA table_info(expense_rollup)")}:
+        # Pre-tenancy or pre-cents rollup (or none yet): drop it with its triggers so _init_rollups rebuilds both.
+        c.execute("DROP TABLE IF EXISTS expense_rollup")
+        for name in _ROLLUP_TRIGGERS:
+            c.execute(f"DROP TRIGGER IF EXISTS {name}")
+
+def _claim_legacy_rows(c):
+    owner = c.execute("SELECT username FROM users ORDER BY rowid LIMIT 1").fetchone()
+    if owner is None:
+        return
+    owner = owner[0]
+    moved = c.execute("UPDATE expenses SET user_id = ? WHERE user_id = ''", (owner,)).rowcount
+    c.execute("UPDATE goals SET user_id = ? WHERE user_id = ''", (owner,))
+    c.execute("UPDATE goal_contributions SET user_id = ? WHERE user_id = ''", (owner,))
+    c.execute("UPDATE OR IGNORE settings SET user_id = ? WHERE user_id = ''", (owner,))
+    c.execute("DELETE FROM settings WHERE user_id = ''")
+    if moved:
+        c.execute("DELETE FROM expense_rollup WHERE user_id IN ('', ?)", (owner,))
+        _apply_rollup_delta(c, 0, owner)
+
+def _resolve_user(user=None):
+    # Ledger functions default to the logged-in user of the current Streamlit
+    # session; code running outside a script run (worker threads, download
+    # callables, scripts) must pass `user` explicitly.
+    if user is not None:
+        return user
+    try:
+        user = st.session_state.get("username")
+    except Exception:
+        user = None
+    if not user:
+        raise RuntimeError("No user given and nobody is logged in.")
+    return user
+
+# Heavy tenants can be moved into their own SQLite file under TENANT_DB_DIR;
+# everyone else shares DB_NAME. Accounts, settings versioning and the
+# extraction cache always live in DB_NAME.
+TENANT_DB_DIR = "tenants"
+_TENANT_TABLES = {
+    "expenses": ["id", "user_id", "day", "category_id", "amount_cents", "description", "import_key"],
+    "goals": ["id", "user_id", "name", "target_amount", "current_amount"],
+    "goal_contributions": ["id", "user_id", "goal_id", "amount", "running_total", "created", "kind"],
+    "settings": ["user_id", "key", "value"],
+    "chat_messages": ["id", "user_id", "role", "content", "created"],
+    "chat_summaries": ["user_id", "summary", "through_id"],
+}
+
+def _tenant_file(user):
+    return os.path.join(TENANT_DB_DIR, hashlib.sha256(user.encode()).hexdigest()[:24] + ".db")
+
+def _db_for(user):
+    path = _tenant_file(user)
+    if not os.path.exists(path):
+        return DB_NAME
+    ensure_db(path)
+    return path
+
+def resolve_ledger(user=None):
+    # (user, database path) for modules that keep their own per-user state.
+    user = _resolve_user(user)
+    return user, _db_for(user)
+
+@diagnostics.traced
+def move_tenant_to_own_db(user):
+    # Copies the user's rows into their own file while holding the shared
+    # database's write lock, swaps the file into place (from then on every
+    # process routes the user there) and only then deletes the shared copy.
+    # Safe to re-run: an existing tenant file just has leftovers cleaned up.
+    path = _tenant_file(user)
+    os.makedirs(TENANT_DB_DIR, exist_ok=True)
+    with transaction() as conn:
+        if not os.path.exists(path):
+            staging = path + ".tmp"
+            if os.path.exists(staging):
+                os.remove(staging)
+            init_db(staging)
+            with transaction(staging) as dst:
+                # Only the categories the user's rows use go over, keeping their ids.
+                dst.executemany("INSERT INTO categories (id, name) VALUES (?, ?)",
+                                conn.execute('''SELECT id, name FROM categories WHERE id IN
+                                                (SELECT DISTINCT category_id FROM expenses WHERE user_id = ?)''', (user,)))
+                for table, columns in _TENANT_TABLES.items():
+                    rows = conn.execute(f"SELECT {', '.join(columns)} FROM {table} WHERE user_id = ?", (user,))
+                    dst.executemany(f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})", rows)
+            _close_pool(staging)
+            os.replace(staging, path)
+        for table in _TENANT_TABLES:
+            conn.execute(f"DELETE FROM {table} WHERE user_id = ?", (user,))
+    _forget_user_caches(user)
+    return path
+
+# Per-user, per-month, per-category totals kept in step with `expenses` by
+# triggers, so dashboard aggregates read a few dozen rollup rows instead of the
+# whole ledger. Months are 'YYYY-MM' strings derived from the epoch day, totals
+# are exact integer cents, and category_id 0 stands for uncategorised rows.
+_ROLLUP_TRIGGERS = {
+    "trg_expenses_rollup_insert": '''CREATE TRIGGER trg_expenses_rollup_insert AFTER INSERT ON expenses BEGIN
+            INSERT INTO expense_rollup (user_id, month, category_id, total_cents, count)
+            VALUES (NEW.user_id, COALESCE(strftime('%Y-%m', NEW.day * 86400, 'unixepoch'), ''), COALESCE(NEW.category_id, 0), NEW.amount_cents, 1)
+            ON CONFLICT(user_id, month, category_id) DO UPDATE SET total_cents = total_cents + excluded.total_cents, count = count + 1;
+        END''',
+    "trg_expenses_rollup_delete": '''CREATE TRIGGER trg_expenses_rollup_delete AFTER DELETE ON expenses BEGIN
+            UPDATE expense_rollup SET total_cents = total_cents - OLD.amount_cents, count = count - 1
+            WHERE user_id = OLD.user_id AND month = COALESCE(strftime('%Y-%m', OLD.day * 86400, 'unixepoch'), '')
+              AND category_id = COALESCE(OLD.category_id, 0);
+        END''',
+    "trg_expenses_rollup_update": '''CREATE TRIGGER trg_expenses_rollup_update AFTER UPDATE OF day, category_id, amount_cents ON expenses BEGIN
+            UPDATE expense_rollup SET total_cents = total_cents - OLD.amount_cents, count = count - 1
+            WHERE user_id = OLD.user_id AND month = COALESCE(strftime('%Y-%m', OLD.day * 86400, 'unixepoch'), '')
+              AND category_id = COALESCE(OLD.category_id, 0);
+            INSERT INTO expense_rollup (user_id, month, category_id, total_cents, count)
+            VALUES (NEW.user_id, COALESCE(strftime('%Y-%m', NEW.day * 86400, 'unixepoch'), ''), COALESCE(NEW.category_id, 0), NEW.amount_cents, 1)
+            ON CONFLICT(user_id, month, category_id) DO UPDATE SET total_cents = total_cents + excluded.total_cents, count = count + 1;
+        END''',
+}
+
+def _init_rollups(c):
+    c.execute('''CREATE TABLE IF NOT EXISTS expense_rollup
+                 (user_id TEXT NOT NULL, month TEXT NOT NULL, category_id INTEGER NOT NULL, total_cents INTEGER NOT NULL DEFAULT 0,
+                  count INTEGER NOT NULL DEFAULT 0, PRIMARY KEY (user_id, month, category_id)) WITHOUT ROWID''')
+    existing = {r[0] for r in c.execute("SELECT name FROM sqlite_master WHERE type='trigger'")}
+    if "trg_expenses_rollup_insert" not in existing:
+        # First run against this file (or its ledger was just migrated): backfill from what is already there.
+        c.execute("DELETE FROM expense_rollup")
+        _apply_rollup_delta(c, 0)
+    for name, ddl in _ROLLUP_TRIGGERS.items():
+        if name not in existing:
+            c.execute(ddl)
+
+def _apply_rollup_delta(c, after_id, user=None):
+    # Folds rows with id > after_id (optionally only one user's) into the rollup
+    # in one grouped pass; used by bulk writes that run with the per-row
+    # triggers suspended.
+    query = '''INSERT INTO expense_rollup (user_id, month, category_id, total_cents, count)
+               SELECT user_id, COALESCE(strftime('%Y-%m', day * 86400, 'unixepoch'), ''), COALESCE(category_id, 0), SUM(amount_cents), COUNT(*)
+               FROM expenses WHERE id > ?'''
+    params = [after_id]
+    if user is not None:
+        query += " AND user_id = ?"
+        params.append(user)
+    query += ''' GROUP BY 1, 2, 3
+               ON CONFLICT(user_id, month, category_id) DO UPDATE SET total_cents = total_cents + excluded.total_cents, count = count + excluded.count'''
+    c.execute(query, params)
+
+# --- USER AUTHENTICATION & SETTINGS ---
+@diagnostics.traced
+def create_user(username, password):
+    pwd_hash = hashlib.sha256(password.encode()).hexdigest()
+    try:
+        with transaction() as conn:
+            conn.execute("INSERT INTO users (username, password) VALUES (?, ?)", (username, pwd_hash))
+            _claim_legacy_rows(conn)
+        return True
+    except sqlite3.IntegrityError:
+        return False
+
+@diagnostics.traced
+def verify_user(username, password):
+    pwd_hash = hashlib.sha256(password.encode()).hexdigest()
+    with db_connection() as conn:
+        user = conn.execute("SELECT * FROM users WHERE username=? AND password=?", (username, pwd_hash)).fetchone()
+    return user is not None
+
+@diagnostics.traced
+def update_credentials(old_username, new_password):
+    pwd_hash = hashlib.sha256(new_password.encode()).hexdigest()
+    with transaction() as conn:
+        conn.execute("UPDATE users SET password = ? WHERE username = ?", (pwd_hash, old_username))
+    return True
+
+def _rename_owner(conn, old, new):
+    for table in ("expenses", "goals", "goal_contributions", "settings", "expense_rollup", "doc_jobs",
+                  "chat_messages", "chat_summaries"):
+        conn.execute(f"UPDATE {table} SET user_id = ? WHERE user_id = ?", (new, old))
+
+@diagnostics.traced
+def update_username(current_username, new_username):
+    try:
+        with transaction() as conn:
+            conn.execute("UPDATE users SET username = ? WHERE username = ?", (new_username, current_username))
+            _rename_owner(conn, current_username, new_username)
+    except sqlite3.IntegrityError:
+        return False
+    tenant = _tenant_file(current_username)
+    if os.path.exists(tenant):
+        with transaction(tenant) as conn:
+            _rename_owner(conn, current_username, new_username)
+        _close_pool(tenant)
+        _initialized_paths.discard(tenant)
+        os.replace(tenant, _tenant_file(new_username))
+    _forget_user_caches(current_username)
+    return True
+
+# --- SETTINGS (BUDGET & CURRENCY) ---
+# All settings are loaded with one query into a typed in-process cache shared by
+# every session. Writes go to the database and the cache together. A trigger
+# bumps meta.settings_version on every settings write, and the cache compares
+# against it at most every SETTINGS_RECHECK_SECONDS, so changes made by another
+# process show up quickly while a steady-state rerun issues no settings queries.
+SETTINGS_RECHECK_SECONDS = 2.0
+SETTING_TYPES = {"budget": float, "currency": str}
+
+_settings_lock = threading.Lock()
+_settings_cache = {}
+
+def _coerce_setting(key, value):
+    try:
+        return SETTING_TYPES.get(key, str)(value)
+    except (TypeError, ValueError):
+        return value
+
+def _settings_version(conn):
+    row = conn.execute("SELECT value FROM meta WHERE key = 'settings_version'").fetchone()
+    return row[0] if row else 0
+
+def _settings_entry(user):
+    path = _db_for(user)
+    now = time.monotonic()
+    with _settings_lock:
+        entry = _settings_cache.get((path, user))
+        if entry is not None and now - entry["checked"] < SETTINGS_RECHECK_SECONDS:
+            return entry
+        with db_connection(path) as conn:
+            version = _settings_version(conn)
+            if entry is None or entry["version"] != version:
+                rows = conn.execute("SELECT key, value FROM settings WHERE user_id = ?", (user,)).fetchall()
+                entry = {"values": {k: _coerce_setting(k, v) for k, v in rows}, "version": version}
+        entry["checked"] = now
+        _settings_cache[(path, user)] = entry
+        return entry
+
+@diagnostics.traced
+def get_setting(key, default_value, user=None):
+    return _settings_entry(_resolve_user(user))["values"].get(key, default_value)
+
+@diagnostics.traced
+def set_setting(key, value, user=None):
+    user = _resolve_user(user)
+    path = _db_for(user)
+    with transaction(path) as conn:
+        conn.execute("INSERT OR REPLACE INTO settings (user_id, key, value) VALUES (?, ?, ?)", (user, key, str(value)))
+        version = _settings_version(conn)
+    with _settings_lock:
+        entry = _settings_cache.get((path, user))
+        if entry is not None:
+            entry["values"][key] = _coerce_setting(key, value)
+            # Only skip a reload if no other writer got in since our last look.
+            if entry["version"] == version - 1:
+                entry["version"] = version
+            else:
+                entry["checked"] = 0.0
+
+@diagnostics.traced
+def get_budget(user=None):
+    return float(get_setting('budget', 25000.0, user))
+
+@diagnostics.traced
+def set_budget(amount, user=None):
+    set_setting('budget', amount, user)
+
+@diagnostics.traced
+def get_currency(user=None):
+    return get_setting('currency', '₹', user)
+
+@diagnostics.traced
+def set_currency(symbol, user=None):
+    set_setting('currency', symbol, user)
+
+# --- EXPENSE FUNCTIONS ---
+# The ledger is only ever appended to, so one DataFrame per user is kept in
+# memory for the whole process and topped up with rows above the highest id
+# already seen. A rerun with no new rows costs a single MAX(id) index lookup.
+# The frame holds the stored integers as they are: Int32 epoch days (nullable,
+# for undated legacy rows), int64 cents and the category as a Categorical over
+# the names the user's rows use (the dictionary itself is shared by everyone).
+# Each (path, user) loads under its own lock, so a cold load of one big ledger
+# doesn't stall everyone else's reads; _ledger_lock only guards the dicts.
+LEDGER_COLUMNS = ["id", "day", "category", "amount_cents", "description"]
+
+_ledger_lock = threading.Lock()
+_ledger_cache = {}
+_ledger_user_locks = {}
+
+def _ledger_user_lock(path, user):
+    with _ledger_lock:
+        return _ledger_user_locks.setdefault((path, user), threading.Lock())
+
+def load_ledger_rows(conn, user, after_id=0):
+    # The user's rows with id > after_id, in id order and in the compact dtypes
+    # above. Only the categories these rows use are looked up.
+    rows = conn.execute("SELECT id, day, category_id, amount_cents, description FROM expenses WHERE user_id = ? AND id > ? ORDER BY id",
+                        (user, after_id)).fetchall()
+    ids, days, category_ids, cents, descriptions = zip(*rows) if rows else ((),) * 5
+    used = sorted({cid for cid in category_ids if cid is not None})
+    categories = conn.execute(f"SELECT id, name FROM categories WHERE id IN ({', '.join('?' * len(used))}) ORDER BY id",
+                              used).fetchall() if used else []
+    codes = pd.Index([cid for cid, _ in categories], dtype="int64").get_indexer(pd.array(category_ids, dtype="Int64").fillna(0))
+    return pd.DataFrame({"id": pd.array(ids, dtype="int64"), "day": pd.array(days, dtype="Int32"),
+                         "category": pd.Categorical.from_codes(codes, dtype=pd.CategoricalDtype([name for _, name in categories])),
+                         "amount_cents": pd.array(cents, dtype="int64"), "description": pd.array(descriptions, dtype="str")})
+
+def _refresh_ledger(user):
+    path = _db_for(user)
+    with _ledger_user_lock(path, user):
+        with _ledger_lock:
+            entry = _ledger_cache.get((path, user))
+        with db_connection(path) as conn:
+            max_id = conn.execute("SELECT MAX(id) FROM expenses WHERE user_id = ?", (user,)).fetchone()[0] or 0
+            if entry is not None and max_id < entry["last_id"]:
+                entry = None  # the file was replaced or rows were removed: start over
+            last_id = entry["last_id"] if entry else 0
+            if entry is not None and max_id == last_id:
+                return entry
+            new_rows = load_ledger_rows(conn, user, last_id)
+        if entry is None or entry["df"].empty:
+            entry = {"df": new_rows, "last_id": 0, "total_cents": 0}
+        elif not new_rows.empty:
+            # The new rows may use categories the cached ones don't (or the other way
+            # round); give both the union so concat keeps the column categorical.
+            cached = entry["df"]
+            categories = cached["category"].cat.categories.union(new_rows["category"].cat.categories, sort=False)
+            entry["df"] = pd.concat([cached.assign(category=cached["category"].cat.set_categories(categories)),
+                                     new_rows.assign(category=new_rows["category"].cat.set_categories(categories))], ignore_index=True)
+        if not new_rows.empty:
+            entry["last_id"] = int(new_rows["id"].iloc[-1])
+            entry["total_cents"] += int(new_rows["amount_cents"].sum())
+        with _ledger_lock:
+            _ledger_cache[(path, user)] = entry
+        return entry
+
+def _patch_ledger(path, user, row, previous_id):
+    # Append our own insert directly when nothing else was added for this user
+    # since the cache was filled; otherwise the next refresh picks up the gap
+    # (as it does for a category the cached frame hasn't seen yet).
+    with _ledger_user_lock(path, user):
+        with _ledger_lock:
+            entry = _ledger_cache.get((path, user))
+        if entry is None or entry["df"].empty or previous_id != entry["last_id"]:
+            return
+        df = entry["df"]
+        if row["category"] is not None and row["category"] not in df["category"].cat.categories:
+            return
+        new = pd.DataFrame([row], columns=df.columns).astype(df.dtypes.to_dict())
+        entry["df"] = pd.concat([df, new], ignore_index=True)
+        entry["last_id"] = row["id"]
+        entry["total_cents"] += row["amount_cents"]
+
+def _forget_user_caches(user):
+    with _ledger_lock:
+        for key in [k for k in _ledger_cache if k[1] == user]:
+            del _ledger_cache[key]
+    with _settings_lock:
+        for key in [k for k in _settings_cache if k[1] == user]:
+            del _settings_cache[key]
+
+@diagnostics.traced
+def add_expense_to_db(date, category, amount, description, user=None):
+    # `date` is a date or date text (ISO or any IMPORT_DATE_FORMATS); anything else raises ValueError.
+    user = _resolve_user(user)
+    path = _db_for(user)
+    day = _to_day(date)
+    if day is None:
+        raise ValueError(f"unrecognised date '{str(date)[:20]}'")
+    cents = _to_cents(amount)
+    category = category or None
+    with transaction(path) as conn:
+        previous_id = conn.execute("SELECT MAX(id) FROM expenses WHERE user_id = ?", (user,)).fetchone()[0] or 0
+        category_id = _category_ids(conn, [category]).get(category)
+        cur = conn.execute("INSERT INTO expenses (user_id, day, category_id, amount_cents, description) VALUES (?, ?, ?, ?, ?)",
+                           (user, day, category_id, cents, description))
+        row_id = cur.lastrowid
+    _patch_ledger(path, user, {"id": row_id, "day": day, "category": category, "amount_cents": cents, "description": description}, previous_id)
+
+@diagnostics.traced
+def get_expenses_from_db(user=None):
+    # Shared across sessions: callers must treat the returned frame as read-only.
+    return _refresh_ledger(_resolve_user(user))["df"]
+
+@diagnostics.traced
+def get_total_spend(user=None):
+    return _refresh_ledger(_resolve_user(user))["total_cents"] / 100
+
+# --- AGGREGATES ---
+@diagnostics.traced
+def current_month():
+    return datetime.today().strftime('%Y-%m')
+
+@diagnostics.traced
+def get_month_spend(month=None, user=None):
+    user = _resolve_user(user)
+    with db_connection(_db_for(user)) as conn:
+        row = conn.execute("SELECT SUM(total_cents) FROM expense_rollup WHERE user_id = ? AND month = ?",
+                           (user, month or current_month())).fetchone()
+    return (row[0] or 0) / 100
+
+@diagnostics.traced
+def get_category_totals(month=None, user=None):
+    user = _resolve_user(user)
+    query = '''SELECT COALESCE(c.name, '') AS category, SUM(r.total_cents) / 100.0 AS amount
+               FROM expense_rollup r LEFT JOIN categories c ON c.id = r.category_id WHERE r.user_id = ?'''
+    params = [user]
+    if month:
+        query += " AND r.month = ?"
+        params.append(month)
+    query += " GROUP BY r.category_id HAVING SUM(r.count) > 0 ORDER BY category"
+    with db_connection(_db_for(user)) as conn:
+        df = pd.read_sql_query(query, conn, params=params)
+    return df.set_index("category")["amount"]
+
+# Pages, the dashboard and exports show rows with ISO dates, category names and
+# decimal amounts, converted in SQL from the stored integers.
+DISPLAY_COLUMNS = ["id", "date", "category", "amount", "description"]
+_DISPLAY_SELECT = ("e.id, date(e.day * 86400, 'unixepoch') AS date, c.name AS category, e.amount_cents / 100.0 AS amount, "
+                   "e.description FROM expenses e LEFT JOIN categories c ON c.id = e.category_id")
+
+@diagnostics.traced
+def get_recent_expenses(limit=5, user=None):
+    user = _resolve_user(user)
+    with db_connection(_db_for(user)) as conn:
+        return pd.read_sql_query(f"SELECT {_DISPLAY_SELECT} WHERE e.user_id = ? ORDER BY e.day DESC, e.id DESC LIMIT ?",
+                                 conn, params=(user, limit))
+
+# --- LEDGER PAGINATION ---
+# Ledger views page newest-first on (day, id) with keyset cursors, so each page
+# is an index range scan no matter how deep the user pages. A cursor is the
+# (day, id) of the last row on the previous page; undated rows come last.
+def _ledger_filters(user, start_date=None, end_date=None, category=None):
+    clauses, params = ["e.user_id = ?"], [user]
+    for op, value in ((">=", start_date), ("<=", end_date)):
+        if value:
+            day = _to_day(value)
+            if day is None:
+                raise ValueError(f"unrecognised date '{str(value)[:20]}'")
+            clauses.append(f"e.day {op} ?")
+            params.append(day)
+    if category:
+        clauses.append("e.category_id = (SELECT id FROM categories WHERE name = ?)")
+        params.append(category)
+    return clauses, params
+
+@diagnostics.traced
+def get_expenses_page(cursor=None, page_size=50, start_date=None, end_date=None, category=None, user=None):
+    user = _resolve_user(user)
+    clauses, params = _ledger_filters(user, start_date, end_date, category)
+    if cursor and cursor[0] is None:
+        clauses.append("e.day IS NULL AND e.id < ?")
+        params.append(cursor[1])
+    elif cursor:
+        clauses.append("(e.day, e.id) < (?, ?)")
+        params.extend(cursor)
+    query = f"SELECT {_DISPLAY_SELECT} WHERE " + " AND ".join(clauses)
+    query += " ORDER BY e.day DESC, e.id DESC LIMIT ?"
+    params.append(page_size + 1)
+    with db_connection(_db_for(user)) as conn:
+        df = pd.read_sql_query(query, conn, params=params)
+        if cursor and cursor[0] is not None and len(df) <= page_size:
+            # The (day, id) range skips NULL days, which sort after every dated row: carry on into them.
+            query = f"SELECT {_DISPLAY_SELECT} WHERE " + " AND ".join(clauses[:-1] + ["e.day IS NULL"])
+            undated = pd.read_sql_query(query + " ORDER BY e.id DESC LIMIT ?", conn, params=params[:-3] + [page_size + 1 - len(df)])
+            if not undated.empty:
+                df = undated if df.empty else pd.concat([df, undated], ignore_index=True)
+    next_cursor = None
+    if len(df) > page_size:
+        df = df.iloc[:page_size]
+        last = df.iloc[-1]
+        next_cursor = (_to_day(last["date"]) if isinstance(last["date"], str) else None, int(last["id"]))
+    return df, next_cursor
+
+@diagnostics.traced
+def count_expenses(start_date=None, end_date=None, category=None, user=None):
+    # Without a date range the rollup already holds per-category counts; with one,
+    # the count is answered from the covering (user, category, day) / (user, day) indexes alone.
+    user = _resolve_user(user)
+    if not start_date and not end_date:
+        query, params = "SELECT SUM(count) FROM expense_rollup WHERE user_id = ?", [user]
+        if category:
+            query += " AND category_id = (SELECT id FROM categories WHERE name = ?)"
+            params.append(category)
+    else:
+        clauses, params = _ledger_filters(user, start_date, end_date, category)
+        query = "SELECT COUNT(*) FROM expenses e WHERE " + " AND ".join(clauses)
+    with db_connection(_db_for(user)) as conn:
+        return conn.execute(query, params).fetchone()[0] or 0
+
+@diagnostics.traced
+def get_categories(user=None):
+    user = _resolve_user(user)
+    with db_connection(_db_for(user)) as conn:
+        rows = conn.execute('''SELECT DISTINCT c.name FROM expense_rollup r JOIN categories c ON c.id = r.category_id
+                               WHERE r.user_id = ? AND r.count > 0 ORDER BY c.name''', (user,)).fetchall()
+    return [r[0] for r in rows]
+
+# --- LEDGER EXPORT ---
+# Exports are generated only when asked for and stream rows out of SQLite in
+# EXPORT_CHUNK_ROWS batches straight into the output file, so the ledger never
+# exists in memory as a DataFrame or a single CSV string.
+EXPORT_CHUNK_ROWS = 10000
+EXPORT_FORMATS = {
+    "csv": ("onyx_ledger.csv", "text/csv"),
+    "csv.gz": ("onyx_ledger.csv.gz", "application/gzip"),
+    "parquet": ("onyx_ledger.parquet", "application/vnd.apache.parquet"),
+}
+EXPORT_COLUMNS = DISPLAY_COLUMNS
+
+def _iter_export_rows(user, start_date=None, end_date=None, category=None, chunk_size=None):
+    clauses, params = _ledger_filters(user, start_date, end_date, category)
+    query = f"SELECT {_DISPLAY_SELECT} WHERE " + " AND ".join(clauses)
+    query += " ORDER BY e.day, e.id"
+    with db_connection(_db_for(user)) as conn:
+        cur = conn.execute(query, params)
+        while True:
+            rows = cur.fetchmany(chunk_size or EXPORT_CHUNK_ROWS)
+            if not rows:
+                break
+            yield rows
+
+def _export_csv(out, chunks):
+    text = io.TextIOWrapper(out, encoding="utf-8", newline="")
+    writer = csv.writer(text)
+    writer.writerow(EXPORT_COLUMNS)
+    count = 0
+    for rows in chunks:
+        writer.writerows(rows)
+        count += len(rows)
+    text.flush()
+    text.detach()
+    return count
+
+def _export_parquet(out, chunks):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("Parquet export needs the pyarrow package (pip install pyarrow).")
+    schema = pa.schema([("id", pa.int64()), ("date", pa.string()), ("category", pa.string()),
+                        ("amount", pa.float64()), ("description", pa.string())])
+    count = 0
+    with pq.ParquetWriter(out, schema) as writer:
+        for rows in chunks:
+            columns = list(zip(*rows))
+            writer.write_table(pa.Table.from_arrays([pa.array(col, type=f.type) for col, f in zip(columns, schema)], schema=schema))
+            count += len(rows)
+    return count
+
+@diagnostics.traced
+def export_ledger(out, fmt="csv", start_date=None, end_date=None, category=None, chunk_size=None, user=None):
+    # Writes the (optionally filtered) ledger to a binary file object and returns the row count.
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unsupported export format: {fmt}")
+    chunks = _iter_export_rows(_resolve_user(user), start_date, end_date, category, chunk_size)
+    if fmt == "parquet":
+        return _export_parquet(out, chunks)
+    if fmt == "csv.gz":
+        with gzip.GzipFile(fileobj=out, mode="wb") as gz:
+            return _export_csv(gz, chunks)
+    return _export_csv(out, chunks)
+
+@diagnostics.traced
+def export_ledger_bytes(fmt="csv", start_date=None, end_date=None, category=None, user=None):
+    out = io.BytesIO()
+    export_ledger(out, fmt, start_date, end_date, category, user=user)
+    return out.getvalue()
+
+# --- BULK IMPORT ---
+# Bank statements (CSV or OFX/QFX) and CSV ledgers are streamed row by row,
+# mapped onto date/category/amount/description and written with executemany in
+# IMPORT_BATCH_ROWS batches inside one transaction. Each imported row carries a
+# hashed natural key (the OFX FITID, or date + amount + description + its
+# occurrence number within that day) behind a unique index, so importing the
+# same or an overlapping statement again skips rows that are already there.
+IMPORT_BATCH_ROWS = 50000
+IMPORT_MAX_REJECTS = 1000       # rejected rows kept in the report (all are counted)
+IMPORT_CACHE_KIB = 256 * 1024   # SQLite page cache while importing, for the index inserts
+IMPORT_COLUMN_ALIASES = {
+    "date": ["date", "transaction date", "posted date", "posting date", "value date", "txn date"],
+    "category": ["category", "type", "transaction type"],
+    "amount": ["amount", "debit", "withdrawal", "value", "transaction amount"],
+    "description": ["description", "memo", "narration", "details", "payee", "name", "particulars"],
+}
+IMPORT_DATE_FORMATS = ["%Y-%m-%d", "%d/%m/%Y", "%m/%d/%Y", "%d-%m-%Y", "%Y/%m/%d", "%d.%m.%Y", "%d %b %Y", "%Y%m%d"]
+
+_ISO_DATE = re.compile(r"\d{4}-\d{2}-\d{2}")
+
+def _text_stream(source):
+    if isinstance(source, str):
+        return open(source, encoding="utf-8-sig", newline="")
+    if hasattr(source, "seek"):
+        source.seek(0)
+    return io.TextIOWrapper(source, encoding="utf-8-sig", newline="")
+
+def _close_text_stream(source, stream):
+    # Never close a file object that belongs to the caller, only our wrapper around it.
+    if isinstance(source, str):
+        stream.close()
+    else:
+        stream.detach()
+
+def _detect_import_format(source):
+    name = (source if isinstance(source, str) else getattr(source, "name", "")).lower()
+    return "ofx" if name.endswith((".ofx", ".qfx")) else "csv"
+
+@diagnostics.traced
+def guess_import_mapping(headers):
+    lowered = {h.strip().lower(): h for h in headers}
+    mapping = {}
+    for field, aliases in IMPORT_COLUMN_ALIASES.items():
+        mapping[field] = next((lowered[a] for a in aliases if a in lowered), None)
+    return mapping
+
+@diagnostics.traced
+def read_import_headers(source):
+    stream = _text_stream(source)
+    try:
+        return next(csv.reader(stream), [])
+    finally:
+        _close_text_stream(source, stream)
+
+def _parse_import_date(text, formats=IMPORT_DATE_FORMATS):
+    text = text.strip()
+    if _ISO_DATE.fullmatch(text):
+        return text
+    for fmt in formats:
+        try:
+            return datetime.strptime(text, fmt).strftime('%Y-%m-%d')
+        except ValueError:
+            continue
+    raise ValueError(f"unrecognised date '{text[:20]}'")
+
+def _parse_import_amount(text):
+    try:
+        return float(text)
+    except ValueError:
+        pass
+    text = str(text).strip()
+    negative = text.startswith("(") and text.endswith(")")
+    cleaned = re.sub(r"[^0-9.\-]", "", text)
+    if not cleaned or cleaned in ("-", "."):
+        raise ValueError(f"unrecognised amount '{text[:20]}'")
+    value = float(cleaned)
+    return -value if negative else value
+
+def _iter_csv_records(stream, mapping):
+    reader = csv.reader(stream)
+    headers = next(reader, [])
+    mapping = mapping or guess_import_mapping(headers)
+    for field in ("date", "amount"):
+        if mapping.get(field) not in headers:
+            raise ValueError(f"No column mapped to '{field}'")
+    date_i, amount_i = headers.index(mapping["date"]), headers.index(mapping["amount"])
+    cat_i = headers.index(mapping["category"]) if mapping.get("category") in headers else None
+    desc_i = headers.index(mapping["description"]) if mapping.get("description") in headers else None
+    width = max(i for i in (date_i, amount_i, cat_i, desc_i) if i is not None) + 1
+    for line_no, row in enumerate(reader, 2):
+        if len(row) < width:
+            if row:
+                yield (line_no, "", "", None, "", None)  # short row: rejected by the date check
+            continue
+        yield (line_no, row[date_i], row[amount_i], row[cat_i] if cat_i is not None else None,
+               row[desc_i] if desc_i is not None else "", None)
+
+_OFX_TAG = re.compile(r"<(\w+)>([^<\r\n]*)")
+
+def _iter_ofx_records(stream):
+    # OFX 1.x is SGML (closing tags optional) and 2.x is XML; both put each
+    # transaction inside a <STMTTRN> block, which is all we read.
+    block, line_no, start = None, 0, 0
+    for line_no, line in enumerate(stream, 1):
+        for part in re.split(r"(?=<)", line):
+            tag = part.strip().upper()
+            if tag.startswith("<STMTTRN>"):
+                block, start = {}, line_no
+            elif tag.startswith("</STMTTRN>") and block is not None:
+                yield (start, block.get("DTPOSTED", "")[:8], block.get("TRNAMT", ""), None,
+                       block.get("NAME") or block.get("MEMO") or "", block.get("FITID"))
+                block = None
+            elif block is not None:
+                match = _OFX_TAG.match(part.strip())
+                if match:
+                    block[match.group(1).upper()] = match.group(2).strip()
+
+def _import_key(date, amount, description, occurrence, fitid):
+    # 64-bit integer keys keep the unique index compact; at a million rows the
+    # chance of any collision is around one in 10^7.
+    base = f"ofx|{fitid}" if fitid else f"{date}|{amount:.2f}|{description}|{occurrence}"
+    return int.from_bytes(hashlib.blake2b(base.encode(), digest_size=8).digest(), "big", signed=True)
+
+def _import_rows(conn, user, records, report, default_category, debits_negative, batch_size, on_progress):
+    insert = '''INSERT OR IGNORE INTO expenses (user_id, day, category_id, amount_cents, description, import_key)
+                VALUES (?, ?, ?, ?, ?, ?)'''
+
+    def reject(line_no, reason):
+        report["rejected"] += 1
+        if len(report["rejects"]) < IMPORT_MAX_REJECTS:
+            report["rejects"].append((line_no, reason))
+
+    # Occurrence numbers tell apart genuinely repeated transactions on the same
+    # day. They are counted over the whole file, since not every export is
+    # sorted by date.
+    occurrences = {}
+    days, categories = {}, {}
+    batch = []
+    for line_no, raw_date, raw_amount, category, description, fitid in records:
+        report["read"] += 1
+        try:
+            date = _parse_import_date(raw_date)
+            amount = _parse_import_amount(raw_amount)
+        except ValueError as e:
+            reject(line_no, str(e))
+            continue
+        if date not in days:
+            days[date] = _to_day(date)
+        if days[date] is None:
+            reject(line_no, f"unrecognised date '{date[:20]}'")
+            continue
+        if debits_negative:
+            if amount >= 0:
+                reject(line_no, "credit, not an expense")
+                continue
+            amount = -amount
+        description = (description or "").strip()
+        base = (date, amount, description)
+        occurrence = occurrences.get(base, 0)
+        occurrences[base] = occurrence + 1
+        category = (category or "").strip() or default_category
+        if category not in categories:
+            categories[category] = _category_ids(conn, [category]).get(category)
+        batch.append((user, days[date], categories[category], _to_cents(amount), description,
+                      _import_key(date, amount, description, occurrence, fitid)))
+        if len(batch) >= batch_size:
+            report["inserted"] += conn.executemany(insert, batch).rowcount
+            batch = []
+            if on_progress:
+                on_progress(report["read"], report["inserted"])
+    if batch:
+        report["inserted"] += conn.executemany(insert, batch).rowcount
+
+@diagnostics.traced
+def import_expenses(source, fmt=None, mapping=None, default_category="Other", debits_negative=False,
+                    batch_size=None, on_progress=None, user=None):
+    # `source` is a path, a Streamlit upload or a binary file object. With
+    # debits_negative (always on for OFX) spending is the negative amounts and
+    # credits are rejected; otherwise amounts are taken as they are.
+    # on_progress(rows_read, rows_inserted) is called after every batch.
+    user = _resolve_user(user)
+    fmt = fmt or _detect_import_format(source)
+    report = {"read": 0, "inserted": 0, "duplicates": 0, "rejected": 0, "rejects": []}
+    stream = _text_stream(source)
+    try:
+        records = _iter_ofx_records(stream) if fmt == "ofx" else _iter_csv_records(stream, mapping)
+        with transaction(_db_for(user)) as conn:
+            # The write lock is held throughout, so the rollup triggers can be
+            # suspended and the new rows folded in with one grouped query at the
+            # end. DDL is transactional: a failed import restores the triggers.
+            first_new_id = conn.execute("SELECT MAX(id) FROM expenses").fetchone()[0] or 0
+            cache_size = conn.execute("PRAGMA cache_size").fetchone()[0]
+            conn.execute(f"PRAGMA cache_size={-IMPORT_CACHE_KIB}")
+            try:
+                for name in _ROLLUP_TRIGGERS:
+                    conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+                _import_rows(conn, user, records, report, default_category, debits_negative or fmt == "ofx",
+                             batch_size or IMPORT_BATCH_ROWS, on_progress)
+                _apply_rollup_delta(conn, first_new_id, user)
+                for ddl in _ROLLUP_TRIGGERS.values():
+                    conn.execute(ddl)
+            finally:
+                conn.execute(f"PRAGMA cache_size={cache_size}")
+    finally:
+        _close_text_stream(source, stream)
+    report["duplicates"] = report["read"] - report["inserted"] - report["rejected"]
+    if on_progress:
+        on_progress(report["read"], report["inserted"])
+    return report
+
+# --- GOALS FUNCTIONS ---
+# Goal progress is an append-only log of contributions. Each row also stores the
+# goal's running total after it, so a goal's current amount is its newest row
+# (one probe of the (goal_id, id, running_total) index) and the full history is
+# there for projections. goals.current_amount is no longer written.
+GOAL_PROJECTION_MAX_DAYS = 36500   # paces slower than this get no projected date
+
+@diagnostics.traced
+def add_goal(name, target, user=None):
+    user = _resolve_user(user)
+    with transaction(_db_for(user)) as conn:
+        conn.execute("INSERT INTO goals (user_id, name, target_amount, current_amount) VALUES (?, ?, ?, 0)", (user, name, target))
+
+@diagnostics.traced
+def get_goals(user=None):
+    user = _resolve_user(user)
+    with db_connection(_db_for(user)) as conn:
+        return pd.read_sql_query('''SELECT g.id, g.name, g.target_amount,
+                                           COALESCE((SELECT c.running_total FROM goal_contributions c
+                                                     WHERE c.goal_id = g.id ORDER BY c.id DESC LIMIT 1), 0) AS current_amount
+                                    FROM goals g WHERE g.user_id = ? ORDER BY g.id''', conn, params=(user,))
+
+@diagnostics.traced
+def fund_goals(contributions, user=None):
+    # `contributions` maps goal id -> amount. Everything is applied in one
+    # transaction; zero amounts and goals the user doesn't own are skipped.
+    # Returns the number of contributions recorded.
+    user = _resolve_user(user)
+    items = [(int(goal_id), float(amount)) for goal_id, amount in dict(contributions).items() if amount]
+    if not items:
+        return 0
+    created = datetime.now().isoformat(timespec="seconds")
+    with transaction(_db_for(user)) as conn:
+        owned = {r[0] for r in conn.execute(f"SELECT id FROM goals WHERE user_id = ? AND id IN ({', '.join('?' * len(items))})",
+                                            [user] + [goal_id for goal_id, _ in items])}
+        rows = []
+        for goal_id, amount in items:
+            if goal_id not in owned:
+                continue
+            last = conn.execute("SELECT running_total FROM goal_contributions WHERE goal_id = ? ORDER BY id DESC LIMIT 1",
+                                (goal_id,)).fetchone()
+            rows.append((user, goal_id, amount, (last[0] if last else 0.0) + amount, created))
+        conn.executemany('''INSERT INTO goal_contributions (user_id, goal_id, amount, running_total, created)
+                            VALUES (?, ?, ?, ?, ?)''', rows)
+    return len(rows)
+
+@diagnostics.traced
+def update_goal_progress(goal_id, amount, user=None):
+    # Single-goal form of fund_goals; goals are scoped by owner, so a stale or
+    # forged goal id can't touch another account.
+    fund_goals({goal_id: amount}, user)
+
+@diagnostics.traced
+def get_goal_contributions(goal_id=None, user=None):
+    user = _resolve_user(user)
+    query, params = "SELECT id, goal_id, amount, running_total, created, kind FROM goal_contributions WHERE user_id = ?", [user]
+    if goal_id is not None:
+        query += " AND goal_id = ?"
+        params.append(goal_id)
+    with db_connection(_db_for(user)) as conn:
+        return pd.read_sql_query(query + " ORDER BY id", conn, params=params)
+
+@diagnostics.traced
+def get_goal_projections(user=None):
+    # Projects each goal's completion date from its average daily contribution
+    # since the first one. Opening balances count towards progress but not the
+    # pace: they were saved before any history was recorded. Goals with less
+    # than a day of history, no progress or a negligible pace get NaT. Indexed
+    # by goal id.
+    user = _resolve_user(user)
+    goals = get_goals(user).set_index("id")
+    with db_connection(_db_for(user)) as conn:
+        history = pd.read_sql_query('''SELECT goal_id, MIN(created) AS first_contribution, SUM(amount) AS funded
+                                       FROM goal_contributions WHERE user_id = ? AND kind = 'deposit'
+                                       GROUP BY goal_id''',
+                                    conn, params=(user,)).set_index("goal_id")
+    goals = goals.join(history)
+    now = pd.Timestamp.now()
+    days = (now - pd.to_datetime(goals["first_contribution"])).dt.total_seconds() / 86400
+    rate = goals["funded"] / days.where(days >= 1)
+    remaining = (goals["target_amount"] - goals["current_amount"]).clip(lower=0)
+    eta_days = (remaining / rate.where(rate > 0)).where(lambda d: d <= GOAL_PROJECTION_MAX_DAYS)
+    return pd.DataFrame({"rate_per_day": rate, "remaining": remaining,
+                         "projected_date": (now + pd.to_timedelta(eta_days, unit="D")).dt.normalize()})
+
+# --- SHARED AI HELPER ---
+# Model discovery is a network round trip, so the resolved name is cached per
+# process. Once it goes stale the old name keeps being served while a single
+# background thread refreshes it; failed lookups are cached for a shorter time
+# so an outage doesn't turn every AI action into another failing list_models().
+MODEL_FALLBACK = "gemini-1.5-flash"
+MODEL_DISCOVERY_TTL = 3600      # seconds a discovered model name is trusted
+MODEL_DISCOVERY_RETRY = 60      # seconds before retrying after a failed discovery
+
+_model_lock = threading.Lock()
+_model_resolve_lock = threading.Lock()
+_model_state = {"name": None, "expires": 0.0, "refreshing": False}
+
+def _discover_model_name():
+    with diagnostics.span("gemini.list_models", kind="api"):
+        models = list(genai.list_models())
+    for m in models:
+        if 'generateContent' in m.supported_generation_methods and 'gemini' in m.name:
+            return m.name
+    return None
+
+def _refresh_model_name():
+    try:
+        name = _discover_model_name()
+    except Exception:
+        name = None
+    with _model_lock:
+        if name:
+            _model_state["name"] = name
+        _model_state["expires"] = time.monotonic() + (MODEL_DISCOVERY_TTL if name else MODEL_DISCOVERY_RETRY)
+        _model_state["refreshing"] = False
+        return _model_state["name"] or MODEL_FALLBACK
+
+@diagnostics.traced
+def get_working_model_name():
+    with _model_lock:
+        name, expires = _model_state["name"], _model_state["expires"]
+        if expires and time.monotonic() >= expires and not _model_state["refreshing"]:
+            _model_state["refreshing"] = True
+            threading.Thread(target=_refresh_model_name, name="onyx-model-refresh", daemon=True).start()
+    if expires:
+        return name or MODEL_FALLBACK
+    # Cold start: resolve synchronously, once, while concurrent callers wait for the result.
+    with _model_resolve_lock:
+        if _model_state["expires"]:
+            return _model_state["name"] or MODEL_FALLBACK
+        return _refresh_model_name()
+
+@diagnostics.traced
+def invalidate_model_name():
+    # Mark stale rather than clearing, so callers keep a name while the refresh runs.
+    with _model_lock:
+        if _model_state["expires"]:
+            _model_state["expires"] = min(_model_state["expires"], time.monotonic())
+
+def _is_missing_model_error(e):
+    text = str(e).lower()
+    return "404" in text or "not found" in text
+
+# --- AI CLIENT ---
+# Every generate/chat call goes through one process-wide token bucket, so a
+# burst from many sessions is smoothed out instead of tripping the provider's
+# quota. A quota error pauses all callers for a backoff that doubles on each
+# consecutive quota error and relaxes again as calls succeed. Identical
+# requests already in flight (same image, same prompt) wait for the one call
+# that is running and share its result.
+AI_RATE_PER_MINUTE = 60         # sustained model calls per minute
+AI_BURST = 10                   # calls allowed back to back before the rate applies
+AI_MAX_WAIT = 120.0             # seconds a call may queue for a slot before giving up
+AI_QUOTA_RETRIES = 3            # extra attempts after a quota error
+AI_QUOTA_BACKOFF = 2.0          # first pause after a quota error, in seconds
+AI_QUOTA_BACKOFF_MAX = 60.0
+
+class AIBusyError(RuntimeError):
+    pass
+
+class _RateLimiter:
+    def __init__(self, rate_per_minute, burst):
+        self.rate = rate_per_minute / 60.0
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.backoff = 0.0
+        self.cond = threading.Condition()
+        self.stats = {"calls": 0, "waiting": 0, "waited": 0, "wait_seconds": 0.0, "max_wait_seconds": 0.0,
+                      "quota_errors": 0, "rejected": 0}
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, max_wait):
+        started = time.monotonic()
+        with self.cond:
+            self.stats["waiting"] += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    if now >= self.paused_until and self.tokens >= 1:
+                        self.tokens -= 1
+                        break
+                    delay = max(self.paused_until - now, (1 - self.tokens) / self.rate)
+                    if now + delay - started > max_wait:
+                        self.stats["rejected"] += 1
+                        raise AIBusyError("AI request queue is full")
+                    self.cond.wait(delay)
+            finally:
+                self.stats["waiting"] -= 1
+            waited = time.monotonic() - started
+            self.stats["calls"] += 1
+            if waited > 0.001:
+                self.stats["waited"] += 1
+            self.stats["wait_seconds"] += waited
+            self.stats["max_wait_seconds"] = max(self.stats["max_wait_seconds"], waited)
+
+    def penalize(self):
+        with self.cond:
+            self.stats["quota_errors"] += 1
+            self.backoff = min(AI_QUOTA_BACKOFF_MAX, self.backoff * 2 if self.backoff else AI_QUOTA_BACKOFF)
+            self.paused_until = max(self.paused_until, time.monotonic() + self.backoff)
+
+    def reward(self):
+        with self.cond:
+            self.backoff /= 2
+            if self.backoff < AI_QUOTA_BACKOFF:
+                self.backoff = 0.0
+
+_ai_limiter = _RateLimiter(AI_RATE_PER_MINUTE, AI_BURST)
+_inflight_lock = threading.Lock()
+_inflight = {}
+_coalesce_stats = {"leaders": 0, "followers": 0}
+
+def _is_quota_error(e):
+    text = f"{type(e).__name__} {e}".lower()
+    return any(s in text for s in ("429", "resourceexhausted", "resource exhausted", "quota", "rate limit", "toomanyrequests"))
+
+def _ai_request(call):
+    # Runs one model call under the shared limiter, retrying quota errors.
+    for attempt in range(AI_QUOTA_RETRIES + 1):
+        _ai_limiter.acquire(AI_MAX_WAIT)
+        try:
+            result = call()
+        except Exception as e:
+            if _is_quota_error(e) and attempt < AI_QUOTA_RETRIES:
+                _ai_limiter.penalize()
+                continue
+            if _is_quota_error(e):
+                _ai_limiter.penalize()
+            raise
+        _ai_limiter.reward()
+        return result
+
+def _coalesced(key, call):
+    # Singleflight: the first caller for `key` runs `call`; callers arriving
+    # while it runs wait and get the same result (or exception).
+    with _inflight_lock:
+        flight = _inflight.get(key)
+        leader = flight is None
+        if leader:
+            flight = _inflight[key] = {"done": threading.Event(), "result": None, "error": None}
+            _coalesce_stats["leaders"] += 1
+        else:
+            _coalesce_stats["followers"] += 1
+    if not leader:
+        flight["done"].wait()
+        if flight["error"] is not None:
+            raise flight["error"]
+        return flight["result"]
+    try:
+        flight["result"] = call()
+        return flight["result"]
+    except Exception as e:
+        flight["error"] = e
+        raise
+    finally:
+        with _inflight_lock:
+            del _inflight[key]
+        flight["done"].set()
+
+def get_ai_client_stats():
+    with _ai_limiter.cond:
+        stats = dict(_ai_limiter.stats, tokens=round(_ai_limiter.tokens, 2), backoff_seconds=_ai_limiter.backoff,
+                     paused_for=max(0.0, _ai_limiter.paused_until - time.monotonic()))
+    with _inflight_lock:
+        stats.update(in_flight=len(_inflight), coalesced=_coalesce_stats["followers"])
+    stats["queue_depth"] = stats.pop("waiting")
+    stats["mean_wait_seconds"] = stats["wait_seconds"] / stats["calls"] if stats["calls"] else 0.0
+    return stats
+
+# --- AI LOGIC ---
+RECEIPT_PROMPT = """
+        Extract receipt data. Return ONLY JSON.
+        Format: {"date": "YYYY-MM-DD", "amount": 0.00, "category": "Food", "description": "Brief desc"}
+        """
+
+AI_BATCH_WORKERS = 4        # concurrent model calls for batch extraction
+AI_BATCH_TIMEOUT = 60       # seconds allowed per model call
+AI_BATCH_RETRIES = 2        # extra attempts per receipt after a failure
+AI_BATCH_BACKOFF = 1.0      # base delay in seconds, doubled on each retry
+
+def _fallback_receipt(e):
+    return {
+        "date": datetime.today().strftime('%Y-%m-%d'),
+        "amount": 0.0,
+        "category": "Other",
+        "description": "Manual Entry (AI Failed)",
+        "warning": f"AI Error: {str(e)[:50]}..."
+    }
+
+# --- IMAGE PREPROCESSING ---
+# Phone photos are several megabytes at full resolution, far more than the model
+# needs to read a receipt. Images are decoded at reduced size where the format
+# allows it (JPEG draft mode), turned upright from EXIF, shrunk to IMAGE_MAX_EDGE,
+# optionally made grayscale and re-encoded as JPEG before upload. Oversized or
+# unreadable files are rejected before any decoding work.
+IMAGE_MAX_UPLOAD_BYTES = 15 * 1024 * 1024
+IMAGE_MAX_PIXELS = 40_000_000
+IMAGE_FORMATS = {"JPEG", "MPO", "PNG", "WEBP"}
+IMAGE_MAX_EDGE = 1600
+IMAGE_GRAYSCALE = True
+IMAGE_JPEG_QUALITY = 80
+
+class ImageRejectedError(ValueError):
+    pass
+
+def _preprocess_signature():
+    return f"{IMAGE_MAX_EDGE}:{IMAGE_GRAYSCALE}:{IMAGE_JPEG_QUALITY}"
+
+def _check_upload_size(data):
+    if len(data) > IMAGE_MAX_UPLOAD_BYTES:
+        raise ImageRejectedError(f"File too large ({len(data) / 1024 / 1024:.1f} MB)")
+
+@diagnostics.traced
+def preprocess_image(data):
+    _check_upload_size(data)
+    try:
+        image = Image.open(io.BytesIO(data))
+    except Exception:
+        raise ImageRejectedError("Unsupported or unreadable image")
+    if image.format not in IMAGE_FORMATS:
+        raise ImageRejectedError(f"Unsupported image format: {image.format}")
+    if image.width * image.height > IMAGE_MAX_PIXELS:
+        raise ImageRejectedError(f"Image too large ({image.width}x{image.height})")
+    mode = "L" if IMAGE_GRAYSCALE else "RGB"
+    if image.format in ("JPEG", "MPO"):
+        image.draft(mode, (IMAGE_MAX_EDGE, IMAGE_MAX_EDGE))
+    image = ImageOps.exif_transpose(image)
+    if image.mode in ("RGBA", "LA", "P"):
+        image = image.convert("RGBA")
+        background = Image.new("RGBA", image.size, "white")
+        image = Image.alpha_composite(background, image)
+    image = image.convert(mode)
+    image.thumbnail((IMAGE_MAX_EDGE, IMAGE_MAX_EDGE), Image.Resampling.LANCZOS)
+    out = io.BytesIO()
+    image.save(out, "JPEG", quality=IMAGE_JPEG_QUALITY, optimize=True)
+    return out.getvalue()
+
+def _read_upload(uploaded_file):
+    if hasattr(uploaded_file, "getvalue"):
+        return uploaded_file.getvalue()
+    uploaded_file.seek(0)
+    data = uploaded_file.read()
+    uploaded_file.seek(0)
+    return data
+
+def _extract_receipt(data, model_name, timeout=None):
+    started = time.perf_counter()
+    prepared = preprocess_image(data)
+    _record_preprocess(len(data), len(prepared), time.perf_counter() - started)
+    model = genai.GenerativeModel(model_name)
+    options = {"request_options": {"timeout": timeout}} if timeout else {}
+    with diagnostics.span("gemini.generate_content", kind="api"):
+        response = _ai_request(lambda: model.generate_content([RECEIPT_PROMPT, {"mime_type": "image/jpeg", "data": prepared}], **options))
+
+    if response.text:
+        clean_text = response.text.replace("```json", "").replace("```", "").strip()
+        match = re.search(r"\{.*\}", clean_text, re.DOTALL)
+        if match:
+            return json.loads(match.group(0))
+        return json.loads(clean_text)
+    return {}
+
+# --- EXTRACTION CACHE ---
+# Successful extractions are stored in SQLite keyed by a hash of the image bytes,
+# the prompt and the model, so re-reviewing or re-uploading the same receipt (from
+# any session) never pays for another model call. Least recently used entries
+# beyond EXTRACTION_CACHE_MAX_ENTRIES are evicted on write.
+EXTRACTION_CACHE_MAX_ENTRIES = 2000
+
+_extraction_stats_lock = threading.Lock()
+_extraction_stats = {"hits": 0, "misses": 0, "bytes_in": 0, "bytes_sent": 0, "preprocess_seconds": 0.0}
+
+def _extraction_key(data, model_name):
+    h = hashlib.sha256(data)
+    h.update(RECEIPT_PROMPT.encode())
+    h.update(model_name.encode())
+    h.update(_preprocess_signature().encode())
+    return h.hexdigest()
+
+def _count_extraction(outcome):
+    with _extraction_stats_lock:
+        _extraction_stats[outcome] += 1
+
+def _record_preprocess(bytes_in, bytes_sent, seconds):
+    with _extraction_stats_lock:
+        _extraction_stats["bytes_in"] += bytes_in
+        _extraction_stats["bytes_sent"] += bytes_sent
+        _extraction_stats["preprocess_seconds"] += seconds
+
+def _extraction_cache_get(key):
+    with db_connection() as conn:
+        row = conn.execute("SELECT result FROM extraction_cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        conn.execute("UPDATE extraction_cache SET last_used = ? WHERE key = ?", (time.time(), key))
+    return json.loads(row[0])
+
+def _extraction_cache_put(key, result):
+    now = time.time()
+    with transaction() as conn:
+        conn.execute("INSERT OR REPLACE INTO extraction_cache (key, result, created, last_used) VALUES (?, ?, ?, ?)",
+                     (key, json.dumps(result), now, now))
+        conn.execute('''DELETE FROM extraction_cache WHERE key IN
+                        (SELECT key FROM extraction_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?)''',
+                     (EXTRACTION_CACHE_MAX_ENTRIES,))
+
+def _cached_extract(uploaded_file, timeout=None):
+    data = _read_upload(uploaded_file)
+    _check_upload_size(data)
+    model_name = get_working_model_name()
+    key = _extraction_key(data, model_name)
+    cached = _extraction_cache_get(key)
+    if cached is not None:
+        _count_extraction("hits")
+        return cached
+    _count_extraction("misses")
+    result = _coalesced(("extract", key), lambda: _extract_receipt(data, model_name, timeout=timeout))
+    if result:
+        _extraction_cache_put(key, result)
+    return result
+
+@diagnostics.traced
+def get_extraction_cache_stats():
+    with db_connection() as conn:
+        entries = conn.execute("SELECT COUNT(*) FROM extraction_cache").fetchone()[0]
+    with _extraction_stats_lock:
+        return dict(_extraction_stats, entries=entries, max_entries=EXTRACTION_CACHE_MAX_ENTRIES)
+
+@diagnostics.traced
+def clear_extraction_cache():
+    with transaction() as conn:
+        conn.execute("DELETE FROM extraction_cache")
+
+@diagnostics.traced
+def analyze_image_direct(uploaded_file):
+    try:
+        return _cached_extract(uploaded_file)
+    except Exception as e:
+        if _is_missing_model_error(e):
+            invalidate_model_name()
+        return _fallback_receipt(e)
+
+def _extract_with_retries(uploaded_file, timeout, retries, backoff):
+    for attempt in range(retries + 1):
+        try:
+            return _cached_extract(uploaded_file, timeout=timeout)
+        except ImageRejectedError as e:
+            return _fallback_receipt(e)
+        except Exception as e:
+            error = e
+            if _is_missing_model_error(e):
+                invalidate_model_name()
+            if isinstance(e, AIBusyError) or _is_quota_error(e):
+                break  # the AI client has already waited and retried these
+            if attempt < retries:
+                time.sleep(backoff * 2 ** attempt)
+    return _fallback_receipt(error)
+
+@diagnostics.traced
+def analyze_images_batch(files, max_workers=None, timeout=None, retries=None, backoff=None, on_progress=None):
+    # Results come back in input order; failed items carry the usual "warning"
+    # fallback dict. on_progress(done, total, index, result) runs on the calling
+    # thread as each item finishes, so it is safe to update Streamlit widgets from it.
+    max_workers = max_workers or AI_BATCH_WORKERS
+    timeout = AI_BATCH_TIMEOUT if timeout is None else timeout
+    retries = AI_BATCH_RETRIES if retries is None else retries
+    backoff = AI_BATCH_BACKOFF if backoff is None else backoff
+    results = [None] * len(files)
+    if not files:
+        return results
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="onyx-extract") as pool:
+        futures = {pool.submit(diagnostics.bind(_extract_with_retries), f, timeout, retries, backoff): i for i, f in enumerate(files)}
+        for done, future in enumerate(as_completed(futures), 1):
+            idx = futures[future]
+            results[idx] = future.result()
+            if on_progress:
+                on_progress(done, len(files), idx, results[idx])
+    return results
+
+# --- DOCUMENT SPOOL ---
+# Queued documents are written once to a content-addressed spool directory and
+# tracked in the doc_jobs table, so the queue and finished extractions survive
+# logouts and restarts and sessions only hold job ids. Background worker
+# threads claim queued jobs and run the extraction ahead of time; "Review" then
+# just reads the stored result. The queue lives in the main database whatever
+# tenant file the user's ledger is in.
+SPOOL_DIR = os.environ.get("ONYX_SPOOL_DIR", "spool")
+DOC_WORKERS = 2                 # background extraction threads per process
+DOC_WORKER_POLL = 5.0           # seconds between queue checks when idle
+DOC_JOB_STALE_SECONDS = 600     # a "running" job untouched this long is requeued
+
+_doc_wakeup = threading.Event()
+_doc_workers_lock = threading.Lock()
+_doc_workers = []
+
+def _spool_path(digest):
+    return os.path.join(SPOOL_DIR, digest[:2], digest)
+
+def _spool_write(digest, data):
+    # Called inside the write transaction that references the file, so it
+    # can't interleave with remove_document_job unlinking it.
+    path = _spool_path(digest)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as fh:
+            fh.write(data)
+        os.replace(tmp, path)
+
+def _doc_job_row(row):
+    job = dict(zip(("id", "name", "size", "status", "result", "error", "attempts", "created"), row))
+    job["result"] = json.loads(job["result"]) if job["result"] else None
+    return job
+
+_DOC_JOB_COLUMNS = "id, name, size, status, result, error, attempts, created"
+
+@diagnostics.traced
+def enqueue_document(uploaded_file, user=None):
+    # Returns the job id; re-queuing a document the user already has queued
+    # returns the existing job.
+    user = _resolve_user(user)
+    data = _read_upload(uploaded_file)
+    digest = hashlib.sha256(data).hexdigest()
+    now = time.time()
+    with transaction() as conn:
+        conn.execute('''INSERT OR IGNORE INTO doc_jobs (user_id, digest, name, size, status, attempts, created, updated)
+                        VALUES (?, ?, ?, ?, 'queued', 0, ?, ?)''',
+                     (user, digest, getattr(uploaded_file, "name", digest[:12]), len(data), now, now))
+        job_id = conn.execute("SELECT id FROM doc_jobs WHERE user_id = ? AND digest = ?", (user, digest)).fetchone()[0]
+        _spool_write(digest, data)
+    start_document_worker()
+    _doc_wakeup.set()
+    return job_id
+
+@diagnostics.traced
+def get_document_jobs(user=None):
+    user = _resolve_user(user)
+    with db_connection() as conn:
+        rows = conn.execute(f"SELECT {_DOC_JOB_COLUMNS} FROM doc_jobs WHERE user_id = ? ORDER BY id", (user,)).fetchall()
+    return [_doc_job_row(r) for r in rows]
+
+@diagnostics.traced
+def get_document_job(job_id, user=None):
+    user = _resolve_user(user)
+    with db_connection() as conn:
+        row = conn.execute(f"SELECT {_DOC_JOB_COLUMNS} FROM doc_jobs WHERE id = ? AND user_id = ?", (job_id, user)).fetchone()
+    return _doc_job_row(row) if row else None
+
+@diagnostics.traced
+def read_document(job_id, user=None):
+    user = _resolve_user(user)
+    with db_connection() as conn:
+        row = conn.execute("SELECT digest FROM doc_jobs WHERE id = ? AND user_id = ?", (job_id, user)).fetchone()
+    if row is None:
+        return None
+    with open(_spool_path(row[0]), "rb") as fh:
+        return fh.read()
+
+@diagnostics.traced
+def remove_document_job(job_id, user=None):
+    # Drops the job and, once no job refers to it any more, its spool file. The
+    # file goes while the write lock is still held, so an enqueue of the same
+    # document either sees the row gone and writes the file afresh or runs first.
+    user = _resolve_user(user)
+    with transaction() as conn:
+        row = conn.execute("DELETE FROM doc_jobs WHERE id = ? AND user_id = ? RETURNING digest", (job_id, user)).fetchone()
+        if row is None:
+            return False
+        if conn.execute("SELECT 1 FROM doc_jobs WHERE digest = ? LIMIT 1", (row[0],)).fetchone() is None:
+            try:
+                os.remove(_spool_path(row[0]))
+            except FileNotFoundError:
+                pass
+    return True
+
+@diagnostics.traced
+def retry_document_jobs(user=None):
+    # Puts the user's failed jobs back in the queue; returns how many.
+    user = _resolve_user(user)
+    with transaction() as conn:
+        count = conn.execute('''UPDATE doc_jobs SET status = 'queued', error = NULL, updated = ?
+                                WHERE user_id = ? AND status = 'failed' ''', (time.time(), user)).rowcount
+    if count:
+        start_document_worker()
+        _doc_wakeup.set()
+    return count
+
+def _claim_document_job():
+    now = time.time()
+    with transaction() as conn:
+        return conn.execute('''UPDATE doc_jobs SET status = 'running', attempts = attempts + 1, updated = ?
+                               WHERE id = (SELECT id FROM doc_jobs WHERE status = 'queued'
+                                           OR (status = 'running' AND updated < ?) ORDER BY id LIMIT 1)
+                               RETURNING id, digest, name''', (now, now - DOC_JOB_STALE_SECONDS)).fetchone()
+
+@diagnostics.traced
+def process_document_job(job_id=None, user=None):
+    # Runs one job: the given one of the user's (e.g. "Review" clicked before
+    # the worker got to it) or the next queued one. Returns the job id, or None
+    # if idle or the given job isn't the user's or is already done.
+    if job_id is None:
+        claimed = _claim_document_job()
+    else:
+        user = _resolve_user(user)
+        with transaction() as conn:
+            claimed = conn.execute('''UPDATE doc_jobs SET status = 'running', attempts = attempts + 1, updated = ?
+                                      WHERE id = ? AND user_id = ? AND status != 'done'
+                                      RETURNING id, digest, name''', (time.time(), job_id, user)).fetchone()
+    if claimed is None:
+        return None
+    job_id, digest, name = claimed
+    try:
+        with open(_spool_path(digest), "rb") as fh:
+            upload = io.BytesIO(fh.read())
+        upload.name = name
+        result = _extract_with_retries(upload, AI_BATCH_TIMEOUT, AI_BATCH_RETRIES, AI_BATCH_BACKOFF)
+    except OSError as e:
+        result = _fallback_receipt(e)
+    status = "failed" if "warning" in result else "done"
+    with transaction() as conn:
+        conn.execute("UPDATE doc_jobs SET status = ?, result = ?, error = ?, updated = ? WHERE id = ?",
+                     (status, json.dumps(result), result.get("warning"), time.time(), job_id))
+    return job_id
+
+def _document_worker():
+    while True:
+        _doc_wakeup.clear()
+        try:
+            if process_document_job() is not None:
+                continue
+        except Exception:
+            pass  # e.g. the database is briefly locked; try again after the poll interval
+        _doc_wakeup.wait(DOC_WORKER_POLL)
+
+def start_document_worker():
+    # Idempotent; the threads are daemons and stop with the process.
+    with _doc_workers_lock:
+        if _doc_workers:
+            return
+        for i in range(DOC_WORKERS):
+            thread = threading.Thread(target=_document_worker, name=f"onyx-doc-worker-{i}", daemon=True)
+            thread.start()
+            _doc_workers.append(thread)
+
+@diagnostics.traced
+def get_chat_response(query, persona="Generic", enable_guru=True, context=None):
+    try:
+        model_name = get_working_model_name()
+        sys_msg = _advisor_instruction(persona, enable_guru, context)
+        key = _advisor_cache_key(model_name, sys_msg, query, context)
+        cached = _advisor_cache_get(key)
+        if cached is not None:
+            return cached
+        chat = genai.GenerativeModel(model_name).start_chat(history=[])
+        prompt = f"{sys_msg}\nUser: {query}"
+        with diagnostics.span("gemini.send_message", kind="api"):
+            response = _coalesced(("chat", model_name, prompt), lambda: _ai_request(lambda: chat.send_message(prompt)))
+        _advisor_cache_put(key, response.text)
+        return response.text
+    except Exception as e:
+        if _is_missing_model_error(e):
+            invalidate_model_name()
+        return f"System Error: {str(e)[:100]}. Please try again later."
+
+# --- ADVISOR CHAT HISTORY ---
+# Advisor conversations are stored per user, so they survive logging out and
+# nothing about them grows in the session. Pages read the newest window with a
+# keyset query and fetch older messages only when asked. The model is sent a
+# rolling summary plus the messages after it verbatim; once CHAT_COMPACT_BATCH
+# messages have piled up behind the last CHAT_CONTEXT_MESSAGES they are folded
+# into the summary on a background thread, so the verbatim part never exceeds
+# the two combined.
+CHAT_WINDOW = 20                # messages shown at first and per "load earlier"
+CHAT_CONTEXT_MESSAGES = 12      # recent messages sent to the model as they are
+CHAT_COMPACT_BATCH = 12         # messages folded into the summary at a time
+CHAT_SUMMARY_MAX_CHARS = 2000
+CHAT_SUMMARY_PROMPT = """
+Update the running summary of a conversation between a user and their financial advisor with the new messages below.
+Keep figures, decisions, goals and open questions; drop small talk. Reply with the summary only, under 250 words.
+"""
+
+_compacting_lock = threading.Lock()
+_compacting = set()
+
+@diagnostics.traced
+def add_chat_message(role, content, user=None):
+    user = _resolve_user(user)
+    with transaction(_db_for(user)) as conn:
+        return conn.execute("INSERT INTO chat_messages (user_id, role, content, created) VALUES (?, ?, ?, ?)",
+                            (user, role, content, time.time())).lastrowid
+
+@diagnostics.traced
+def get_chat_messages(before_id=None, limit=CHAT_WINDOW, user=None):
+    # The newest `limit` messages older than `before_id`, oldest first.
+    user = _resolve_user(user)
+    query, params = "SELECT id, role, content FROM chat_messages WHERE user_id = ?", [user]
+    if before_id is not None:
+        query += " AND id < ?"
+        params.append(before_id)
+    with db_connection(_db_for(user)) as conn:
+        rows = conn.execute(query + " ORDER BY id DESC LIMIT ?", params + [limit]).fetchall()
+    return [{"id": r[0], "role": r[1], "content": r[2]} for r in reversed(rows)]
+
+@diagnostics.traced
+def clear_chat_history(user=None):
+    user = _resolve_user(user)
+    with transaction(_db_for(user)) as conn:
+        conn.execute("DELETE FROM chat_messages WHERE user_id = ?", (user,))
+        conn.execute("DELETE FROM chat_summaries WHERE user_id = ?", (user,))
+
+def _chat_context(user):
+    # (rolling summary or None, the recent messages as model history).
+    with db_connection(_db_for(user)) as conn:
+        row = conn.execute("SELECT summary, through_id FROM chat_summaries WHERE user_id = ?", (user,)).fetchone()
+        summary, through_id = row if row else (None, 0)
+        rows = conn.execute('''SELECT role, content FROM chat_messages WHERE user_id = ? AND id > ?
+                               ORDER BY id DESC LIMIT ?''', (user, through_id, CHAT_CONTEXT_MESSAGES + CHAT_COMPACT_BATCH)).fetchall()
+    history = []
+    for role, content in reversed(rows):
+        role = "model" if role == "assistant" else "user"
+        if history and history[-1]["role"] == role:
+            history[-1]["parts"].append(content)   # a question whose reply failed
+        else:
+            history.append({"role": role, "parts": [content]})
+    if history and history[0]["role"] == "model":
+        history.pop(0)   # chat history has to open with a user turn
+    return summary, history
+
+def _summarize_chat(previous, messages):
+    turns = "\n".join(f"{role}: {content}" for role, content in messages)
+    try:
+        model = genai.GenerativeModel(get_working_model_name())
+        prompt = f"{CHAT_SUMMARY_PROMPT}\nCurrent summary:\n{previous or '(none)'}\n\nNew messages:\n{turns}"
+        with diagnostics.span("gemini.generate_content", kind="api"):
+            summary = _ai_request(lambda: model.generate_content(prompt)).text.strip()
+    except Exception:
+        # Without the model, keep the tail of a plain transcript instead.
+        summary = f"{previous}\n{turns}" if previous else turns
+        return summary[-CHAT_SUMMARY_MAX_CHARS:]
+    return summary[:CHAT_SUMMARY_MAX_CHARS]
+
+@diagnostics.traced
+def compact_chat_history(user=None):
+    # Folds the messages behind the verbatim window into the rolling summary
+    # once there are at least CHAT_COMPACT_BATCH of them. Returns how many
+    # were folded.
+    user = _resolve_user(user)
+    path = _db_for(user)
+    with db_connection(path) as conn:
+        row = conn.execute("SELECT summary, through_id FROM chat_summaries WHERE user_id = ?", (user,)).fetchone()
+        previous, through_id = row if row else (None, 0)
+        rows = conn.execute("SELECT id, role, content FROM chat_messages WHERE user_id = ? AND id > ? ORDER BY id",
+                            (user, through_id)).fetchall()
+    folded = rows[:-CHAT_CONTEXT_MESSAGES]
+    if len(folded) < CHAT_COMPACT_BATCH:
+        return 0
+    summary = _summarize_chat(previous, [(role, content) for _, role, content in folded])
+    with transaction(path) as conn:
+        conn.execute('''INSERT INTO chat_summaries (user_id, summary, through_id) VALUES (?, ?, ?)
+                        ON CONFLICT (user_id) DO UPDATE SET summary = excluded.summary, through_id = excluded.through_id
+                        WHERE excluded.through_id > chat_summaries.through_id''', (user, summary, folded[-1][0]))
+    return len(folded)
+
+def _schedule_chat_compaction(user):
+    with _compacting_lock:
+        if user in _compacting:
+            return
+        _compacting.add(user)
+
+    def run():
+        try:
+            compact_chat_history(user)
+        except Exception:
+            pass   # tried again after the next reply
+        finally:
+            with _compacting_lock:
+                _compacting.discard(user)
+    threading.Thread(target=run, name="onyx-chat-compact", daemon=True).start()
+
+# --- AI ADVISOR SESSIONS ---
+# The model lives in the caller's per-user store (the Streamlit session state)
+# and is only rebuilt when the persona, the guru switch, the resolved model, the
+# financial summary or the conversation summary changes. Each question starts
+# a chat from the stored history, so the session holds nothing that grows.
+#
+# Replies are cached process-wide on (model, persona, normalised question,
+# summary version), so asking the same thing again about unchanged finances
+# returns without a model call. A streamed reply depends on the conversation
+# before it, so only the opening question of a conversation (no stored history
+# or rolling summary yet) is looked up and stored.
+ADVISOR_CACHE_SIZE = 512
+ADVISOR_CACHE_TTL = 900       # seconds a cached reply is served
+
+_advisor_cache_lock = threading.Lock()
+_advisor_cache = OrderedDict()
+_advisor_cache_stats = {"hits": 0, "misses": 0}
+
+def _advisor_instruction(persona, enable_guru, context=None, chat_summary=None):
+    instruction = f"You are {persona}. Keep it short." if enable_guru else "You are a helpful assistant."
+    if context:
+        instruction += "\nAnswer using the user's finances below; don't invent figures that aren't there.\n" + context["text"]
+    if chat_summary:
+        instruction += "\nSummary of the conversation so far:\n" + chat_summary
+    return instruction
+
+def _normalize_query(query):
+    return re.sub(r"\s+", " ", query).strip().rstrip("?!. ").lower()
+
+def _advisor_cache_key(model_name, instruction, query, context):
+    # The summary text is already covered by its version.
+    return model_name, instruction.split("\n", 1)[0], _normalize_query(query), context and context["version"]
+
+def _advisor_cache_get(key):
+    with _advisor_cache_lock:
+        entry = _advisor_cache.get(key)
+        if entry is None or time.monotonic() - entry[0] > ADVISOR_CACHE_TTL:
+            _advisor_cache.pop(key, None)
+            _advisor_cache_stats["misses"] += 1
+            return None
+        _advisor_cache.move_to_end(key)
+        _advisor_cache_stats["hits"] += 1
+        return entry[1]
+
+def _advisor_cache_put(key, text):
+    with _advisor_cache_lock:
+        _advisor_cache[key] = (time.monotonic(), text)
+        _advisor_cache.move_to_end(key)
+        while len(_advisor_cache) > ADVISOR_CACHE_SIZE:
+            _advisor_cache.popitem(last=False)
+
+@diagnostics.traced
+def get_advisor_cache_stats():
+    with _advisor_cache_lock:
+        return dict(_advisor_cache_stats, entries=len(_advisor_cache))
+
+@diagnostics.traced
+def clear_advisor_cache():
+    with _advisor_cache_lock:
+        _advisor_cache.clear()
+
+@diagnostics.traced
+def get_advisor_session(store, persona="Generic", enable_guru=True, context=None, chat_summary=None):
+    instruction = _advisor_instruction(persona, enable_guru, context, chat_summary)
+    model_name = get_working_model_name()
+    session = store.get("advisor_session")
+    if session is None or session["instruction"] != instruction or session["model"] != model_name:
+        session = {"instruction": instruction, "model": model_name,
+                   "client": genai.GenerativeModel(model_name, system_instruction=instruction),
+                   "ttft": None, "elapsed": None, "cached": False}
+        store["advisor_session"] = session
+    return session
+
+@diagnostics.traced
+def stream_chat_response(query, store, persona="Generic", enable_guru=True, context=None, user=None):
+    # Yields reply text as it arrives and records time-to-first-token and total
+    # reply time on the session. `context` is the advisor summary from
+    # analytics.get_advisor_summary(), or None to answer without one. The
+    # question and a successful reply are added to the user's chat history.
+    started = time.perf_counter()
+    store.pop("advisor_error", None)
+    try:
+        user = _resolve_user(user)
+        chat_summary, history = _chat_context(user)
+        session = get_advisor_session(store, persona, enable_guru, context, chat_summary)
+        add_chat_message("user", query, user)
+        opening = chat_summary is None and not history
+        key = _advisor_cache_key(session["model"], session["instruction"], query, context) if opening else None
+        reply = _advisor_cache_get(key) if key else None
+        session["cached"] = reply is not None
+        if reply is not None:
+            session["ttft"] = session["elapsed"] = time.perf_counter() - started
+            yield reply
+        else:
+            session["ttft"] = None
+            chat = session["client"].start_chat(history=history)
+            parts = []
+            with diagnostics.span("gemini.send_message", kind="api") as api:
+                for chunk in _ai_request(lambda: chat.send_message(query, stream=True)):
+                    if session["ttft"] is None:
+                        session["ttft"] = time.perf_counter() - started
+                        if api is not None:
+                            api["ttft_ms"] = session["ttft"] * 1000
+                    parts.append(chunk.text)
+                    yield chunk.text
+            session["elapsed"] = time.perf_counter() - started
+            reply = "".join(parts)
+            if key:
+                _advisor_cache_put(key, reply)
+        add_chat_message("assistant", reply, user)
+        _schedule_chat_compaction(user)
+    except Exception as e:
+        if _is_missing_model_error(e):
+            invalidate_model_name()
+        # Failed replies aren't stored; the page shows the error until the next question.
+        store["advisor_error"] = f"System Error: {str(e)[:100]}. Please try again later."
+        yield store["advisor_error"]
+
+@diagnostics.traced
+def get_advisor_metrics(store):
+    session = store.get("advisor_session")
+    if session is None:
+        return {"error": store.get("advisor_error")}
+    return {"ttft": session["ttft"], "elapsed": session["elapsed"], "cached": session["cached"],
+            "error": store.get("advisor_error")}